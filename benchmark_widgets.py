@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Benchmark della libreria eink_widgets
+
+Misura i tempi dei vari percorsi di rendering senza bisogno del display.
+
+Uso:
+    python3 benchmark_widgets.py            # tutti i benchmark
+    python3 benchmark_widgets.py gray       # solo quello indicato
+    python3 benchmark_widgets.py transport
+    python3 benchmark_widgets.py primitives
+    python3 benchmark_widgets.py charts
+    python3 benchmark_widgets.py parallel
+    python3 benchmark_widgets.py fonts      # usa pic/Font.ttc o il font in $BENCH_FONT
+    python3 benchmark_widgets.py steady
+    python3 benchmark_widgets.py refresh
+    python3 benchmark_widgets.py raster
+    python3 benchmark_widgets.py marquee
+    python3 benchmark_widgets.py table
+    python3 benchmark_widgets.py clock
+    python3 benchmark_widgets.py animation
+"""
+
+import math
+import os
+import sys
+import tempfile
+import time
+import zlib
+import eink_widgets
+from eink_widgets import *
+from eink_transport import FrameEncoder, FrameDecoder
+
+
+def _timeit(fn, repeat=50):
+    """Tempo medio di una chiamata in millisecondi (dopo un giro di riscaldamento)"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _dashboard(canvas, fill=0):
+    """Disegna una dashboard tipica sul canvas"""
+    canvas.clear()
+    canvas.add_widget(Text(10, 5, "Dashboard", font_size='large'))
+    canvas.add_widget(Text(160, 10, "12:34", font_size='medium'))
+    canvas.add_widget(Box(10, 35, 120, 40, fill=fill))
+    canvas.add_widget(Text(140, 40, "22°", font_size='xlarge'))
+    canvas.add_widget(ProgressBar(10, 85, 150, 12, progress=65))
+    canvas.add_widget(StatusBox(170, 100, 50, 18, "ON", is_active=True, font_size='small'))
+    canvas.add_widget(NotchBar(canvas.width - 12, 0, 10, canvas.height, level=60))
+    canvas.add_widget(SimpleGraph(10, 100, 150, 20, [18, 17, 16, 20, 24, 26, 25, 22, 19]))
+
+
+def _getbuffer_4gray_reference(image):
+    """Impacchettamento a 2 bit pixel per pixel, come getbuffer_4Gray dei driver Waveshare"""
+    width, height = image.size
+    buf = [0xFF] * (width // 4 * height)
+    pixels = image.convert('L').load()
+    i = 0
+    for y in range(height):
+        for x in range(width):
+            if pixels[x, y] == 0xC0:
+                pixels[x, y] = 0x80
+            elif pixels[x, y] == 0x80:
+                pixels[x, y] = 0x40
+            i += 1
+            if i % 4 == 0:
+                buf[(x + y * width) // 4] = ((pixels[x - 3, y] & 0xc0) | (pixels[x - 2, y] & 0xc0) >> 2 |
+                                             (pixels[x - 1, y] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
+    return bytearray(buf)
+
+
+def bench_gray():
+    """Confronto tra il percorso monocromatico e quello a 4 livelli di grigio"""
+    width, height = 400, 300
+    mono = EinkCanvas(width, height)
+    gray = GrayCanvas(width, height)
+    gray_dither = GrayCanvas(width, height, dither=True)
+
+    _dashboard(mono)
+    _dashboard(gray, fill=GRAY2)
+    _dashboard(gray_dither, fill=GRAY2)
+
+    print(f"Canvas {width}x{height}")
+    print(f"  rendering mono:            {_timeit(lambda: _dashboard(mono)):8.2f} ms")
+    print(f"  rendering 4-gray:          {_timeit(lambda: _dashboard(gray, fill=GRAY2)):8.2f} ms")
+    print(f"  buffer mono (1bpp):        {_timeit(mono.get_buffer):8.2f} ms")
+    print(f"  buffer 4-gray (2bpp):      {_timeit(gray.get_buffer):8.2f} ms")
+    print(f"  buffer 4-gray con dither:  {_timeit(gray_dither.get_buffer):8.2f} ms")
+    quantized = gray.get_quantized_image()
+    print(f"  getbuffer_4Gray Waveshare: {_timeit(lambda: _getbuffer_4gray_reference(quantized), 3):8.2f} ms")
+
+
+def bench_transport():
+    """Velocità di codifica e compressione dei frame di una dashboard che si aggiorna"""
+    width, height = 800, 480
+    canvas = EinkCanvas(width, height)
+    frames = []
+    for minute in range(30):
+        _dashboard(canvas)
+        canvas.add_widget(Text(300, 10, f"12:{minute:02d}", font_size='large'))
+        canvas.add_widget(ProgressBar(300, 60, 400, 20, progress=minute * 3))
+        frames.append(bytes(canvas.get_buffer()))
+
+    def encode_all():
+        encoder = FrameEncoder()
+        return [encoder.encode(frame) for frame in frames]
+
+    def decode_all():
+        decoder = FrameDecoder()
+        return [decoder.decode(packet) for packet in packets]
+
+    packets = encode_all()
+    assert decode_all() == frames
+
+    raw = sum(len(frame) for frame in frames)
+    full_zlib = sum(len(zlib.compress(frame)) for frame in frames)
+    deltas = sum(len(packet) for packet in packets[1:])
+    print(f"Canvas {width}x{height}, {len(frames)} frame")
+    print(f"  codifica delta:            {_timeit(encode_all, 5) / len(frames):8.2f} ms/frame")
+    print(f"  decodifica:                {_timeit(decode_all, 5) / len(frames):8.2f} ms/frame")
+    print(f"  byte grezzi:               {raw:8d}")
+    print(f"  zlib frame completi:       {full_zlib:8d} ({raw / full_zlib:.1f}x)")
+    print(f"  keyframe + delta:          {len(packets[0]) + deltas:8d} ({raw / (len(packets[0]) + deltas):.1f}x)")
+    print(f"  delta medio:               {deltas / (len(packets) - 1):8.0f} byte")
+
+
+def _hatch_reference(draw, x0, y0, x1, y1, spacing):
+    """Retinatura diagonale disegnata pixel per pixel (come il vecchio DonutChart)"""
+    for i in range(x0 - y1, x1 - y0, spacing):
+        for x in range(x0, x1):
+            y = x - i
+            if y0 <= y < y1:
+                draw.point((x, y), fill=0)
+
+
+def bench_primitives():
+    """Retinature su buffer impacchettato contro il disegno pixel per pixel"""
+    width, height = 800, 480
+    image = Image.new('1', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    bitmap = PackedBitmap(width, height)
+    pattern = hatch_pattern('diagonal1', 3)
+
+    print(f"Bitmap {width}x{height}")
+    print(f"  retinatura pixel/pixel:    {_timeit(lambda: _hatch_reference(draw, 0, 0, 200, 200, 3), 3):8.2f} ms (200x200)")
+    print(f"  retinatura packed:         {_timeit(lambda: bitmap.pattern_fill(0, 0, 199, 199, pattern)):8.2f} ms (200x200)")
+    print(f"  DonutChart con retinature: {_timeit(lambda: DonutChart(100, 100, 120, [3, 2, 1, 4, 2, 5]).draw(draw, image, {'small': ImageFont.load_default()}), 10):8.2f} ms")
+
+
+def bench_charts():
+    """Grafici su serie lunghe: decimazione per colonna e cache dell'area disegnata"""
+    width, height = 800, 480
+    canvas = EinkCanvas(width, height)
+    fonts = canvas.fonts
+    for n in (1000, 10000, 100000):
+        data = [math.sin(i / 50) * 20 + (i % 7) for i in range(n)]
+        graph = SimpleGraph(0, 0, 400, 200, data)
+        chart = LineChart(0, 0, 400, 200, [data])
+
+        def chart_uncached():
+            eink_widgets._plot_cache.clear()
+            chart.draw(canvas.draw, canvas.image, fonts)
+
+        print(f"{n} campioni")
+        print(f"  SimpleGraph:               {_timeit(lambda: graph.draw(canvas.draw, canvas.image, fonts), 5):8.2f} ms")
+        print(f"  LineChart:                 {_timeit(chart_uncached, 5):8.2f} ms")
+        print(f"  LineChart (in cache):      {_timeit(lambda: chart.draw(canvas.draw, canvas.image, fonts), 5):8.2f} ms")
+
+
+def _heavy_widgets():
+    """Widget costosi da rasterizzare: ciambelle retinate, testi grandi, grafici lunghi"""
+    widgets = []
+    for i in range(6):
+        widgets.append(DonutChart(70 + i * 130, 90, 120, [3, 2, 1, 4, 2, 5]))
+        widgets.append(Text(10 + i * 130, 170, f"{20 + i}°", font_size='xlarge'))
+        widgets.append(LineChart(10 + i * 130, 240, 120, 100, [[math.sin(x / (i + 5)) for x in range(20000)]]))
+        widgets.append(Paragraph(10 + i * 130, 350, 120, "Temperatura stabile, umidità in calo " * 3, font_size='small'))
+    return widgets
+
+
+def bench_parallel():
+    """Rasterizzazione parallela dei widget con composizione nell'ordine originale"""
+    width, height = 800, 480
+    serial = EinkCanvas(width, height)
+    parallel = EinkCanvas(width, height)
+
+    def add_serial():
+        eink_widgets._plot_cache.clear()
+        serial.clear()
+        for widget in _heavy_widgets():
+            serial.add_widget(widget)
+
+    def add_parallel(workers):
+        eink_widgets._plot_cache.clear()
+        parallel.clear()
+        parallel.add_widgets(_heavy_widgets(), max_workers=workers)
+
+    add_serial()
+    add_parallel(4)
+    assert serial.get_image().tobytes() == parallel.get_image().tobytes()
+
+    print(f"Canvas {width}x{height}, {len(_heavy_widgets())} widget, {os.cpu_count()} core")
+    print(f"  seriale:                   {_timeit(add_serial, 5):8.2f} ms")
+    for workers in (2, 4):
+        print(f"  {workers} thread:                  {_timeit(lambda: add_parallel(workers), 5):8.2f} ms")
+
+
+def bench_fonts():
+    """Font bitmap precompilati contro FreeType"""
+    font_path = os.environ.get('BENCH_FONT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pic', 'Font.ttc'))
+    if not os.path.exists(font_path):
+        print(f"  font non trovato: {font_path} (imposta BENCH_FONT)")
+        return
+    image = Image.new('1', (800, 480), 255)
+    draw = ImageDraw.Draw(image)
+    texts = [f"{i % 24:02d}:{i % 60:02d} {i % 40}°" for i in range(100)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (18, 48):
+            path = os.path.join(tmp, f"Font-{size}.ebf")
+            build_bitmap_font(font_path, path, size)
+            start = time.perf_counter()
+            truetype = ImageFont.truetype(font_path, size)
+            ttf_load = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            bitmap = BitmapFont(path)
+            ebf_load = (time.perf_counter() - start) * 1000
+
+            print(f"{size}px")
+            print(f"  caricamento TTF:           {ttf_load:8.2f} ms")
+            print(f"  caricamento bitmap:        {ebf_load:8.2f} ms")
+            def draw_texts(font, cold=False):
+                if cold:
+                    font._lines.clear()
+                for text in texts:
+                    eink_widgets._draw_text(draw, (10, 10), text, font, 0)
+
+            print(f"  100 testi FreeType:        {_timeit(lambda: draw_texts(truetype), 5):8.2f} ms")
+            print(f"  100 testi bitmap:          {_timeit(lambda: draw_texts(bitmap, cold=True), 5):8.2f} ms")
+            print(f"  100 testi bitmap (cache):  {_timeit(lambda: draw_texts(bitmap), 5):8.2f} ms")
+            bitmap.close()
+
+
+def bench_steady():
+    """Loop di refresh a regime: widget riusati, buffer e immagini temporanee riusati"""
+    width, height = 400, 300
+    canvas = EinkCanvas(width, height).enable_steady_state()
+    temperature = DataSource(20.0)
+    history = DataSource([18.0 + i for i in range(8)])
+    canvas.add_widget(Text(10, 5, "Serra", font_size='large'))
+    canvas.add_widget(Text(200, 10, "").bind('text', temperature, lambda t: f"{t:.1f}°"))
+    canvas.add_widget(ProgressBar(10, 50, 180, 14, 0).bind('progress', temperature, lambda t: int(t * 2) % 100))
+    canvas.add_widget(DonutChart(300, 150, 100, [1, 1, 1]).bind('data', temperature, lambda t: [t, 40 - t, 5]))
+    canvas.add_widget(LineChart(10, 80, 200, 120, [[]]).bind('series', history, lambda h: [h]))
+    canvas.add_widget(NotchBar(width - 12, 0, 10, height, 0).bind('level', temperature, lambda t: int(t * 2) % 100))
+
+    def frame(i):
+        # Valori che si ripetono: a regime le cache sono già piene
+        value = 18.0 + i % 8
+        temperature.set(value)
+        history.set(history.value[1:] + [value])
+        canvas.update()
+        return canvas.get_buffer(rotation=270)
+
+    # Lo stesso tracker dei test (richiede pytest per il fixture in conftest.py)
+    from conftest import AllocationTracker
+    with AllocationTracker() as tracker:
+        for i in range(60):
+            frame(i)
+            tracker.frame()
+    tracker.assert_flat(warmup=20)
+    steady = tracker.frames[20:]
+    print(f"Canvas {width}x{height}, {len(steady)} frame a regime")
+    print(f"  blocchi Python netti/frame: {sum(f[0] for f in steady) / len(steady):8.2f}")
+    print(f"  byte netti/frame:           {sum(f[1] for f in steady) / len(steady):8.1f}")
+    print(f"  blocchi PIL nuovi/frame:    {sum(f[2] for f in steady) / len(steady):8.2f}")
+    print(f"  frame:                      {_timeit(lambda: frame(0)):8.2f} ms")
+
+
+def bench_refresh():
+    """Costo dei refresh di un orologio con politiche di refresh completo diverse"""
+    epd = SimulatedDisplay(122, 250)
+    canvas = EinkCanvas(epd.height, epd.width)
+    clock = Text(10, 30, "", font_size='xlarge')
+    canvas.add_widget(clock)
+
+    def minute(i):
+        clock.set('text', f"{i // 60 % 24:02d}:{i % 60:02d}")
+        canvas.update()
+        return canvas.get_buffer(rotation=270)
+
+    # Pixel cambiati contro un confronto bit a bit dei buffer
+    accounting = RefreshAccounting(epd)
+    previous = bytes(minute(0))
+    accounting.display(previous)
+    for i in range(1, 6):
+        buf = bytes(minute(i))
+        accounting.displayPartial(buf)
+        reference = (int.from_bytes(buf, 'big') ^ int.from_bytes(previous, 'big')).bit_count()
+        assert accounting.last['changed_pixels'] == reference
+        previous = buf
+
+    print("Orologio 250x122, un aggiornamento al minuto per 24 ore")
+    for full_every in (1, 10, 60):
+        accounting = RefreshAccounting(SimulatedDisplay(122, 250))
+        start = time.perf_counter()
+        for i in range(24 * 60):
+            accounting.screen = 'notte' if i < 7 * 60 else 'giorno'
+            if i % full_every == 0:
+                accounting.display(minute(i))
+            else:
+                accounting.displayPartial(minute(i))
+        elapsed = (time.perf_counter() - start) * 1000 / (24 * 60)
+        totals = accounting.totals
+        night = accounting.screens['notte']
+        print(f"  completo ogni {full_every:2d}: {totals.energy_mj / 1000:6.1f} J/giorno "
+              f"(notte {night.energy_mj / 1000:5.1f} J), "
+              f"vita {1 / accounting.wear_fraction / 365:6.0f} anni, "
+              f"{totals.as_dict()['avg_changed_pixels']:6.0f} pixel/refresh, "
+              f"{elapsed:.2f} ms/refresh")
+
+
+def bench_raster():
+    """Foto grande ridotta per il pannello: decodifica ridotta contro decodifica completa"""
+    photo = Image.radial_gradient('L').resize((4000, 3000)).convert('RGB')
+    ImageDraw.Draw(photo).rectangle((1000, 1000, 2000, 1500), fill=(0, 0, 0))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'foto.jpg')
+        photo.save(path, quality=90)
+        del photo
+        crop = (800, 800, 2200, 1700)
+
+        def reference():
+            with Image.open(path) as img:
+                return img.convert('L').crop(crop).resize((250, 161), Image.Resampling.LANCZOS).convert('1', dither=Image.Dither.NONE)
+
+        def draft():
+            eink_widgets._raster_cache.clear()
+            return load_image(path, (250, None), crop, dither=False)
+
+        # La decodifica ridotta cambia solo pochi pixel del risultato (senza
+        # dithering: la diffusione dell'errore amplificherebbe ogni differenza)
+        changed = ImageChops.logical_xor(reference(), draft()).histogram()[255]
+        assert changed < 250 * 161 // 100, changed
+
+        print("JPEG 4000x3000, ritaglio 1400x900 -> 250x161")
+        print(f"  decodifica completa:       {_timeit(reference, 5):8.2f} ms")
+        print(f"  draft + ritaglio:          {_timeit(draft, 5):8.2f} ms")
+        print(f"  in cache:                  {_timeit(lambda: load_image(path, (250, None), crop, dither=False)):8.2f} ms")
+        print(f"  pixel diversi:             {changed:8d}")
+
+
+def bench_marquee():
+    """Testo che scorre: striscia pre-renderizzata contro Text spostato a ogni passo"""
+    width, height = 250, 122
+    message = "Allerta meteo: vento forte e pioggia intensa fino a domani sera"
+    canvas = EinkCanvas(width, height)
+    ticker = Marquee(0, 100, width, 20, message)
+    canvas.add_widget(ticker)
+    text_canvas = EinkCanvas(width, height)
+    text = Text(width, 100, message)
+    text_canvas.add_widget(text)
+
+    def step_marquee():
+        ticker.step()
+        return canvas.update()
+
+    def step_text():
+        text.move_to(text.x - 8 if text.x > -2000 else width, text.y)
+        return text_canvas.update()
+
+    # Ogni passo aggiorna solo il rettangolo fisso della striscia
+    regions = {step_marquee() for _ in range(50)}
+    assert regions == {(0, 100, width, 120)}, regions
+    area = max((r[2] - r[0]) * (r[3] - r[1]) for r in (step_text() for _ in range(50)) if r)
+
+    print(f"Striscia {width}x20, messaggio di {len(message)} caratteri")
+    print(f"  Text spostato:             {_timeit(step_text, 200):8.3f} ms/passo (area fino a {area} px)")
+    print(f"  Marquee:                   {_timeit(step_marquee, 200):8.3f} ms/passo (area {width * 20} px)")
+
+
+def bench_table():
+    """Tabella virtualizzata: costo per pagina indipendente dal numero di righe"""
+    width, height = 400, 300
+    for count in (1000, 1000000):
+        rows = [(f"A{i:07d}", f"Articolo {i}", i * 7 % 1000) for i in range(count)]
+        canvas = EinkCanvas(width, height)
+        table = Table(0, 0, width, height, rows, headers=['Codice', 'Articolo', 'Qtà'],
+                      align=['left', 'left', 'right'])
+        canvas.add_widget(table)
+        page = table.visible_rows(canvas.fonts)
+
+        def next_page():
+            if not table.next_page():
+                table.set('first_row', 0)
+            canvas.update()
+
+        def back_and_forth():
+            table.prev_page()
+            canvas.update()
+            table.next_page()
+            canvas.update()
+
+        # Scorrendo di una riga si rasterizza solo la riga nuova
+        table.scroll(1)
+        canvas.update()
+        before = len(table._cache['rows'])
+        table.scroll(1)
+        canvas.update()
+        assert len(table._cache['rows']) == before + 1
+
+        print(f"{count} righe, {page} per pagina")
+        print(f"  pagina nuova:              {_timeit(next_page, 20):8.2f} ms")
+        print(f"  scorrimento di una riga:   {_timeit(lambda: (table.scroll(1), canvas.update()), 20):8.2f} ms")
+        print(f"  pagina già vista:          {_timeit(back_and_forth, 20) / 2:8.2f} ms")
+
+
+def bench_clock():
+    """Orologio per un giorno: Clock con celle per cifra contro Text"""
+    width, height = 250, 122
+    midnight = time.mktime((2026, 1, 1, 0, 0, 0, 0, 0, -1))
+    results = {}
+    for name in ('Text', 'Clock'):
+        canvas = EinkCanvas(width, height)
+        if name == 'Clock':
+            widget = Clock(60, 40, '%H:%M', font_size='xlarge', now=midnight)
+            tick = widget.tick
+        else:
+            widget = Text(60, 40, time.strftime('%H:%M', time.localtime(midnight)), font_size='xlarge')
+            tick = lambda now: widget.set('text', time.strftime('%H:%M', time.localtime(now)))
+        canvas.add_widget(widget)
+        area = 0
+        start = time.perf_counter()
+        for minute in range(1, 24 * 60):
+            tick(midnight + minute * 60)
+            x0, y0, x1, y1 = canvas.update()
+            area += (x1 - x0) * (y1 - y0)
+        elapsed = (time.perf_counter() - start) * 1000 / (24 * 60 - 1)
+        results[name] = (canvas.get_image().tobytes(), area, elapsed)
+
+    # Stessa immagine finale (le cifre sono centrate nella loro cella)
+    reference = EinkCanvas(width, height)
+    reference.add_widget(Clock(60, 40, '%H:%M', font_size='xlarge', now=midnight + (24 * 60 - 1) * 60))
+    assert results['Clock'][0] == reference.get_image().tobytes()
+
+    print(f"Orologio HH:MM, {24 * 60 - 1} scatti di minuto")
+    for name, (_, area, elapsed) in results.items():
+        print(f"  {name + ':':26s} {area / (24 * 60 - 1):8.0f} px/scatto, {elapsed:.3f} ms/scatto")
+
+
+def bench_animation():
+    """Animazione a 10 fps su display simulati più o meno veloci del frame budget"""
+    print("Barra e box animati per 1 s a 10 fps")
+    for refresh_time in (0.0, 0.05, 0.25):
+        canvas = EinkCanvas(250, 122)
+        bar = ProgressBar(10, 10, 150, 15, 0)
+        box = Box(0, 60, 20, 20, fill=0)
+        canvas.add_widget(Text(10, 35, "Livello", font_size='small'))
+        canvas.add_widget(bar)
+        canvas.add_widget(box)
+        epd = SimulatedDisplay(122, 250, partial_refresh_time=refresh_time)
+
+        animation = Animation(canvas, epd, fps=10, rotation=270)
+        animation.add(bar, 'progress', 100, duration=1.0, easing=ease_linear)
+        animation.add(box, 'position', (200, 60), duration=0.5, delay=0.5)
+        stats = animation.run()
+
+        # Tutti i frame sono mostrati o contati come saltati; l'ultimo ha i valori finali
+        assert stats.frames + stats.dropped == 11
+        assert (bar.progress, box.x) == (100, 200)
+        assert epd.partial_refreshes == stats.refreshes
+        print(f"  refresh {refresh_time * 1000:3.0f} ms: {stats.achieved_fps:5.1f} fps, "
+              f"{stats.frames:2d} frame, {stats.dropped:2d} saltati, "
+              f"render {stats.as_dict()['avg_render_ms']:.2f} ms/frame")
+
+
+BENCHMARKS = {
+    'gray': bench_gray,
+    'transport': bench_transport,
+    'primitives': bench_primitives,
+    'charts': bench_charts,
+    'parallel': bench_parallel,
+    'fonts': bench_fonts,
+    'steady': bench_steady,
+    'refresh': bench_refresh,
+    'raster': bench_raster,
+    'marquee': bench_marquee,
+    'table': bench_table,
+    'clock': bench_clock,
+    'animation': bench_animation,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Benchmark sconosciuto: {name} (disponibili: {', '.join(BENCHMARKS)})")
+            continue
+        print(f"\n=== {name} ===")
+        BENCHMARKS[name]()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Converte un font TrueType in font bitmap 1-bit (uno per dimensione)
+
+I font bitmap si caricano a runtime con load_bitmap_font/add_bitmap_font,
+senza FreeType. Nominandoli Font-<size>.ebf in picdir diventano i font di
+default del canvas (small=14, medium=18, large=24, xlarge=48).
+
+Uso:
+    python3 build_bitmap_font.py pic/Lato-Regular.ttf pic --size 14 --size 18
+    python3 build_bitmap_font.py pic/Font.ttc pic --size 14 --size 18 --size 24 --size 48 --name Font
+"""
+
+import argparse
+import os
+from eink_widgets import build_bitmap_font, BitmapFont, BITMAP_FONT_CHARS
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converte un font TrueType in font bitmap 1-bit")
+    parser.add_argument('font', help="file TTF/TTC")
+    parser.add_argument('output_dir', help="directory dei font bitmap")
+    parser.add_argument('--size', action='append', type=int, required=True,
+                        help="dimensione in pixel, ripetibile")
+    parser.add_argument('--name', help="prefisso dei file (default: nome del font)")
+    parser.add_argument('--chars', default='', help="caratteri da aggiungere a quelli di default")
+    args = parser.parse_args()
+
+    name = args.name or os.path.splitext(os.path.basename(args.font))[0]
+    for size in args.size:
+        output = os.path.join(args.output_dir, f"{name}-{size}.ebf")
+        count = build_bitmap_font(args.font, output, size, BITMAP_FONT_CHARS + args.chars)
+        font = BitmapFont(output)
+        print(f"Font bitmap creato: {output}")
+        print(f"  {font.getname()[0]} {font.getname()[1]} {size}px, {count} glifi, {os.path.getsize(output)} byte")
+        font.close()
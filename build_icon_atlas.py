@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Crea un atlante di icone 1-bit da una directory di SVG
+
+L'atlante si usa a runtime con IconAtlas/AtlasIcon, senza bisogno di cairosvg.
+
+Uso:
+    python3 build_icon_atlas.py pic/icons pic/icons.atlas --size 24 --size 48
+"""
+
+import argparse
+from eink_widgets import build_icon_atlas, IconAtlas
+
+
+def parse_size(value):
+    """Accetta '48' oppure '48x32'"""
+    if 'x' in value:
+        width, height = value.split('x')
+        return (int(width), int(height))
+    return int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea un atlante di icone 1-bit da una directory di SVG")
+    parser.add_argument('svg_dir', help="directory con i file .svg")
+    parser.add_argument('output', help="file dell'atlante da creare")
+    parser.add_argument('--size', action='append', type=parse_size, required=True,
+                        help="dimensione delle icone (es. 24 o 48x32), ripetibile")
+    parser.add_argument('--width', type=int, default=512, help="larghezza del bitmap dell'atlante")
+    args = parser.parse_args()
+
+    count = build_icon_atlas(args.svg_dir, args.output, args.size, atlas_width=args.width)
+
+    with IconAtlas(args.output) as atlas:
+        print(f"Atlante creato: {args.output}")
+        print(f"  icone: {len(atlas.names())} ({count} immagini)")
+        print(f"  bitmap: {atlas.width}x{atlas.height}")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Strumenti condivisi dai test (e dal benchmark "steady")
+
+Uso:
+    python3 -m pytest -q
+"""
+
+import os
+import tracemalloc
+
+import pytest
+from PIL import Image
+
+
+class AllocationTracker:
+    """
+    Allocazioni per frame di un loop di refresh, misurate con tracemalloc
+
+    Dopo ogni frame si confronta uno snapshot con il precedente: a regime il
+    numero di blocchi Python rimasti vivi non deve crescere. Le allocazioni
+    interne di Pillow (cache del rendering FreeType e degli encoder) sono
+    escluse; per le immagini PIL (allocate in C) si contano invece i blocchi
+    nuovi dell'allocatore di PIL.
+
+    Example:
+        with AllocationTracker() as tracker:
+            for _ in range(50):
+                render_frame()
+                tracker.frame()
+        tracker.assert_flat(warmup=10)
+    """
+
+    def __init__(self):
+        self.frames = []        # (blocchi Python netti, byte netti, blocchi PIL nuovi)
+        self._snapshot = None
+        self._pil_blocks = 0
+
+    def __enter__(self):
+        tracemalloc.start()
+        self._snapshot = self._take_snapshot()
+        self._pil_blocks = Image.core.get_stats()['allocated_blocks']
+        return self
+
+    def __exit__(self, *exc):
+        tracemalloc.stop()
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, Image.__file__.rsplit(os.sep, 1)[0] + os.sep + '*'),
+        ))
+
+    def frame(self):
+        """Da chiamare alla fine di ogni frame"""
+        snapshot = self._take_snapshot()
+        diff = snapshot.compare_to(self._snapshot, 'lineno')
+        pil_blocks = Image.core.get_stats()['allocated_blocks']
+        self.frames.append((sum(d.count_diff for d in diff), sum(d.size_diff for d in diff),
+                            pil_blocks - self._pil_blocks))
+        self._snapshot = snapshot
+        self._pil_blocks = pil_blocks
+
+    def assert_flat(self, warmup=10):
+        """
+        Dopo warmup frame non devono restare allocazioni né nuovi blocchi PIL
+
+        Le free list di CPython (float, tuple) trattengono qualche oggetto che
+        tracemalloc vede ancora allocato: si tollera in media meno di un blocco
+        per frame, mentre un widget o una lista persi ne lasciano diversi.
+        """
+        steady = self.frames[warmup:]
+        blocks = sum(frame[0] for frame in steady)
+        pil_blocks = sum(frame[2] for frame in steady)
+        assert blocks < len(steady) and pil_blocks == 0, (
+            f"allocazioni a regime: {blocks} blocchi Python, {pil_blocks} blocchi PIL in {len(steady)} frame")
+
+
+@pytest.fixture
+def allocation_tracker():
+    """AllocationTracker già avviato per la durata del test"""
+    with AllocationTracker() as tracker:
+        yield tracker
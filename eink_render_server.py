@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Server di rendering per display e-ink
+
+Processo sempre attivo che tiene caldi i cache di font, SVG e layout di
+eink_widgets e renderizza le schermate descritte in JSON per conto di
+altri servizi, via HTTP su TCP o su socket Unix.
+
+Descrizione di una schermata (POST /render):
+    {
+        "width": 250, "height": 122,
+        "canvas": "mono",              # "mono", "color", "gray"
+        "inks": ["black", "red"],      # solo per "color"
+        "rotation": 270,
+        "format": "buffer",            # "buffer" (formato del pannello) o "png"
+        "widgets": [
+            {"type": "Text", "x": 10, "y": 10, "text": "Ciao", "font_size": "large"},
+            {"type": "ProgressBar", "x": 10, "y": 50, "width": 200, "height": 12, "progress": 40}
+        ]
+    }
+
+Uso:
+    python3 eink_render_server.py --port 8150
+    python3 eink_render_server.py --unix /tmp/eink.sock --workers 4
+    python3 eink_render_server.py --load-test 500 --concurrency 8
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import eink_widgets
+from eink_widgets import EinkCanvas, ColorCanvas, GrayCanvas
+
+# Widget che si possono creare da una descrizione JSON
+WIDGET_TYPES = {
+    name: getattr(eink_widgets, name)
+    for name in ('Text', 'Paragraph', 'Box', 'StatusBox', 'NotchBar', 'ProgressBar',
+                 'SVGIcon', 'DonutChart', 'Line', 'SimpleGraph')
+}
+
+CANVAS_TYPES = {
+    'mono': EinkCanvas,
+    'color': ColorCanvas,
+    'gray': GrayCanvas,
+}
+
+# Dimensione massima accettata per un canvas (lato in pixel)
+MAX_SIZE = 2048
+
+# Inchiostri accettati per i canvas "color" (al massimo uno per nome)
+INK_NAMES = ('black', 'red', 'yellow')
+
+# Canvas riusati da ogni worker (i meno usati di recente vengono scartati)
+CANVAS_CACHE_SIZE = 4
+
+# Parametri dei widget che sono coppie di interi (es. size di SVGIcon)
+_PAIR_PARAMS = ('size',)
+
+# Parametri geometrici dei widget, limitati a MAX_WIDGET_SIZE in valore assoluto:
+# un widget molto più grande del canvas allocherebbe comunque tutta la sua area
+_GEOMETRY_PARAMS = ('x', 'y', 'x1', 'y1', 'x2', 'y2', 'width', 'height', 'diameter',
+                    'size', 'outline_width', 'num_notches', 'spacing')
+MAX_WIDGET_SIZE = 2 * MAX_SIZE
+
+
+class RenderError(ValueError):
+    """Descrizione della schermata non valida"""
+
+
+def _pair(name, value):
+    """Coppia di interi da una lista JSON (es. [48, 48])"""
+    try:
+        first, second = value
+        return (int(first), int(second))
+    except (TypeError, ValueError):
+        raise RenderError(f"{name} deve essere una coppia di interi")
+
+
+def _check_geometry(name, value):
+    """Rifiuta un parametro geometrico oltre MAX_WIDGET_SIZE (anche negativo)"""
+    values = value if isinstance(value, tuple) else (value,)
+    for v in values:
+        if isinstance(v, (int, float)) and not abs(v) <= MAX_WIDGET_SIZE:
+            raise RenderError(f"{name} fuori dai limiti (massimo {MAX_WIDGET_SIZE} in valore assoluto)")
+
+
+def parse_inks(value):
+    """Inchiostri di un canvas "color", controllati contro INK_NAMES"""
+    if not isinstance(value, (list, tuple)) or not 0 < len(value) <= len(INK_NAMES):
+        raise RenderError(f"inks deve essere una lista di 1-{len(INK_NAMES)} inchiostri")
+    if any(not isinstance(ink, str) or ink not in INK_NAMES for ink in value) or len(set(value)) != len(value):
+        raise RenderError(f"Inchiostri non validi: usa nomi distinti tra {', '.join(INK_NAMES)}")
+    return tuple(value)
+
+
+def create_widget(spec):
+    """Crea un widget da un dizionario {"type": ..., parametri...}"""
+    if not isinstance(spec, dict):
+        raise RenderError("Ogni widget deve essere un oggetto JSON")
+    spec = dict(spec)
+    name = spec.pop('type', None)
+    if not isinstance(name, str) or name not in WIDGET_TYPES:
+        raise RenderError(f"Tipo di widget sconosciuto: {name}")
+    for param in _PAIR_PARAMS:
+        if spec.get(param) is not None:
+            spec[param] = _pair(param, spec[param])
+    for param in _GEOMETRY_PARAMS:
+        _check_geometry(param, spec.get(param))
+    try:
+        return WIDGET_TYPES[name](**spec)
+    except (TypeError, ValueError) as e:
+        raise RenderError(f"Parametri non validi per {name}: {e}")
+
+
+class RenderStats:
+    """Latenze delle ultime richieste e throughput del server (tempi in millisecondi)"""
+
+    def __init__(self, keep=1000):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=keep)
+        self.requests = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def record(self, queue_ms, render_ms, encode_ms):
+        with self._lock:
+            self.requests += 1
+            self._samples.append((queue_ms, render_ms, encode_ms))
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self):
+        with self._lock:
+            samples = list(self._samples)
+            requests, errors = self.requests, self.errors
+        elapsed = time.perf_counter() - self.started
+        totals = sorted(sum(s) for s in samples)
+        n = len(samples) or 1
+
+        def percentile(p):
+            return totals[min(len(totals) - 1, int(len(totals) * p))] if totals else 0.0
+
+        return {
+            'requests': requests,
+            'errors': errors,
+            'requests_per_s': requests / elapsed if elapsed else 0.0,
+            'avg_queue_ms': sum(s[0] for s in samples) / n,
+            'avg_render_ms': sum(s[1] for s in samples) / n,
+            'avg_encode_ms': sum(s[2] for s in samples) / n,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'max_ms': totals[-1] if totals else 0.0,
+        }
+
+
+class Renderer:
+    """
+    Renderizza descrizioni di schermate con un pool di worker
+
+    Ogni worker riusa i propri canvas (gli ultimi CANVAS_CACHE_SIZE per tipo,
+    dimensione e inchiostri); font, SVG e layout dei paragrafi sono nei cache
+    condivisi di eink_widgets.
+    """
+
+    def __init__(self, picdir=None, workers=None):
+        self.picdir = picdir
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        self.stats = RenderStats()
+        self._local = threading.local()
+        # Carica i font una volta all'avvio
+        EinkCanvas(8, 8, picdir)
+
+    def _canvas(self, kind, width, height, inks):
+        canvases = getattr(self._local, 'canvases', None)
+        if canvases is None:
+            canvases = self._local.canvases = OrderedDict()
+        key = (kind, width, height, inks)
+        canvas = canvases.get(key)
+        if canvas is None:
+            if kind == 'color':
+                canvas = ColorCanvas(width, height, self.picdir, inks=inks)
+            else:
+                canvas = CANVAS_TYPES[kind](width, height, self.picdir)
+            canvases[key] = canvas
+            if len(canvases) > CANVAS_CACHE_SIZE:
+                canvases.popitem(last=False)
+        else:
+            canvases.move_to_end(key)
+            canvas.clear()
+        return canvas
+
+    def _render(self, spec, submitted):
+        started = time.perf_counter()
+        if not isinstance(spec, dict):
+            raise RenderError("La descrizione della schermata deve essere un oggetto JSON")
+        kind = spec.get('canvas', 'mono')
+        if not isinstance(kind, str) or kind not in CANVAS_TYPES:
+            raise RenderError(f"Tipo di canvas sconosciuto: {kind}")
+        try:
+            width, height = int(spec['width']), int(spec['height'])
+        except (KeyError, TypeError, ValueError):
+            raise RenderError("width e height sono obbligatori")
+        if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE):
+            raise RenderError(f"Dimensioni non valide: {width}x{height}")
+        rotation = spec.get('rotation', 0)
+        if rotation not in (0, 90, 180, 270):
+            raise RenderError(f"Rotazione non valida: {rotation}")
+        output = spec.get('format', 'buffer')
+        if output not in ('buffer', 'png'):
+            raise RenderError(f"Formato sconosciuto: {output}")
+
+        inks = parse_inks(spec.get('inks', ('black', 'red'))) if kind == 'color' else None
+        widgets = spec.get('widgets', [])
+        if not isinstance(widgets, list):
+            raise RenderError("widgets deve essere una lista")
+
+        canvas = self._canvas(kind, width, height, inks)
+        for widget in widgets:
+            widget = create_widget(widget)
+            try:
+                canvas.add_widget(widget)
+            except (TypeError, ValueError, KeyError) as e:
+                # Valori di tipo sbagliato che il costruttore accetta ma il disegno no
+                raise RenderError(f"Parametri non validi per {type(widget).__name__}: {e}")
+        rendered = time.perf_counter()
+
+        headers = {}
+        if output == 'png':
+            image = canvas.get_preview() if kind == 'color' else canvas.get_image()
+            if rotation:
+                image = image.transpose(eink_widgets._TRANSPOSE[rotation])
+            out = io.BytesIO()
+            image.save(out, 'PNG')
+            body, content_type = out.getvalue(), 'image/png'
+        else:
+            planes = canvas.get_plane_buffers(rotation) if kind == 'color' else [canvas.get_buffer(rotation)]
+            body, content_type = b''.join(planes), 'application/octet-stream'
+            headers['X-Planes'] = str(len(planes))
+            headers['X-Bpp'] = '2' if kind == 'gray' else '1'
+        finished = time.perf_counter()
+
+        timings = ((started - submitted) * 1000, (rendered - started) * 1000, (finished - rendered) * 1000)
+        self.stats.record(*timings)
+        headers['X-Queue-Ms'] = f"{timings[0]:.2f}"
+        headers['X-Render-Ms'] = f"{timings[1]:.2f}"
+        headers['X-Encode-Ms'] = f"{timings[2]:.2f}"
+        return body, content_type, headers
+
+    def render(self, spec):
+        """
+        Renderizza una schermata nel pool di worker
+
+        Returns:
+            (body, content_type, headers) con i tempi di coda/rendering/codifica negli header
+        """
+        try:
+            return self.executor.submit(self._render, spec, time.perf_counter()).result()
+        except Exception:
+            self.stats.record_error()
+            raise
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class _RenderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Header e corpo partono in due write: senza questo il delayed ACK aggiunge ~40 ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        if self.server.address_family == socket.AF_UNIX:
+            self.disable_nagle_algorithm = False    # TCP_NODELAY non esiste sui socket Unix
+        super().setup()
+
+    def _reply(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_json(self, status, data):
+        self._reply(status, json.dumps(data).encode())
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply_json(200, self.server.renderer.stats.as_dict())
+        elif self.path == '/health':
+            self._reply_json(200, {'status': 'ok'})
+        else:
+            self._reply_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self._reply_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            spec = json.loads(self.rfile.read(length))
+            body, content_type, headers = self.server.renderer.render(spec)
+        except (RenderError, ValueError) as e:
+            self._reply_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._reply_json(500, {'error': str(e)})
+            return
+        self._reply(200, body, content_type, headers)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class RenderServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Server HTTP di rendering su TCP
+
+    Example:
+        server = RenderServer(('127.0.0.1', 8150), Renderer(picdir))
+        server.serve_forever()
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, renderer, verbose=False):
+        self.renderer = renderer
+        self.verbose = verbose
+        super().__init__(address, _RenderHandler)
+
+
+class UnixRenderServer(RenderServer):
+    """Server HTTP di rendering su socket Unix"""
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class RenderClient:
+    """
+    Client per RenderServer (connessione persistente)
+
+    Example:
+        client = RenderClient(port=8150)             # oppure RenderClient(unix_path='/tmp/eink.sock')
+        buf = client.render({"width": 250, "height": 122, "widgets": [...]})
+        epd.display(buf)
+    """
+
+    def __init__(self, host='127.0.0.1', port=8150, unix_path=None, timeout=30):
+        if unix_path:
+            self._conn = _UnixHTTPConnection(unix_path, timeout)
+        else:
+            self._conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.last_timings = {}
+
+    def _request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        self._conn.request(method, path, body, headers)
+        response = self._conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RenderError(json.loads(data).get('error', f"HTTP {response.status}"))
+        return response, data
+
+    def render(self, spec):
+        """Renderizza una schermata e restituisce i byte (buffer del pannello o PNG)"""
+        response, data = self._request('POST', '/render', json.dumps(spec).encode())
+        self.last_timings = {name: float(response.getheader(f'X-{name.title()}-Ms'))
+                             for name in ('queue', 'render', 'encode')}
+        return data
+
+    def metrics(self):
+        """Metriche del server"""
+        return json.loads(self._request('GET', '/metrics')[1])
+
+    def close(self):
+        self._conn.close()
+
+
+def load_test(spec, requests=200, concurrency=8, **client_args):
+    """
+    Invia richieste concorrenti al server e misura latenza e throughput lato client
+
+    Returns:
+        dizionario con richieste al secondo e percentili di latenza (ms)
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        client = RenderClient(**client_args)
+        try:
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                start = time.perf_counter()
+                try:
+                    client.render(spec)
+                except (OSError, http.client.HTTPException, RenderError) as e:
+                    with lock:
+                        errors.append(e)
+                    client.close()
+                    continue
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            client.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latencies) or [0.0]
+    return {
+        'requests': requests - len(errors),
+        'errors': len(errors),
+        'concurrency': concurrency,
+        'requests_per_s': (requests - len(errors)) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[int(len(latencies) * 0.95)],
+        'max_ms': latencies[-1],
+    }
+
+
+# Schermata usata dal load test
+EXAMPLE_SPEC = {
+    'width': 250, 'height': 122, 'rotation': 270, 'format': 'buffer',
+    'widgets': [
+        {'type': 'Text', 'x': 10, 'y': 5, 'text': 'Dashboard', 'font_size': 'large'},
+        {'type': 'Text', 'x': 160, 'y': 10, 'text': '12:34'},
+        {'type': 'ProgressBar', 'x': 10, 'y': 40, 'width': 150, 'height': 12, 'progress': 65},
+        {'type': 'StatusBox', 'x': 170, 'y': 40, 'width': 50, 'height': 18, 'text': 'ON',
+         'is_active': True, 'font_size': 'small'},
+        {'type': 'SimpleGraph', 'x': 10, 'y': 70, 'width': 200, 'height': 40,
+         'data': [18, 17, 16, 20, 24, 26, 25, 22, 19]},
+    ],
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server di rendering per display e-ink")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8150)
+    parser.add_argument('--unix', help="percorso del socket Unix (al posto di host/porta)")
+    parser.add_argument('--picdir', help="directory con font e risorse")
+    parser.add_argument('--workers', type=int, help="thread di rendering")
+    parser.add_argument('--verbose', action='store_true', help="log di ogni richiesta")
+    parser.add_argument('--load-test', type=int, metavar='N',
+                        help="avvia un server locale e invia N richieste di prova")
+    parser.add_argument('--concurrency', type=int, default=8, help="client concorrenti del load test")
+    args = parser.parse_args()
+
+    renderer = Renderer(args.picdir, args.workers)
+    if args.unix:
+        server = UnixRenderServer(args.unix, renderer, args.verbose)
+        client_args = {'unix_path': args.unix}
+    else:
+        server = RenderServer((args.host, args.port if not args.load_test else 0), renderer, args.verbose)
+        client_args = {'host': args.host, 'port': server.server_address[1]}
+
+    if args.load_test:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        result = load_test(EXAMPLE_SPEC, args.load_test, args.concurrency, **client_args)
+        print("Load test (client):")
+        for name, value in result.items():
+            print(f"  {name}: {value:.2f}" if isinstance(value, float) else f"  {name}: {value}")
+        print("Metriche (server):")
+        for name, value in renderer.stats.as_dict().items():
+            print(f"  {name}: {value:.2f}" if isinstance(value, float) else f"  {name}: {value}")
+        server.shutdown()
+    else:
+        print(f"Server di rendering in ascolto su {args.unix or f'{args.host}:{args.port}'}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    server.server_close()
+    renderer.close()
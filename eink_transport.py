@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Trasporto compresso dei frame verso display remoti
+
+Un renderer centrale invia i frame a dei client "sottili" che pilotano i
+pannelli. Ogni frame viene codificato come XOR rispetto al precedente
+(su e-ink cambia poco tra un aggiornamento e l'altro) e poi compresso con
+RLE degli zeri o zlib, scegliendo il risultato più piccolo.
+
+Tutte le operazioni lavorano sui buffer impacchettati di EinkCanvas.get_buffer()
+con operazioni in C (int.from_bytes per lo XOR, re per le sequenze, zlib).
+"""
+
+import queue
+import re
+import socket
+import struct
+import threading
+import zlib
+
+# Intestazione di ogni pacchetto: marcatore, tipo, metodo, numero di sequenza, lunghezza del frame
+_PACKET_HEADER = struct.Struct('<2sBBII')
+_PACKET_MAGIC = b'EF'
+_LENGTH = struct.Struct('<I')
+_RUN = struct.Struct('<II')
+
+KEYFRAME = 0
+DELTA = 1
+
+RAW = 0
+RLE = 1
+ZLIB = 2
+
+_NONZERO = re.compile(b'[^\x00]+')
+
+
+def xor_bytes(a, b):
+    """XOR di due buffer della stessa lunghezza"""
+    if len(a) != len(b):
+        raise ValueError("I buffer da confrontare devono avere la stessa lunghezza")
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+def rle_encode(data):
+    """
+    Codifica le sequenze di byte a zero (tipiche di un delta XOR)
+
+    Il risultato è una lista di (zeri da saltare, lunghezza) seguita dai byte letterali.
+    """
+    out = bytearray()
+    pos = 0
+    for match in _NONZERO.finditer(data):
+        start, end = match.span()
+        out += _RUN.pack(start - pos, end - start)
+        out += data[start:end]
+        pos = end
+    return bytes(out)
+
+
+def rle_decode(data, length):
+    """Decodifica il risultato di rle_encode in un buffer di length byte"""
+    out = bytearray(length)
+    pos = 0
+    i = 0
+    view = memoryview(data)
+    while i < len(data):
+        skip, count = _RUN.unpack_from(data, i)
+        i += _RUN.size
+        pos += skip
+        out[pos:pos + count] = view[i:i + count]
+        pos += count
+        i += count
+    return out
+
+
+class FrameEncoder:
+    """
+    Codifica una sequenza di frame per il trasporto
+
+    Example:
+        encoder = FrameEncoder()
+        packet = encoder.encode(canvas.get_buffer())
+    """
+
+    def __init__(self, keyframe_interval=0, level=6):
+        """
+        Args:
+            keyframe_interval: ogni quanti frame inviarne uno completo (0 = solo il primo)
+            level: livello di compressione zlib
+        """
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self.sequence = 0
+        self._previous = None
+
+    def reset(self):
+        """Il prossimo frame sarà un keyframe (es. nuovo client)"""
+        self._previous = None
+
+    def encode(self, buf):
+        """
+        Codifica un frame
+
+        Args:
+            buf: buffer impacchettato (bytes, bytearray o memoryview)
+
+        Returns:
+            bytes: pacchetto da inviare
+        """
+        buf = bytes(buf)
+        kind = DELTA
+        if (self._previous is None or len(self._previous) != len(buf) or
+                (self.keyframe_interval and self.sequence % self.keyframe_interval == 0)):
+            kind = KEYFRAME
+            data = buf
+        else:
+            data = xor_bytes(buf, self._previous)
+        self._previous = buf
+
+        method, payload = RAW, data
+        if kind == DELTA:
+            rle = rle_encode(data)
+            if len(rle) < len(payload):
+                method, payload = RLE, rle
+        compressed = zlib.compress(data, self.level)
+        if len(compressed) < len(payload):
+            method, payload = ZLIB, compressed
+
+        packet = _PACKET_HEADER.pack(_PACKET_MAGIC, kind, method, self.sequence, len(buf)) + payload
+        self.sequence += 1
+        return packet
+
+
+class FrameDecoder:
+    """Decodifica i pacchetti di FrameEncoder e ricostruisce i frame"""
+
+    def __init__(self):
+        self.sequence = None
+        self._previous = None
+
+    def decode(self, packet):
+        """
+        Decodifica un pacchetto
+
+        Returns:
+            bytes: frame completo
+
+        Raises:
+            ValueError: pacchetto non valido o delta senza il frame di riferimento
+        """
+        magic, kind, method, sequence, length = _PACKET_HEADER.unpack_from(packet)
+        if magic != _PACKET_MAGIC:
+            raise ValueError("Pacchetto non valido")
+        if kind == DELTA and (self._previous is None or sequence != self.sequence + 1):
+            raise ValueError(f"Delta {sequence} ricevuto senza il frame precedente")
+
+        payload = memoryview(packet)[_PACKET_HEADER.size:]
+        if method == RLE:
+            data = rle_decode(payload, length)
+        elif method == ZLIB:
+            data = zlib.decompress(payload)
+        else:
+            data = bytes(payload)
+
+        frame = xor_bytes(data, self._previous) if kind == DELTA else bytes(data)
+        self._previous = frame
+        self.sequence = sequence
+        return frame
+
+
+def _send_packet(sock, packet):
+    sock.sendall(_LENGTH.pack(len(packet)) + packet)
+
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            return None
+        received += n
+    return buf
+
+
+def _recv_packet(sock):
+    header = _recv_exact(sock, _LENGTH.size)
+    if header is None:
+        return None
+    return _recv_exact(sock, _LENGTH.unpack(header)[0])
+
+
+class _ClientWriter:
+    """
+    Invio dei frame a un client su un thread dedicato
+
+    La coda è limitata: se il client è lento si scartano i frame più vecchi
+    ancora in coda (i delta vengono calcolati al momento dell'invio, quindi
+    il client riceve sempre una sequenza coerente).
+    """
+
+    def __init__(self, server, conn, keyframe_interval, queue_size):
+        self.conn = conn
+        self.encoder = FrameEncoder(keyframe_interval)
+        self.queue = queue.Queue(queue_size)
+        self._server = server
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def push(self, buf):
+        """Accoda un frame senza bloccare; restituisce il numero di frame scartati"""
+        dropped = 0
+        while True:
+            try:
+                self.queue.put_nowait(buf)
+                return dropped
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            buf = self.queue.get()
+            if buf is None:
+                return
+            packet = self.encoder.encode(buf)
+            try:
+                _send_packet(self.conn, packet)
+            except OSError:
+                # Errore o timeout di invio: il client viene scollegato
+                self._server._drop(self)
+                return
+            self._server._sent(len(packet))
+
+
+class FrameServer:
+    """
+    Server TCP che invia i frame ai client connessi
+
+    Ogni client ha il proprio encoder, una coda limitata e un thread di invio:
+    un client lento perde frame intermedi ma non rallenta gli altri né chi
+    chiama send(). Il primo frame che riceve è sempre un keyframe, poi solo delta.
+
+    Example:
+        server = FrameServer(port=9100)
+        server.send(canvas.get_buffer())
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, keyframe_interval=0, queue_size=2, send_timeout=5.0):
+        """
+        Args:
+            host, port: indirizzo di ascolto (port=0 = porta libera, vedi address)
+            keyframe_interval: ogni quanti frame inviarne uno completo (0 = solo il primo)
+            queue_size: frame in attesa per client prima di scartare i più vecchi
+            send_timeout: secondi di invio bloccato dopo cui un client viene scollegato
+        """
+        self.keyframe_interval = keyframe_interval
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._socket = socket.create_server((host, port))
+        self.address = self._socket.getsockname()
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._last_frame = None
+        self._closed = False
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.settimeout(self.send_timeout)
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                    return
+                writer = _ClientWriter(self, conn, self.keyframe_interval, self.queue_size)
+                self._clients[conn] = writer
+                if self._last_frame is not None:
+                    writer.push(self._last_frame)
+
+    def _sent(self, size):
+        with self._lock:
+            self.bytes_sent += size
+            self.frames_sent += 1
+
+    def _drop(self, writer):
+        with self._lock:
+            self._clients.pop(writer.conn, None)
+        writer.conn.close()
+
+    def send(self, buf):
+        """Accoda un frame per tutti i client connessi (non blocca)"""
+        buf = bytes(buf)
+        with self._lock:
+            self._last_frame = buf
+            for writer in self._clients.values():
+                self.frames_dropped += writer.push(buf)
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def close(self):
+        """Chiude il socket di ascolto e scollega tutti i client"""
+        with self._lock:
+            self._closed = True
+            writers = list(self._clients.values())
+            self._clients.clear()
+        # shutdown sveglia il thread bloccato in accept()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._thread.join()
+        for writer in writers:
+            writer.push(None)
+            try:
+                writer.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            writer.conn.close()
+        for writer in writers:
+            writer.thread.join()
+
+
+class FrameClient:
+    """
+    Client che riceve i frame e li invia al display
+
+    Example:
+        client = FrameClient('192.168.1.10', 9100, epd)
+        client.run()                     # blocca finché il server chiude
+    """
+
+    def __init__(self, host, port, epd=None, partial=False):
+        """
+        Args:
+            host, port: indirizzo del FrameServer
+            epd: display (Waveshare o SimulatedDisplay); None per usare solo on_frame
+            partial: usa displayPartial per i delta
+        """
+        self.epd = epd
+        self.partial = partial
+        self.decoder = FrameDecoder()
+        self.frames_received = 0
+        self.bytes_received = 0
+        self._socket = socket.create_connection((host, port))
+
+    def on_frame(self, frame, is_delta):
+        """Chiamato per ogni frame ricevuto; di default lo invia al display"""
+        if self.epd is None:
+            return
+        if is_delta and self.partial:
+            self.epd.displayPartial(frame)
+        else:
+            self.epd.display(frame)
+
+    def receive(self):
+        """
+        Riceve e mostra un frame
+
+        Returns:
+            bytes: il frame, o None se il server ha chiuso la connessione
+        """
+        packet = _recv_packet(self._socket)
+        if packet is None:
+            return None
+        frame = self.decoder.decode(packet)
+        self.frames_received += 1
+        self.bytes_received += len(packet) + _LENGTH.size
+        self.on_frame(frame, packet[2] == DELTA)
+        return frame
+
+    def run(self):
+        """Riceve frame finché la connessione resta aperta"""
+        while self.receive() is not None:
+            pass
+
+    def close(self):
+        self._socket.close()
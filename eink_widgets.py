@@ -5,16 +5,446 @@ Libreria di widget per display e-ink
 Componenti riutilizzabili per creare interfacce grafiche su display e-paper
 """
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageChops
 import os
 import io
+import json
 import math
-import cairosvg
+import mmap
+import struct
+import copy
+import hashlib
+import bisect
+import time
+import zlib
+import threading
+import warnings
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# cairosvg serve solo per rasterizzare gli SVG a runtime: con un IconAtlas se ne può fare a meno
+try:
+    import cairosvg
+except (ImportError, OSError):
+    cairosvg = None
+
+
+# Rotazioni supportate per l'export verso il buffer del pannello (gradi antiorari)
+_TRANSPOSE = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+# Font TrueType condivisi tra tutti i canvas: (percorso, dimensione) -> font
+_font_cache = {}
+_font_cache_lock = threading.Lock()
+
+
+def load_font(font_path, size):
+    """
+    Carica un font TrueType, condiviso tra tutti i canvas del processo
+
+    Args:
+        font_path: percorso al file TTF/TTC
+        size: dimensione del font in pixel
+    """
+    key = (font_path, size)
+    with _font_cache_lock:
+        font = _font_cache.get(key)
+        if font is None:
+            font = _font_cache[key] = ImageFont.truetype(font_path, size)
+    return font
+
+
+def _flatten_white(img):
+    """Immagine L/RGB con l'eventuale trasparenza composta su sfondo bianco"""
+    if img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode not in ('L', 'RGB'):
+        return img.convert('RGB')
+    return img
+
+
+def _to_1bit(img, size=None, box=None, dither=True, reducing_gap=None):
+    """
+    Conversione in B/N comune a SVG e immagini raster
+
+    Args:
+        img: immagine PIL di qualsiasi modalità
+        size: tupla (width, height) finale (None = dimensioni di box o dell'immagine)
+        box: regione (x0, y0, x1, y1) da ritagliare prima di ridimensionare
+        dither: Floyd-Steinberg (True) o soglia semplice (False)
+        reducing_gap: riduzione intera preliminare di Image.resize (più veloce)
+    """
+    img = _flatten_white(img)
+    if size or box:
+        if size is None:
+            size = (round(box[2] - box[0]), round(box[3] - box[1]))
+        img = img.resize(size, Image.Resampling.LANCZOS, box=box, reducing_gap=reducing_gap)
+    return img.convert('1', dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+
+
+# SVG già rasterizzati in B/N: (svg, size) -> immagine '1'
+_svg_cache = OrderedDict()
+_svg_cache_size = 64
+_svg_cache_lock = threading.Lock()
+
+
+def render_svg(svg_string, size=None):
+    """
+    Rasterizza un SVG in un'immagine B/N, con cache condivisa tra i canvas
+
+    Args:
+        svg_string: contenuto SVG come stringa
+        size: tupla (width, height) per ridimensionare
+
+    Returns:
+        immagine PIL in modalità '1' (da non modificare: è condivisa)
+    """
+    # size può arrivare come lista (es. da JSON): la chiave di cache deve essere hashable
+    if size is not None:
+        size = tuple(size)
+    key = (svg_string, size)
+    with _svg_cache_lock:
+        img = _svg_cache.get(key)
+        if img is not None:
+            _svg_cache.move_to_end(key)
+            return img
+
+    if cairosvg is None:
+        raise ImportError("cairosvg non disponibile: installalo (pip install cairosvg) o usa un IconAtlas")
+
+    # Converte SVG in immagine
+    png_data = cairosvg.svg2png(bytestring=svg_string.encode('utf-8'))
+    img = Image.open(io.BytesIO(png_data))
+
+    # Trasparenza su bianco, ridimensionamento e conversione in B/N
+    img = _to_1bit(img, size)
+
+    with _svg_cache_lock:
+        _svg_cache[key] = img
+        if len(_svg_cache) > _svg_cache_size:
+            _svg_cache.popitem(last=False)
+    return img
+
+
+# Formato dei font bitmap: magic, lunghezza dei metadati JSON, numero di glifi, offset dei bitmap
+_BFONT_MAGIC = b'EINKBFN1'
+_BFONT_HEADER = struct.Struct('<8sIII')
+# Indice dei glifi: codice, avanzamento, offset dalla linea di base, dimensioni, posizione dei bitmap
+_BFONT_GLYPH = struct.Struct('<IhhhHHI')
+
+# Caratteri inclusi di default: ASCII stampabile, Latin-1 e qualche simbolo tipografico
+BITMAP_FONT_CHARS = (''.join(chr(c) for c in range(32, 127)) + ''.join(chr(c) for c in range(160, 256)) +
+                     '€–—…‘’“”•')
+
+
+def build_bitmap_font(font_path, output_path, size, chars=BITMAP_FONT_CHARS):
+    """
+    Converte un font TrueType in un font bitmap 1-bit per una dimensione
+
+    I glifi vengono rasterizzati con l'hinting monocromatico (come fa PIL
+    su un'immagine '1') e salvati impacchettati a 1 bit, con un indice di
+    avanzamenti e offset. Richiede FreeType solo qui, non a runtime.
+
+    Args:
+        font_path: file TTF/TTC
+        output_path: file del font bitmap da scrivere (.ebf)
+        size: dimensione del font in pixel
+        chars: caratteri da includere
+
+    Returns:
+        numero di glifi scritti
+    """
+    font = ImageFont.truetype(font_path, size)
+    ascent, descent = font.getmetrics()
+    # Linea dell'ancora 'm' rispetto alla linea di base, come la calcola FreeType
+    middle = font.getbbox('A', '1', anchor='ls')[1] - font.getbbox('A', '1', anchor='lm')[1]
+    family, style = font.getname()
+
+    index = []
+    data = bytearray()
+    for ch in dict.fromkeys(chars):
+        x0, y0, x1, y1 = font.getbbox(ch, '1', anchor='ls')
+        width, height = max(0, x1 - x0), max(0, y1 - y0)
+        if width and height:
+            glyph = Image.new('1', (width, height), 0)
+            draw = ImageDraw.Draw(glyph)
+            draw.fontmode = '1'
+            draw.text((-x0, -y0), ch, font=font, fill=255, anchor='ls')
+            bitmap = glyph.tobytes('raw')
+        else:
+            x0 = y0 = width = height = 0
+            bitmap = b''
+        index.append(_BFONT_GLYPH.pack(ord(ch), round(font.getlength(ch, '1')), x0, y0, width, height, len(data)))
+        data += bitmap
+
+    meta = json.dumps({'family': family, 'style': style, 'size': size, 'ascent': ascent,
+                       'descent': descent, 'middle': middle}).encode('utf-8')
+    data_offset = (_BFONT_HEADER.size + len(meta) + len(index) * _BFONT_GLYPH.size + 7) // 8 * 8
+    with open(output_path, 'wb') as f:
+        f.write(_BFONT_HEADER.pack(_BFONT_MAGIC, len(meta), len(index), data_offset))
+        f.write(meta)
+        f.write(b''.join(index))
+        f.write(b'\0' * (data_offset - _BFONT_HEADER.size - len(meta) - len(index) * _BFONT_GLYPH.size))
+        f.write(data)
+    return len(index)
+
+
+class BitmapFont(ImageFont.BaseImageFont):
+    """
+    Font bitmap 1-bit creato con build_bitmap_font, senza FreeType a runtime
+
+    Il file viene mappato in memoria e i glifi vengono copiati direttamente
+    nella maschera del testo. Nei widget (Text, Paragraph, Table, ...) e con
+    textbbox/textlength si usa come un font TrueType, con gli stessi
+    ancoraggi; il kerning non viene applicato.
+
+    Implementa l'interfaccia dei font PIL (getbbox, getlength, getmask,
+    getmask2, getmetrics, getname) senza FreeType. ImageDraw.text applica gli
+    offset di getmask2 (e quindi gli ancoraggi) solo ai FreeTypeFont: i widget
+    disegnano il testo con _draw_text, che per i font bitmap incolla
+    direttamente la maschera della riga nella posizione giusta. Un draw.text
+    diretto ignora l'ancoraggio.
+
+    Example:
+        canvas.fonts['lato_medium'] = load_bitmap_font('pic/Lato-Regular-18.ebf')
+        canvas.add_widget(Text(10, 10, "12:34", font='lato_medium'))
+    """
+
+    # Maschere delle righe già composte: (testo, ancora) -> (maschera, offset)
+    _line_cache_size = 128
+
+    def __init__(self, path):
+        """
+        Args:
+            path: file del font bitmap
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_len, count, self._data_offset = _BFONT_HEADER.unpack_from(self._mmap)
+        if magic != _BFONT_MAGIC:
+            raise ValueError(f"{path} non è un font bitmap valido")
+        start = _BFONT_HEADER.size
+        meta = json.loads(self._mmap[start:start + meta_len].decode('utf-8'))
+        self.size = meta['size']
+        self.family, self.style = meta['family'], meta['style']
+        self.ascent, self.descent, self._middle = meta['ascent'], meta['descent'], meta['middle']
+        self._glyphs = {
+            chr(code): (advance, x0, y0, width, height, offset)
+            for code, advance, x0, y0, width, height, offset in _BFONT_GLYPH.iter_unpack(
+                self._mmap[start + meta_len:start + meta_len + count * _BFONT_GLYPH.size])
+        }
+        self._fallback = self._glyphs.get('?') or next(iter(self._glyphs.values()))
+        self._images = {}
+        self._lines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def getname(self):
+        return (self.family, self.style)
+
+    def getmetrics(self):
+        return (self.ascent, self.descent)
+
+    def _glyph_image(self, ch):
+        """Bitmap di un glifo come maschera '1' (255 = inchiostro)"""
+        img = self._images.get(ch)
+        if img is None:
+            _, _, _, width, height, offset = self._glyphs.get(ch, self._fallback)
+            start = self._data_offset + offset
+            img = self._images[ch] = Image.frombytes(
+                '1', (width, height), self._mmap[start:start + (width + 7) // 8 * height])
+        return img
+
+    def getlength(self, text, mode='', direction=None, features=None, language=None):
+        glyphs, fallback = self._glyphs, self._fallback
+        return sum(glyphs.get(ch, fallback)[0] for ch in text)
+
+    def _layout(self, text, anchor):
+        """Posizioni dei glifi e bounding box del testo rispetto al punto di ancoraggio"""
+        anchor = anchor or 'la'
+        glyphs, fallback = self._glyphs, self._fallback
+        placed = []
+        pen = 0
+        ink = None
+        for ch in text:
+            advance, x0, y0, width, height, _ = glyphs.get(ch, fallback)
+            if width:
+                placed.append((ch, pen + x0, y0))
+                ink = _union_bbox(ink, (pen + x0, y0, pen + x0 + width, y0 + height))
+            pen += advance
+        if ink is None:
+            ink = (0, 0, 0, 0)
+        # Come FreeType: in orizzontale conta anche l'avanzamento, in verticale solo l'inchiostro
+        bbox = (min(0, ink[0]), ink[1], max(pen, ink[2]), ink[3])
+        dx = {'l': 0, 'm': -((pen + 1) // 2), 'r': -pen}[anchor[0]]
+        dy = {'a': self.ascent, 't': -bbox[1], 'm': -self._middle, 's': 0,
+              'b': -bbox[3], 'd': -self.descent}[anchor[1]]
+        return placed, (bbox[0] + dx, bbox[1] + dy, bbox[2] + dx, bbox[3] + dy), dx, dy
+
+    def getbbox(self, text, mode='', direction=None, features=None, language=None, stroke_width=0,
+                anchor=None):
+        self._check_stroke(stroke_width)
+        return self._layout(text, anchor)[1]
+
+    @staticmethod
+    def _check_stroke(stroke_width):
+        if stroke_width:
+            raise ValueError("I font bitmap non supportano il contorno (stroke_width)")
+
+    def _line_mask(self, text, anchor=None):
+        """Maschera 'L' di una riga (255 = inchiostro) e offset dal punto di ancoraggio, in cache LRU"""
+        key = (text, anchor)
+        with self._lock:
+            cached = self._lines.get(key)
+            if cached is not None:
+                self._lines.move_to_end(key)
+                return cached
+
+        placed, bbox, dx, dy = self._layout(text, anchor)
+        mask = Image.new('L', (bbox[2] - bbox[0], bbox[3] - bbox[1]), 0)
+        for ch, x, y in placed:
+            mask.paste(255, (x + dx - bbox[0], y + dy - bbox[1]), self._glyph_image(ch))
+        result = (mask, bbox[:2])
+
+        with self._lock:
+            self._lines[key] = result
+            if len(self._lines) > self._line_cache_size:
+                self._lines.popitem(last=False)
+        return result
+
+    def getmask2(self, text, mode='', direction=None, features=None, language=None, stroke_width=0,
+                 anchor=None, ink=0, start=None, *args, **kwargs):
+        """
+        Maschera della riga e offset dal punto di ancoraggio, come FreeTypeFont.getmask2
+
+        La maschera ha solo i valori 0 e 255, quindi vale sia per mode '1' che
+        per 'L'; altri modi e il contorno non sono supportati.
+        """
+        if mode not in ('', '1', 'L'):
+            raise ValueError(f"Modo {mode} non supportato dai font bitmap (solo '1' e 'L')")
+        self._check_stroke(stroke_width)
+        # Come per tutti i font PIL, ImageDraw vuole l'immagine core (Image.im)
+        mask, offset = self._line_mask(text, anchor)
+        return mask.im, offset
+
+    def getmask(self, text, mode='', *args, **kwargs):
+        return self.getmask2(text, mode, *args, **kwargs)[0]
+
+    def font_variant(self, font=None, size=None, *args, **kwargs):
+        """
+        Lo stesso font a un'altra dimensione: il file <nome>-<size>.ebf accanto a questo
+
+        Raises:
+            ValueError: se si chiede un altro file di font o la dimensione non è stata generata
+        """
+        if font is not None and font != self.path:
+            raise ValueError("Un font bitmap non può cambiare file: usa load_bitmap_font")
+        if size is None or size == self.size:
+            return self
+        stem = os.path.splitext(self.path)[0].rpartition('-')[0]
+        path = f"{stem}-{size}.ebf"
+        if not stem or not os.path.exists(path):
+            raise ValueError(f"Font bitmap di dimensione {size} non trovato ({path}): "
+                             "generalo con build_bitmap_font")
+        return load_bitmap_font(path)
+
+    def close(self):
+        """Chiude il file mappato"""
+        self._images = {}
+        self._mmap.close()
+        self._file.close()
+
+
+# Font bitmap condivisi tra tutti i canvas: percorso -> font
+_bitmap_font_cache = {}
+
+
+def load_bitmap_font(path):
+    """Carica un font bitmap (.ebf), condiviso tra tutti i canvas del processo"""
+    with _font_cache_lock:
+        font = _bitmap_font_cache.get(path)
+        if font is None:
+            font = _bitmap_font_cache[path] = BitmapFont(path)
+    return font
+
+
+class _SpatialGrid:
+    """
+    Indice spaziale a griglia uniforme dei bounding box dei widget
+
+    Ogni widget è registrato nelle celle che il suo bounding box tocca, così
+    le ricerche per regione o per punto guardano solo i widget vicini.
+    """
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._bboxes = {}
+
+    def _cells_in(self, bbox):
+        c = self.cell_size
+        return [(col, row)
+                for row in range(math.floor(bbox[1]) // c, (math.ceil(bbox[3]) - 1) // c + 1)
+                for col in range(math.floor(bbox[0]) // c, (math.ceil(bbox[2]) - 1) // c + 1)]
+
+    def __contains__(self, item):
+        return item in self._bboxes
+
+    def insert(self, item, bbox):
+        self._bboxes[item] = bbox
+        for cell in self._cells_in(bbox):
+            self._cells.setdefault(cell, set()).add(item)
+
+    def remove(self, item):
+        bbox = self._bboxes.pop(item)
+        for cell in self._cells_in(bbox):
+            items = self._cells[cell]
+            items.discard(item)
+            if not items:
+                del self._cells[cell]
+
+    def move(self, item, bbox):
+        """Aggiorna il bounding box di un elemento (tocca solo le celle cambiate)"""
+        old_cells = set(self._cells_in(self._bboxes[item]))
+        new_cells = set(self._cells_in(bbox))
+        for cell in old_cells - new_cells:
+            items = self._cells[cell]
+            items.discard(item)
+            if not items:
+                del self._cells[cell]
+        for cell in new_cells - old_cells:
+            self._cells.setdefault(cell, set()).add(item)
+        self._bboxes[item] = bbox
+
+    def query(self, bbox):
+        """Elementi il cui bounding box interseca bbox"""
+        found = set()
+        for cell in self._cells_in(bbox):
+            found.update(self._cells.get(cell, ()))
+        return [item for item in found if _intersect_bbox(self._bboxes[item], bbox)]
+
+    def query_point(self, x, y):
+        """Elementi il cui bounding box contiene il punto (x, y)"""
+        return self.query((x, y, x + 1, y + 1))
 
 
 class EinkCanvas:
     """Canvas base per disegnare su display e-ink"""
 
+    # Modalità dell'immagine PIL del canvas
+    mode = '1'
+
+    # add_widgets può rasterizzare i widget in parallelo su self.image
+    _parallel_add = True
+
     def __init__(self, width, height, picdir=None):
         """
         Args:
@@ -24,22 +454,31 @@ class EinkCanvas:
         """
         self.width = width
         self.height = height
-        self.image = Image.new('1', (width, height), 255)
+        self.image = Image.new(self.mode, (width, height), 255)
         self.draw = ImageDraw.Draw(self.image)
         self.picdir = picdir or os.path.join(os.path.dirname(__file__), 'pic')
+        self.background = 255
+        self.widgets = []
+        self._bboxes = {}
+        self._invalid = {}
+        self._invalid_region = None
+        self._z = {}
+        self._grid = _SpatialGrid()
+        self._unindexed = []
+        self._out_buffers = None
 
         # Font di default
         self._load_fonts()
 
     def _load_fonts(self):
-        """Carica i font di default"""
+        """Carica i font di default (i font bitmap Font-<size>.ebf in picdir hanno la precedenza)"""
         font_path = os.path.join(self.picdir, 'Font.ttc')
         try:
             self.fonts = {
-                'small': ImageFont.truetype(font_path, 14),
-                'medium': ImageFont.truetype(font_path, 18),
-                'large': ImageFont.truetype(font_path, 24),
-                'xlarge': ImageFont.truetype(font_path, 48)
+                'small': self._default_font(font_path, 14),
+                'medium': self._default_font(font_path, 18),
+                'large': self._default_font(font_path, 24),
+                'xlarge': self._default_font(font_path, 48)
             }
         except:
             # Fallback a font di default se Font.ttc non esiste
@@ -50,6 +489,22 @@ class EinkCanvas:
                 'xlarge': ImageFont.load_default()
             }
 
+    def _default_font(self, font_path, size):
+        bitmap_path = os.path.join(self.picdir, f'Font-{size}.ebf')
+        if os.path.exists(bitmap_path):
+            return load_bitmap_font(bitmap_path)
+        return load_font(font_path, size)
+
+    def add_bitmap_font(self, name, path):
+        """
+        Aggiunge un font bitmap creato con build_bitmap_font.py (senza FreeType)
+
+        Example:
+            canvas.add_bitmap_font('lato_medium', 'pic/Lato-Regular-18.ebf')
+            canvas.add_widget(Text(10, 10, "Ciao", font='lato_medium'))
+        """
+        self.fonts[name] = load_bitmap_font(path)
+
     def add_custom_font(self, name, font_path, size):
         """
         Aggiunge un font personalizzato
@@ -64,7 +519,7 @@ class EinkCanvas:
             canvas.add_widget(Text(10, 10, "Ciao", font='lato_medium'))
         """
         try:
-            self.fonts[name] = ImageFont.truetype(font_path, size)
+            self.fonts[name] = load_font(font_path, size)
         except Exception as e:
             print(f"Errore nel caricamento del font {font_path}: {e}")
             self.fonts[name] = self.fonts.get('medium', ImageFont.load_default())
@@ -93,616 +548,4630 @@ class EinkCanvas:
     def clear(self, color=255):
         """Pulisce il canvas"""
         self.draw.rectangle((0, 0, self.width, self.height), fill=color)
+        self._forget_widgets()
+        self.background = color
+
+    def _forget_widgets(self):
+        """Rimuove tutti i widget mantenuti dal canvas"""
+        for widget in self.widgets:
+            widget._canvas = None
+        self.widgets = []
+        self._bboxes = {}
+        self._invalid = {}
+        self._invalid_region = None
+        self._z = {}
+        self._grid = _SpatialGrid()
+        self._unindexed = []
 
     def get_image(self):
         """Restituisce l'immagine PIL"""
         return self.image
 
-    def add_widget(self, widget):
-        """Aggiunge un widget al canvas"""
-        widget.draw(self.draw, self.image, self.fonts)
-        return self
-
+    def get_buffer(self, rotation=0):
+        """
+        Restituisce il buffer 1-bit impacchettato nel formato del driver Waveshare
 
-class Widget:
-    """Classe base per tutti i widget"""
+        Args:
+            rotation: rotazione antioraria in gradi (0, 90, 180, 270)
 
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+        Example:
+            # Equivale a epd.getbuffer(canvas.get_image().rotate(180)) su 2.13" V4
+            epd.display(canvas.get_buffer(rotation=270))
+        """
+        image = self.image
+        if rotation:
+            image = image.transpose(_TRANSPOSE[rotation])
+        return self._output(rotation, image.tobytes('raw'))
 
-    def draw(self, draw, image, fonts):
-        """Da implementare nelle sottoclassi"""
-        raise NotImplementedError
+    def enable_steady_state(self, image_blocks=64):
+        """
+        Modalità a regime per i loop di refresh che girano per settimane
 
+        - get_buffer() (e get_plane_buffers()) restituisce sempre lo stesso
+          bytearray per rotazione, aggiornato sul posto: va usato o copiato
+          prima della chiamata successiva
+        - PIL tiene da parte fino a image_blocks blocchi di memoria delle
+          immagini temporanee (rotazioni, maschere, sotto-immagini) e li
+          riusa invece di liberarli e riallocarli a ogni frame
 
-class Text(Widget):
-    """Widget per testo semplice"""
+        I widget vanno creati una volta e aggiornati con set()/update():
+        così, dopo i primi frame, un aggiornamento non lascia allocazioni.
 
-    def __init__(self, x, y, text, font_size='medium', font=None, fill=0, anchor=None):
-        """
-        Args:
-            x, y: posizione
-            text: testo da visualizzare
-            font_size: 'small', 'medium', 'large', 'xlarge' (usato se font=None)
-            font: nome del font personalizzato (es. 'lato_medium', 'custom_title')
-                  se specificato, ha priorità su font_size
-            fill: colore (0=nero, 255=bianco)
-            anchor: ancora del testo ('lt', 'mm', etc.)
+        Returns:
+            il canvas stesso
         """
-        super().__init__(x, y)
-        self.text = str(text)
-        self.font_size = font_size
-        self.font = font  # Font personalizzato (opzionale)
-        self.fill = fill
-        self.anchor = anchor
+        if self._out_buffers is None:
+            self._out_buffers = {}
+        Image.core.set_blocks_max(max(Image.core.get_blocks_max(), image_blocks))
+        return self
 
-    def draw(self, draw, image, fonts):
-        # Usa font personalizzato se specificato, altrimenti usa font_size
-        if self.font and self.font in fonts:
-            font = fonts[self.font]
+    def _output(self, key, data):
+        """Buffer di uscita con i dati: nuovo, oppure quello riusato in modalità a regime"""
+        if self._out_buffers is None:
+            return bytearray(data)
+        buf = self._out_buffers.get(key)
+        if buf is None or len(buf) != len(data):
+            buf = self._out_buffers[key] = bytearray(data)
         else:
-            font = fonts.get(self.font_size, fonts.get('medium', ImageFont.load_default()))
+            buf[:] = data
+        return buf
 
-        if self.anchor:
-            draw.text((self.x, self.y), self.text, font=font, fill=self.fill, anchor=self.anchor)
-        else:
-            draw.text((self.x, self.y), self.text, font=font, fill=self.fill)
+    def _output_buffer(self, key, size):
+        """Buffer di uscita da riempire sul posto: nuovo, oppure quello riusato in modalità a regime"""
+        if self._out_buffers is None:
+            return bytearray(size)
+        buf = self._out_buffers.get(key)
+        if buf is None or len(buf) != size:
+            buf = self._out_buffers[key] = bytearray(size)
+        return buf
 
+    def add_widget(self, widget):
+        """
+        Aggiunge un widget al canvas
 
-class Box(Widget):
-    """Widget per box/rettangoli"""
+        Il canvas mantiene un riferimento a ogni widget aggiunto (per update()
+        e render_region()): in un loop che ricrea i widget a ogni refresh va
+        chiamato clear() prima di aggiungerli, altrimenti la lista cresce
+        all'infinito. Per i widget già presenti basta modificarli con set().
+        """
+        widget.draw(self.draw, self.image, self.fonts)
+        self._register_widget(widget)
+        return self
 
-    def __init__(self, x, y, width, height, fill=255, outline=0, outline_width=1):
+    def add_widgets(self, widgets, max_workers=None):
         """
+        Aggiunge più widget, rasterizzandoli in parallelo se max_workers > 1
+
+        Ogni widget viene disegnato in un tile privato su un pool di thread e i
+        tile vengono composti nell'ordine originale, quindi il risultato è
+        identico a chiamare add_widget() per ognuno. Conviene con widget
+        costosi (SVG, DonutChart, testi grandi) su schede multi-core: PIL e
+        cairo rilasciano il GIL durante buona parte del lavoro.
+
         Args:
-            x, y: posizione top-left
-            width, height: dimensioni
-            fill: colore riempimento
-            outline: colore bordo
-            outline_width: spessore bordo
+            widgets: widget da aggiungere, in ordine di disegno
+            max_workers: thread di rendering (None o 1 = seriale)
         """
-        super().__init__(x, y)
-        self.width = width
-        self.height = height
-        self.fill = fill
-        self.outline = outline
-        self.outline_width = outline_width
+        widgets = list(widgets)
+        if not (self._parallel_add and max_workers and max_workers > 1 and len(widgets) > 1):
+            for widget in widgets:
+                self.add_widget(widget)
+            return self
 
-    def draw(self, draw, image, fonts):
-        draw.rectangle(
-            (self.x, self.y, self.x + self.width, self.y + self.height),
-            fill=self.fill,
-            outline=self.outline,
-            width=self.outline_width
-        )
+        # I widget che non si sovrappongono ai precedenti del gruppo si disegnano
+        # direttamente su una copia del canvas; gli altri su fondo bianco e su
+        # fondo nero, per ricavare quali pixel hanno dipinto. Quelli che escono
+        # dal canvas (o senza bbox) si disegnano sul canvas, al loro turno: PIL
+        # taglia le loro forme sul bordo dello schermo, non su quello del tile
+        covered = _SpatialGrid()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            jobs = []
+            for widget in widgets:
+                bbox = widget.get_bbox(self.fonts)
+                region = _clip_bbox(bbox or (0, 0, self.width, self.height), self.width, self.height)
+                if bbox is None or not (bbox[0] >= 0 and bbox[1] >= 0 and
+                                        bbox[2] <= self.width and bbox[3] <= self.height):
+                    if region is not None:
+                        covered.insert(widget, region)
+                    jobs.append((widget, None, None))
+                    continue
+                base = None
+                if not covered.query(region):
+                    base = self.image.crop(self._padded_region(region))
+                covered.insert(widget, region)
+                jobs.append((widget, region, pool.submit(self._rasterize_tile, widget, region, base)))
 
+            for widget, region, job in jobs:
+                if job is None:
+                    widget.draw(self.draw, self.image, self.fonts)
+                else:
+                    tiles = job.result()
+                    if len(tiles) == 1:
+                        self.image.paste(tiles[0], region[:2])
+                    elif not self._composite_tile(region, *tiles):
+                        widget.draw(self.draw, self.image, self.fonts)
+                self._register_widget(widget)
+        return self
 
-class StatusBox(Widget):
-    """Box con testo per indicatori di stato (ON/OFF)"""
+    def _rasterize_tile(self, widget, region, base=None):
+        """
+        Disegna un widget in tile privati (eseguito nei thread di add_widgets)
 
-    def __init__(self, x, y, width, height, text, is_active=False, font_size='medium'):
+        Returns:
+            [tile] disegnato su base, oppure [tile su bianco, tile su nero]
         """
-        Args:
-            x, y: posizione
-            width, height: dimensioni
-            text: testo da visualizzare
-            is_active: True per stato attivo (invertito)
-            font_size: dimensione font
+        padded = self._padded_region(region)
+        widget = widget.translated(-padded[0], -padded[1])
+        backgrounds = [base] if base is not None else [
+            self._new_region_image(padded, self.mode, color) for color in (255, 0)]
+        for tile in backgrounds:
+            widget.draw(ImageDraw.Draw(tile), tile, self.fonts)
+        return [self._crop_region(tile, region, padded) for tile in backgrounds]
+
+    def _composite_tile(self, region, white, black):
         """
-        super().__init__(x, y)
-        self.width = width
-        self.height = height
-        self.text = text
-        self.is_active = is_active
-        self.font_size = font_size
+        Compone sul canvas i pixel dipinti da un widget (uguali sui due fondi)
 
-    def draw(self, draw, image, fonts):
-        # Box esterno
-        draw.rectangle(
-            (self.x, self.y, self.x + self.width, self.y + self.height),
-            outline=0, fill=255
-        )
+        Returns:
+            False se il widget ha fuso o invertito il fondo (es. testo antialiasing):
+            in quel caso il tile non basta e va ridisegnato sul canvas
+        """
+        white_l, black_l = white.convert('L'), black.convert('L')
+        diff = ImageChops.difference(white_l, black_l)
+        if ImageChops.subtract(black_l, white_l).getbbox() or diff.point(_PARTIAL_LUT).getbbox():
+            return False
+        self.image.paste(white, region[:2], diff.point(_SAME_LUT, '1'))
+        return True
 
-        # Box interno (invertito se attivo)
-        draw.rectangle(
-            (self.x + 2, self.y + 2, self.x + self.width - 2, self.y + self.height - 2),
-            outline=0, fill=0 if self.is_active else 255
-        )
+    def _register_widget(self, widget):
+        """Registra un widget già disegnato (verrà indicizzato alla prima ricerca)"""
+        if widget._canvas is self and widget in self._z:
+            warnings.warn("Widget aggiunto due volte allo stesso canvas: usa clear() prima di "
+                          "ridisegnare, o modifica il widget con set() e chiama update()",
+                          RuntimeWarning, stacklevel=3)
+            return
+        self.widgets.append(widget)
+        widget._canvas = self
+        self._z[widget] = len(self._z)
+        self._unindexed.append(widget)
 
-        # Testo centrato (colore invertito se attivo)
-        text_fill = 255 if self.is_active else 0
-        font = fonts.get(self.font_size, fonts['medium'])
-        text_x = self.x + self.width / 2
-        text_y = self.y + self.height / 2
-        draw.text((text_x, text_y + 1), self.text, font=font, fill=text_fill, anchor="mm")
+    def _index_widgets(self):
+        """Inserisce nell'indice spaziale i widget aggiunti dall'ultima ricerca"""
+        for widget in self._unindexed:
+            self._grid.insert(widget, self._widget_bbox(widget))
+        self._unindexed = []
 
+    def widgets_in(self, bbox):
+        """
+        Widget il cui bounding box interseca bbox, in ordine di disegno
 
-class NotchBar(Widget):
-    """Barra verticale con tacche discrete"""
+        Usa l'indice spaziale: il costo dipende dai widget vicini, non da
+        quanti ce ne sono sul canvas.
+        """
+        self._index_widgets()
+        return sorted(self._grid.query(bbox), key=self._z.__getitem__)
 
-    def __init__(self, x, y, width, height, level, num_notches=5, spacing=3):
+    def widget_at(self, x, y):
         """
-        Args:
-            x, y: posizione top-left
-            width: larghezza barra
-            height: altezza barra
-            level: livello in percentuale (0-100)
-            num_notches: numero di tacche
-            spacing: spazio tra le tacche
+        Widget più in alto nel punto (x, y), None se non ce ne sono
+
+        Utile con i display touch: le coordinate vanno prima riportate
+        all'orientamento del canvas.
         """
-        super().__init__(x, y)
-        self.width = width
-        self.height = height
-        self.level = level
-        self.num_notches = num_notches
-        self.spacing = spacing
+        self._index_widgets()
+        hits = self._grid.query_point(x, y)
+        return max(hits, key=self._z.__getitem__) if hits else None
 
-    def draw(self, draw, image, fonts):
-        # Calcola quante tacche devono essere piene
-        filled_notches = round(self.level * self.num_notches / 100)
-        filled_notches = min(self.num_notches, max(0, filled_notches))
+    def _widget_bbox(self, widget):
+        """Bounding box di un widget (con cache), tutto il canvas se non è nota"""
+        bbox = self._bboxes.get(widget)
+        if bbox is None:
+            bbox = widget.get_bbox(self.fonts) or (0, 0, self.width, self.height)
+            self._bboxes[widget] = bbox
+        return bbox
 
-        # Calcola dimensioni tacche
-        total_spacing = self.spacing * (self.num_notches - 1)
-        available_height = self.height - total_spacing
-        notch_height = available_height // self.num_notches
+    def invalidate_widget(self, widget):
+        """
+        Segna un widget da ridisegnare al prossimo update()
 
-        # Disegna le tacche dal basso verso l'alto
-        for i in range(self.num_notches):
-            y_bottom = self.y + self.height - (i * (notch_height + self.spacing))
-            y_top = y_bottom - notch_height
+        Va chiamato prima di modificare il widget (lo fa Widget.set), così da
+        ricordare anche l'area occupata in precedenza.
+        """
+        if widget._canvas is self and widget not in self._invalid:
+            self._invalid[widget] = self._widget_bbox(widget)
+            del self._bboxes[widget]
 
-            # Bordo della tacca
-            draw.rectangle(
-                (self.x, y_top, self.x + self.width, y_bottom),
-                outline=0, fill=255
-            )
+    def update(self):
+        """
+        Ridisegna solo i widget invalidati (e quelli che si sovrappongono a loro)
 
-            # Riempimento se necessario
-            if i < filled_notches:
-                draw.rectangle(
-                    (self.x + 2, y_top + 2, self.x + self.width - 2, y_bottom - 2),
-                    fill=0
-                )
+        Più modifiche allo stesso widget tra due update() vengono accorpate in
+        un solo ridisegno; se nulla è cambiato non viene disegnato niente.
 
+        Returns:
+            regione (x0, y0, x1, y1) modificata, oppure None
+        """
+        if not self._invalid and self._invalid_region is None:
+            return None
+        region = self._invalid_region
+        for widget, old_bbox in self._invalid.items():
+            bbox = self._widget_bbox(widget)
+            if widget in self._grid:
+                self._grid.move(widget, bbox)
+            region = _union_bbox(region, _union_bbox(old_bbox, bbox))
+        self._invalid = {}
+        self._invalid_region = None
+        return self.render_region(region)
 
-class ProgressBar(Widget):
-    """Barra di progresso orizzontale"""
+    def invalidate(self, bbox=None):
+        """Segna una regione (None = tutto il canvas) da ridisegnare al prossimo update()"""
+        self._invalid_region = _union_bbox(self._invalid_region, bbox or (0, 0, self.width, self.height))
 
-    def __init__(self, x, y, width, height, progress, show_percentage=True, font_size='small'):
-        """
-        Args:
-            x, y: posizione
-            width, height: dimensioni
-            progress: progresso in percentuale (0-100)
-            show_percentage: mostra il testo con la percentuale
-            font_size: dimensione font per la percentuale
+    def render_region(self, bbox):
         """
-        super().__init__(x, y)
-        self.width = width
-        self.height = height
-        self.progress = max(0, min(100, progress))
-        self.show_percentage = show_percentage
-        self.font_size = font_size
+        Ridisegna subito una regione del canvas
 
-    def draw(self, draw, image, fonts):
-        # Bordo esterno
-        draw.rectangle(
-            (self.x, self.y, self.x + self.width, self.y + self.height),
-            outline=0, fill=255
-        )
+        Vengono disegnati solo i widget che la intersecano e, con draw_clipped,
+        solo la loro parte dentro la regione: il costo è proporzionale
+        all'area ridisegnata, non a tutto lo schermo.
+
+        Returns:
+            regione (x0, y0, x1, y1) effettivamente ridisegnata, oppure None
+        """
+        region = _clip_bbox(bbox, self.width, self.height)
+        if region is not None:
+            self._render_region(region)
+        return region
+
+    def _region_widgets(self, region):
+        """Widget che intersecano una regione, in ordine di disegno"""
+        return [widget for widget in self.widgets_in(region)
+                if _intersect_bbox(self._widget_bbox(widget), region)]
+
+    def _padded_region(self, region, widgets=()):
+        """
+        Area della sotto-immagine in cui ridisegnare una regione
+
+        È la regione allargata di _RENDER_PAD pixel, senza uscire dal canvas:
+        sui bordi dello schermo PIL taglia le forme esattamente come nel
+        disegno a pieno formato. Verso l'alto e verso sinistra arriva anche
+        all'origine dei widget senza _integer_coords: PIL arrotonda i vertici
+        calcolati in modo simmetrico rispetto a zero, quindi un vertice che
+        diventasse negativo nella sotto-immagine cadrebbe su un altro pixel.
+        """
+        x0, y0, x1, y1 = region
+        x0, y0 = x0 - _RENDER_PAD, y0 - _RENDER_PAD
+        for widget in widgets:
+            if not widget._integer_coords:
+                bbox = self._widget_bbox(widget)
+                x0, y0 = min(x0, math.floor(bbox[0])), min(y0, math.floor(bbox[1]))
+        return (max(0, x0), max(0, y0),
+                min(self.width, x1 + _RENDER_PAD), min(self.height, y1 + _RENDER_PAD))
+
+    def _draw_region(self, region, padded, draw, image, widgets):
+        """
+        Disegna dei widget nella sotto-immagine di una regione
+
+        La sotto-immagine copre padded (da _padded_region); i widget vengono
+        disegnati con la regione come rettangolo di clip.
+        """
+        dx, dy = -padded[0], -padded[1]
+        clip = (region[0] + dx, region[1] + dy, region[2] + dx, region[3] + dy)
+        for widget in widgets:
+            widget.translated(dx, dy).draw_clipped(draw, image, self.fonts, clip)
+
+    @staticmethod
+    def _new_region_image(padded, mode, color):
+        """Sotto-immagine che copre padded"""
+        x0, y0, x1, y1 = padded
+        return Image.new(mode, (x1 - x0, y1 - y0), color)
+
+    @staticmethod
+    def _crop_region(img, region, padded):
+        """Ritaglia la regione da una sotto-immagine disegnata con _draw_region"""
+        x0, y0, x1, y1 = region
+        px, py = padded[:2]
+        return img.crop((x0 - px, y0 - py, x1 - px, y1 - py))
+
+    def _render_region(self, region):
+        """Ridisegna da zero una regione del canvas"""
+        widgets = self._region_widgets(region)
+        padded = self._padded_region(region, widgets)
+        img = self._new_region_image(padded, self.mode, self.background)
+        self._draw_region(region, padded, ImageDraw.Draw(img), img, widgets)
+        self.image.paste(self._crop_region(img, region, padded), region[:2])
+
+
+# Tabelle per confrontare i tile disegnati su bianco e su nero: pixel uguali
+# (dipinti dal widget) e pixel fusi col fondo
+_SAME_LUT = [255] + [0] * 255
+_PARTIAL_LUT = [0] + [255] * 254 + [0]
+
+# Margine attorno alle sotto-immagini di rendering: PIL può arrotondare in modo
+# diverso le forme tagliate dal bordo dell'immagine, quindi si disegna un po'
+# più grande e si ritaglia (così l'output è identico al disegno a pieno formato).
+# Sui bordi del canvas il margine si ferma al bordo (vedi _padded_region)
+_RENDER_PAD = 8
+
+# Tabella per invertire l'ordine dei bit in un byte (rotazione di 180° del buffer)
+_REVERSE_BITS = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+class TiledCanvas(EinkCanvas):
+    """
+    Canvas a tile per pannelli grandi (7.5"-13.3")
+
+    Non mantiene un'immagine PIL a pieno formato: il frame è un buffer 1-bit
+    impacchettato e i widget vengono disegnati tile per tile, solo nei tile
+    che toccano. Ogni tile si ridisegna in modo indipendente (anche in
+    parallelo) e solo i tile modificati vengono copiati nel buffer, così la
+    memoria di picco resta limitata a pochi tile alla volta (allargati fino
+    all'origine dei widget senza _integer_coords che li attraversano).
+
+    Example:
+        canvas = TiledCanvas(800, 480, picdir, tile_size=128)
+        canvas.add_widget(Text(10, 10, "Magazzino", font_size='large'))
+        for x0, y0, x1, y1 in canvas.render():
+            ...  # refresh parziale della regione
+        epd.display(canvas.get_buffer())
+    """
+
+    # I widget vengono disegnati tile per tile in render() (già in parallelo)
+    _parallel_add = False
+
+    def __init__(self, width, height, picdir=None, tile_size=128, max_workers=None):
+        """
+        Args:
+            width: larghezza del canvas
+            height: altezza del canvas
+            picdir: directory con font e risorse
+            tile_size: lato dei tile in pixel (multiplo di 8)
+            max_workers: thread per il rendering dei tile (None o 1 = seriale)
+        """
+        if tile_size % 8:
+            raise ValueError("tile_size deve essere un multiplo di 8")
+
+        self.width = width
+        self.height = height
+        self.picdir = picdir or os.path.join(os.path.dirname(__file__), 'pic')
+        self.tile_size = tile_size
+        self.max_workers = max_workers
+        self.cols = (width + tile_size - 1) // tile_size
+        self.rows = (height + tile_size - 1) // tile_size
+        self.stride = (width + 7) // 8
+        self.framebuffer = bytearray(b'\xff' * (self.stride * height))
+        self.background = 255
+        self.widgets = []
+        self._bboxes = {}
+        self._invalid = {}
+        self._invalid_region = None
+        self._z = {}
+        self._grid = _SpatialGrid(tile_size)
+        self._unindexed = []
+        self._out_buffers = None
+        self._tile_widgets = {}
+        self.dirty_tiles = set()
+
+        # Font di default
+        self._load_fonts()
+
+    def _tile_rect(self, col, row):
+        x0, y0 = col * self.tile_size, row * self.tile_size
+        return (x0, y0, min(x0 + self.tile_size, self.width), min(y0 + self.tile_size, self.height))
+
+    def _tiles_in(self, bbox):
+        """Tile (colonna, riga) che intersecano un bounding box"""
+        if bbox is None:
+            bbox = (0, 0, self.width, self.height)
+        bbox = _clip_bbox(bbox, self.width, self.height)
+        if bbox is None:
+            return []
+        t = self.tile_size
+        return [(col, row)
+                for row in range(bbox[1] // t, (bbox[3] - 1) // t + 1)
+                for col in range(bbox[0] // t, (bbox[2] - 1) // t + 1)]
+
+    def clear(self, color=255):
+        """Pulisce il canvas"""
+        self.framebuffer[:] = (b'\xff' if color else b'\x00') * len(self.framebuffer)
+        self.background = color
+        self._forget_widgets()
+        self._tile_widgets = {}
+        self.dirty_tiles = {(c, r) for r in range(self.rows) for c in range(self.cols)}
+
+    def add_widget(self, widget):
+        """Aggiunge un widget: verrà disegnato al prossimo render() nei tile che tocca"""
+        self._register_widget(widget)
+        for tile in self._tiles_in(self._widget_bbox(widget)):
+            self._tile_widgets.setdefault(tile, []).append(widget)
+            self.dirty_tiles.add(tile)
+        return self
+
+    def _retile_invalid(self):
+        """Sposta i widget invalidati nei tile della loro nuova posizione"""
+        for widget, old_bbox in self._invalid.items():
+            bbox = self._widget_bbox(widget)
+            if widget in self._grid:
+                self._grid.move(widget, bbox)
+            for tile in self._tiles_in(old_bbox):
+                self._tile_widgets[tile].remove(widget)
+                self.dirty_tiles.add(tile)
+            for tile in self._tiles_in(bbox):
+                # Inserisce rispettando l'ordine di disegno originale
+                bisect.insort(self._tile_widgets.setdefault(tile, []), widget, key=self._z.__getitem__)
+                self.dirty_tiles.add(tile)
+        self._invalid = {}
+
+    def update(self):
+        """
+        Ridisegna i tile dei widget invalidati
+
+        Returns:
+            regione (x0, y0, x1, y1) che comprende i tile aggiornati, oppure None
+        """
+        region = None
+        for rect in self.render():
+            region = _union_bbox(region, rect)
+        return region
+
+    def invalidate(self, bbox=None):
+        """Segna come da ridisegnare i tile che intersecano bbox (None = tutto)"""
+        self.dirty_tiles.update(self._tiles_in(bbox))
+
+    def render_region(self, bbox):
+        """Ridisegna subito i tile che intersecano bbox (e gli altri tile già da aggiornare)"""
+        self.invalidate(bbox)
+        return self.update()
+
+    def _render_tile(self, tile):
+        x0, y0, x1, y1 = rect = self._tile_rect(*tile)
+        widgets = self._tile_widgets.get(tile)
+        tile_bytes = (x1 - x0 + 7) // 8
+
+        if widgets:
+            padded = self._padded_region(rect, widgets)
+            img = self._new_region_image(padded, '1', self.background)
+            self._draw_region(rect, padded, ImageDraw.Draw(img), img, widgets)
+            data = self._crop_region(img, rect, padded).tobytes('raw')
+        else:
+            data = (b'\xff' if self.background else b'\x00') * (tile_bytes * (y1 - y0))
+
+        # Copia le righe del tile nel buffer (x0 è allineato al byte)
+        fb = self.framebuffer
+        offset = y0 * self.stride + x0 // 8
+        for row in range(y1 - y0):
+            fb[offset:offset + tile_bytes] = data[row * tile_bytes:(row + 1) * tile_bytes]
+            offset += self.stride
+        return rect
+
+    def render(self):
+        """
+        Ridisegna i tile modificati
+
+        Returns:
+            lista delle regioni (x0, y0, x1, y1) aggiornate nel buffer
+        """
+        self._retile_invalid()
+        tiles = sorted(self.dirty_tiles, key=lambda t: (t[1], t[0]))
+        self.dirty_tiles = set()
+        if self.max_workers and self.max_workers > 1 and len(tiles) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                return list(pool.map(self._render_tile, tiles))
+        return [self._render_tile(tile) for tile in tiles]
+
+    def get_region_buffer(self, bbox):
+        """
+        Buffer 1-bit impacchettato di una regione, per i refresh parziali
+
+        La regione viene allargata ai byte interi in orizzontale.
+
+        Returns:
+            tupla ((x0, y0, x1, y1) effettivi, bytearray)
+        """
+        x0 = (bbox[0] // 8) * 8
+        x1 = min(self.width, ((bbox[2] + 7) // 8) * 8)
+        y0, y1 = bbox[1], bbox[3]
+        start, end = x0 // 8, (x1 + 7) // 8
+        buf = bytearray()
+        for y in range(y0, y1):
+            row = y * self.stride
+            buf += self.framebuffer[row + start:row + end]
+        return (x0, y0, x1, y1), buf
+
+    def get_image(self):
+        """Restituisce l'immagine PIL del frame (alloca un'immagine a pieno formato)"""
+        if self.dirty_tiles or self._invalid:
+            self.render()
+        return Image.frombytes('1', (self.width, self.height), bytes(self.framebuffer))
+
+    def get_buffer(self, rotation=0):
+        """
+        Restituisce il buffer 1-bit impacchettato nel formato del driver Waveshare
+
+        Le rotazioni di 0° e 180° (con larghezza multipla di 8) lavorano
+        direttamente sul buffer; quelle di 90° e 270° ruotano il frame a
+        strisce alte un tile, che diventano colonne di byte del buffer
+        ruotato. Nessuna crea immagini a pieno formato.
+        """
+        if self.dirty_tiles or self._invalid:
+            self.render()
+        if not rotation:
+            return self._output(rotation, self.framebuffer)
+        if rotation == 180 and self.width % 8 == 0:
+            return self._output(rotation, self.framebuffer[::-1].translate(_REVERSE_BITS))
+        if rotation in (90, 270):
+            return self._transposed_buffer(rotation)
+        return self._output(rotation, self.get_image().transpose(_TRANSPOSE[rotation]).tobytes('raw'))
+
+    def _transposed_buffer(self, rotation):
+        """Buffer ruotato di 90° o 270°, riempito una striscia di tile alla volta"""
+        width, height, stride, band = self.width, self.height, self.stride, self.tile_size
+        out_stride = (height + 7) // 8
+        out = self._output_buffer(rotation, out_stride * width)
+        for start in range(0, height, band):
+            # Righe del frame che finiscono nelle colonne di byte da start // 8
+            # (a 270° le prime colonne del buffer ruotato sono le ultime righe del frame)
+            if rotation == 90:
+                y0, y1 = start, min(height, start + band)
+            else:
+                y0, y1 = max(0, height - start - band), height - start
+            strip = Image.frombytes('1', (width, y1 - y0), bytes(self.framebuffer[y0 * stride:y1 * stride]))
+            data = strip.transpose(_TRANSPOSE[rotation]).tobytes('raw')
+            row_bytes = (y1 - y0 + 7) // 8
+            for k in range(row_bytes):
+                out[start // 8 + k::out_stride] = data[k::row_bytes]
+        return out
+
+
+# Nomi dei colori della palette per i pannelli a colori
+_PALETTE = {0: 'black', 255: 'white'}
+
+
+def _plane_color(color, ink):
+    """Colore da usare nel piano di un inchiostro: 0 se il colore è quell'inchiostro, 255 altrimenti"""
+    if color is None:
+        return None
+    name = _PALETTE.get(color, color)
+    if not isinstance(name, str):
+        name = 'black' if name < 128 else 'white'
+    return 0 if name == ink else 255
+
+
+def _mono_color(color):
+    """Colore 0/255 su un'immagine B/N: solo il bianco (e i grigi chiari) è carta, ogni inchiostro è nero"""
+    name = _PALETTE.get(color, color)
+    if not isinstance(name, str):
+        return 0 if name < 128 else 255
+    return 255 if name == 'white' else 0
+
+
+class _PlaneDraw:
+    """ImageDraw di un piano colore: traduce fill/outline dalla palette a 0/255"""
+
+    def __init__(self, draw, ink):
+        self._draw = draw
+        self._ink = ink
+
+    def __getattr__(self, name):
+        attr = getattr(self._draw, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if 'fill' in kwargs:
+                kwargs['fill'] = _plane_color(kwargs['fill'], self._ink)
+            if 'outline' in kwargs:
+                kwargs['outline'] = _plane_color(kwargs['outline'], self._ink)
+            return attr(*args, **kwargs)
+        return call
+
+
+class _PlaneImage:
+    """Immagine di un piano colore: le immagini B/N incollate sono inchiostro nero"""
+
+    def __init__(self, image, ink):
+        self._image = image
+        self._ink = ink
+
+    def __getattr__(self, name):
+        return getattr(self._image, name)
+
+    def paste(self, im, box=None, mask=None):
+        if self._ink == 'black' or not isinstance(im, Image.Image):
+            return self._image.paste(im, box, mask)
+        # Negli altri piani l'area dell'immagine diventa carta (bianco)
+        x, y = box[:2]
+        if mask is None:
+            self._image.paste(255, (x, y, x + im.width, y + im.height))
+        else:
+            self._image.paste(255, (x, y), mask)
+
+
+class ColorCanvas(EinkCanvas):
+    """
+    Canvas per pannelli a più colori (nero/rosso, nero/giallo, ...)
+
+    Mantiene un piano 1-bit per ogni inchiostro, nello stesso formato dei
+    buffer dei driver Waveshare (0 = inchiostro, 255 = carta). I widget
+    accettano i colori della palette ('black', 'white', 'red', 'yellow' oltre
+    a 0/255) e vengono disegnati una volta per piano, quindi un frame costa
+    circa il doppio di uno monocromatico con due inchiostri.
+
+    Example:
+        canvas = ColorCanvas(epd.height, epd.width, picdir, inks=('black', 'red'))
+        canvas.add_widget(Text(10, 10, "ALLARME", fill='red'))
+        black, red = canvas.get_plane_buffers(rotation=270)
+        epd.display(black, red)
+    """
+
+    # Ogni widget va disegnato una volta per piano: add_widgets resta seriale
+    _parallel_add = False
+
+    def __init__(self, width, height, picdir=None, inks=('black', 'red')):
+        """
+        Args:
+            width: larghezza del canvas
+            height: altezza del canvas
+            picdir: directory con font e risorse
+            inks: inchiostri del pannello, nell'ordine dei buffer del driver
+        """
+        super().__init__(width, height, picdir)
+        self.inks = tuple(inks)
+        self.planes = {}
+        for ink in self.inks:
+            # Il piano nero coincide con self.image (compatibilità con get_image/get_buffer)
+            self.planes[ink] = self.image if ink == 'black' else Image.new('1', (width, height), 255)
+        self._draws = {ink: _PlaneDraw(ImageDraw.Draw(plane), ink) for ink, plane in self.planes.items()}
+        self._images = {ink: _PlaneImage(plane, ink) for ink, plane in self.planes.items()}
+
+        # Stato dei piani all'ultimo export, per il dirty tracking
+        self._exported = {ink: Image.new('1', (width, height), 255) for ink in self.inks}
+        self._changed = None
+
+    def clear(self, color=255):
+        """Pulisce il canvas (color può essere un colore della palette)"""
+        for ink, plane in self.planes.items():
+            plane.paste(_plane_color(color, ink), (0, 0, self.width, self.height))
+        self._forget_widgets()
+        self.background = color
+        self._changed = (0, 0, self.width, self.height)
+
+    def add_widget(self, widget):
+        """Aggiunge un widget disegnandolo in tutti i piani"""
+        for ink in self.inks:
+            widget.draw(self._draws[ink], self._images[ink], self.fonts)
+        self._register_widget(widget)
+        self._changed = _union_bbox(self._changed, self._widget_bbox(widget))
+        return self
+
+    def _render_region(self, region):
+        widgets = self._region_widgets(region)
+        padded = self._padded_region(region, widgets)
+        for ink in self.inks:
+            img = self._new_region_image(padded, '1', _plane_color(self.background, ink))
+            self._draw_region(region, padded, _PlaneDraw(ImageDraw.Draw(img), ink), _PlaneImage(img, ink), widgets)
+            self.planes[ink].paste(self._crop_region(img, region, padded), region[:2])
+        self._changed = _union_bbox(self._changed, region)
+
+    def get_dirty_bboxes(self):
+        """
+        Regioni modificate per ogni piano rispetto all'ultimo export
+
+        Il confronto è limitato all'area toccata dai widget aggiunti nel frattempo.
+
+        Returns:
+            dizionario {inchiostro: (x0, y0, x1, y1) oppure None se invariato}
+        """
+        dirty = dict.fromkeys(self.inks)
+        region = _clip_bbox(self._changed, self.width, self.height)
+        if region is None:
+            return dirty
+        for ink in self.inks:
+            diff = ImageChops.logical_xor(self.planes[ink].crop(region), self._exported[ink].crop(region))
+            bbox = diff.getbbox()
+            if bbox:
+                dirty[ink] = (region[0] + bbox[0], region[1] + bbox[1],
+                              region[0] + bbox[2], region[1] + bbox[3])
+        return dirty
+
+    def _mark_exported(self):
+        """Aggiorna lo stato esportato solo nella regione modificata"""
+        region = _clip_bbox(self._changed, self.width, self.height)
+        if region is not None:
+            for ink in self.inks:
+                self._exported[ink].paste(self.planes[ink].crop(region), region[:2])
+        self._changed = None
+
+    def get_plane_buffers(self, rotation=0):
+        """
+        Buffer 1-bit impacchettati di tutti i piani, nell'ordine di inks
+
+        Example:
+            epd.display(*canvas.get_plane_buffers(rotation=270))
+        """
+        buffers = []
+        for ink in self.inks:
+            plane = self.planes[ink]
+            if rotation:
+                plane = plane.transpose(_TRANSPOSE[rotation])
+            buffers.append(self._output((rotation, ink), plane.tobytes('raw')))
+        self._mark_exported()
+        return tuple(buffers)
+
+    def get_preview(self):
+        """Immagine RGB di anteprima con tutti i piani sovrapposti (solo per debug)"""
+        colors = {'black': (0, 0, 0), 'red': (255, 0, 0), 'yellow': (255, 255, 0)}
+        preview = Image.new('RGB', (self.width, self.height), (255, 255, 255))
+        for ink in self.inks:
+            preview.paste(colors.get(ink, (0, 0, 0)), (0, 0), ImageChops.invert(self.planes[ink]))
+        return preview
+
+
+# Livelli dei pannelli a 4 toni di grigio (stessi valori dei driver Waveshare)
+GRAY1 = 0xFF  # bianco
+GRAY2 = 0xC0  # grigio chiaro
+GRAY3 = 0x80  # grigio scuro
+GRAY4 = 0x00  # nero
+
+# Quantizzazione 0-255 -> livello a 2 bit (0=nero, 3=bianco), soglie a metà tra i livelli
+_GRAY4_LEVELS = [0 if v < 64 else 1 if v < 160 else 2 if v < 224 else 3 for v in range(256)]
+_GRAY4_VALUES = [(GRAY4, GRAY3, GRAY2, GRAY1)[level] for level in _GRAY4_LEVELS]
+
+# Palette per la quantizzazione con dithering (indice = livello)
+_GRAY4_PALETTE = Image.new('P', (1, 1))
+_GRAY4_PALETTE.putpalette([GRAY4] * 3 + [GRAY3] * 3 + [GRAY2] * 3 + [GRAY1] * 3)
+
+
+def pack_2bpp(image, dither=False):
+    """
+    Quantizza un'immagine a 4 livelli e la impacchetta a 2 bit per pixel
+
+    Il formato è quello di getbuffer_4Gray dei driver Waveshare: 4 pixel per
+    byte, il primo nei bit più significativi, 11=bianco ... 00=nero.
+    Quantizzazione e impacchettamento sono fatti interamente in C da PIL.
+
+    Args:
+        image: immagine PIL (convertita in 'L' se necessario)
+        dither: usa il dithering Floyd-Steinberg invece della soglia
+    """
+    if dither:
+        levels = image.convert('RGB').quantize(palette=_GRAY4_PALETTE, dither=Image.Dither.FLOYDSTEINBERG)
+    else:
+        levels = image.convert('L').point(_GRAY4_LEVELS).convert('P')
+    return bytearray(levels.tobytes('raw', 'P;2'))
+
+
+class GrayCanvas(EinkCanvas):
+    """
+    Canvas a 4 livelli di grigio per i pannelli che supportano la modalità 4-gray
+
+    Si disegna su un'immagine 'L' (il testo è anti-aliasing) e i widget possono
+    usare i grigi veri (GRAY2, GRAY3) come colore di riempimento; il buffer
+    viene quantizzato e impacchettato a 2 bit per pixel.
+
+    Example:
+        epd.Init_4Gray()
+        canvas = GrayCanvas(epd.height, epd.width, picdir)
+        canvas.add_widget(Box(10, 10, 100, 40, fill=GRAY2))
+        epd.display_4Gray(canvas.get_buffer(rotation=90))
+    """
+
+    mode = 'L'
+
+    def __init__(self, width, height, picdir=None, dither=False):
+        """
+        Args:
+            width: larghezza del canvas
+            height: altezza del canvas
+            picdir: directory con font e risorse
+            dither: usa il dithering Floyd-Steinberg nella quantizzazione
+        """
+        super().__init__(width, height, picdir)
+        self.dither = dither
+
+    def get_buffer(self, rotation=0):
+        """
+        Restituisce il buffer a 2 bit per pixel nel formato del driver (display_4Gray)
+
+        Args:
+            rotation: rotazione antioraria in gradi (0, 90, 180, 270)
+        """
+        image = self.image
+        if rotation:
+            image = image.transpose(_TRANSPOSE[rotation])
+        return self._output(rotation, pack_2bpp(image, self.dither))
+
+    def get_quantized_image(self):
+        """Anteprima dell'immagine con i soli 4 livelli di grigio del pannello"""
+        if self.dither:
+            return self.image.convert('RGB').quantize(
+                palette=_GRAY4_PALETTE, dither=Image.Dither.FLOYDSTEINBERG).convert('L')
+        return self.image.point(_GRAY4_VALUES)
+
+
+# Retinature per pattern_fill: una stringa per riga ('0' = inchiostro, '1' = carta),
+# ripetute in orizzontale e in verticale
+def hatch_pattern(kind, spacing=4):
+    """
+    Retinatura periodica con passo spacing
+
+    Args:
+        kind: 'horizontal', 'vertical', 'diagonal1' (/), 'diagonal2' (\\), 'dots', 'crosshatch'
+        spacing: distanza in pixel tra le linee
+
+    Returns:
+        tupla di righe da usare con PackedBitmap.pattern_fill
+    """
+    paper = '1' * spacing
+    dot = '0' + '1' * (spacing - 1)
+    if kind == 'horizontal':
+        rows = ['0' * spacing] + [paper] * (spacing - 1)
+    elif kind == 'vertical':
+        rows = [dot] * spacing
+    elif kind == 'diagonal1':
+        rows = [paper[:r] + '0' + paper[r + 1:] for r in range(spacing)]
+    elif kind == 'diagonal2':
+        rows = [paper[:c] + '0' + paper[c + 1:] for c in ((-r) % spacing for r in range(spacing))]
+    elif kind == 'dots':
+        rows = [dot] + [paper] * (spacing - 1)
+    elif kind == 'crosshatch':
+        rows = ['0' * spacing] + [dot] * (spacing - 1)
+    else:
+        raise ValueError(f"Retinatura sconosciuta: {kind}")
+    return tuple(rows)
+
+
+def _is_ink(color):
+    """Sui bitmap 1-bit solo il nero è inchiostro (come PIL per i colori chiari)"""
+    return color == 0 or color == 'black'
+
+
+class PackedBitmap:
+    """
+    Bitmap 1-bit impacchettato nel formato dei driver Waveshare (1 = carta, 0 = inchiostro)
+
+    Serve per le retinature (pattern_fill), che PIL non offre: rettangoli,
+    linee e testo restano più veloci con ImageDraw. Le coordinate finali
+    sono incluse, come per ImageDraw.rectangle.
+
+    Example:
+        bitmap = PackedBitmap(250, 122)
+        bitmap.pattern_fill(10, 40, 100, 80, hatch_pattern('diagonal1', 3))
+        epd.display(bitmap.buffer)
+    """
+
+    def __init__(self, width, height, buffer=None):
+        self.width = width
+        self.height = height
+        self.stride = (width + 7) // 8
+        if buffer is None:
+            buffer = bytearray(b'\xff' * (self.stride * height))
+        self.buffer = buffer
+
+    @classmethod
+    def from_image(cls, image):
+        """Bitmap da un'immagine PIL (convertita in '1')"""
+        if image.mode != '1':
+            image = image.convert('1')
+        return cls(image.width, image.height, bytearray(image.tobytes('raw')))
+
+    def get_image(self):
+        """Immagine PIL '1' con il contenuto del bitmap"""
+        return Image.frombytes('1', (self.width, self.height), bytes(self.buffer))
+
+    def fill(self, color=255):
+        """Riempie tutto il bitmap"""
+        self.buffer[:] = (b'\x00' if _is_ink(color) else b'\xff') * len(self.buffer)
+
+    def _clip(self, x0, y0, x1, y1):
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(self.width - 1, int(x1)), min(self.height - 1, int(y1))
+        if x0 > x1 or y0 > y1:
+            return None
+        return x0, y0, x1, y1
+
+    def pattern_fill(self, x0, y0, x1, y1, pattern, origin=(0, 0), color=0):
+        """
+        Disegna una retinatura nel rettangolo [x0, x1] x [y0, y1]
+
+        Per ogni tipo di riga del pattern si prepara una volta la maschera di
+        byte, poi ogni riga costa una sola AND/OR tra interi.
+
+        Args:
+            pattern: righe del pattern (vedi hatch_pattern)
+            origin: punto a cui è ancorato il pattern
+            color: colore dei pixel '0' del pattern (quelli '1' restano invariati)
+        """
+        clipped = self._clip(x0, y0, x1, y1)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        ink = _is_ink(color)
+        b0, b1 = x0 >> 3, x1 >> 3
+        nbytes = b1 - b0 + 1
+        px0 = b0 * 8
+        period = len(pattern[0])
+        phase = (px0 - origin[0]) % period
+        left, right = x0 - px0, px0 + nbytes * 8 - 1 - x1
+
+        masks = []
+        for row in pattern:
+            bits = (row * (nbytes * 8 // period + 2))[phase:phase + nbytes * 8]
+            bits = '1' * left + bits[left:nbytes * 8 - right] + '1' * right
+            mask = int(bits, 2)
+            # inchiostro: AND con la maschera; carta: OR con la maschera invertita
+            masks.append(mask if ink else ~mask & ((1 << nbytes * 8) - 1))
+
+        buf, stride = self.buffer, self.stride
+        rows = len(pattern)
+        for y in range(y0, y1 + 1):
+            start = y * stride + b0
+            value = int.from_bytes(buf[start:start + nbytes], 'big')
+            mask = masks[(y - origin[1]) % rows]
+            value = value & mask if ink else value | mask
+            buf[start:start + nbytes] = value.to_bytes(nbytes, 'big')
+
+
+def _resolve_font(fonts, font=None, font_size='medium'):
+    """Restituisce il font personalizzato se presente, altrimenti quello per font_size"""
+    if font and font in fonts:
+        return fonts[font]
+    if font_size in fonts:
+        return fonts[font_size]
+    if 'medium' in fonts:
+        return fonts['medium']
+    return ImageFont.load_default()
+
+
+# Avanzamenti dei glifi per font e modalità (char -> larghezza in pixel)
+_glyph_advances = weakref.WeakKeyDictionary()
+
+
+def text_width(text, font, mode='1'):
+    """
+    Larghezza approssimata di un testo sommando gli avanzamenti dei singoli glifi
+
+    Gli avanzamenti sono misurati con FreeType una sola volta per carattere e
+    poi riusati, quindi il costo è lineare nella lunghezza del testo.
+    Il kerning viene ignorato (differenza trascurabile su display 1-bit).
+
+    Args:
+        text: testo da misurare
+        font: font PIL
+        mode: modalità dell'immagine di destinazione ('1' usa l'hinting monocromatico)
+    """
+    per_font = _glyph_advances.get(font)
+    if per_font is None:
+        per_font = _glyph_advances[font] = {}
+    advances = per_font.get(mode)
+    if advances is None:
+        advances = per_font[mode] = {}
+    width = 0
+    for ch in text:
+        adv = advances.get(ch)
+        if adv is None:
+            adv = advances[ch] = font.getlength(ch, mode)
+        width += adv
+    return width
+
+
+# Draw di servizio per misurare il testo senza disegnare
+_measure_draw = ImageDraw.Draw(Image.new('1', (1, 1)))
+
+
+def _text_bbox(xy, text, font, anchor=None):
+    """Bounding box intero (x0, y0, x1, y1) di un testo, x1/y1 esclusi"""
+    x0, y0, x1, y1 = _measure_draw.textbbox(xy, text, font=font, anchor=anchor)
+    return (math.floor(x0), math.floor(y0), math.ceil(x1), math.ceil(y1))
+
+
+def _union_bbox(a, b):
+    """Unione di due bounding box (None = vuoto)"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _clip_bbox(bbox, width, height):
+    """Arrotonda un bounding box ai pixel interi e lo limita al canvas (None se vuoto)"""
+    if bbox is None:
+        return None
+    return _intersect_bbox(
+        (math.floor(bbox[0]), math.floor(bbox[1]), math.ceil(bbox[2]), math.ceil(bbox[3])),
+        (0, 0, width, height)
+    )
+
+
+def _intersect_bbox(a, b):
+    """Intersezione di due bounding box, None se non si sovrappongono"""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def _line_height(font):
+    """Altezza di una riga (ascendente + discendente) per il font"""
+    if hasattr(font, 'getmetrics'):
+        ascent, descent = font.getmetrics()
+        return ascent + descent
+    bbox = font.getbbox('Ag')
+    return bbox[3] - bbox[1]
+
+
+def _draw_text(draw, xy, text, font, fill, anchor=None):
+    """
+    draw.text che rispetta gli ancoraggi anche con i BitmapFont
+
+    Per un font bitmap la maschera di ogni riga viene incollata con
+    draw.bitmap, con gli stessi arrotondamenti e la stessa interlinea di
+    ImageDraw per i font TrueType (testo su più righe allineato a sinistra).
+    Solo il testo che esce dal bordo superiore con una y frazionaria negativa
+    può differire di una riga di pixel: lì FreeType cambia il glifo, non lo sposta.
+    """
+    if not isinstance(font, BitmapFont):
+        draw.text(xy, text, font=font, fill=fill, anchor=anchor)
+        return
+
+    anchor = anchor or 'la'
+    lines = text.split('\n')
+    x, top = xy
+    widths = [font.getlength(line) for line in lines]
+    spacing = 0
+    if len(lines) > 1:
+        if anchor[1] in 'tb':
+            raise ValueError("anchor not supported for multiline text")
+        spacing = font.getbbox('A')[3] + 4
+        top -= {'m': (len(lines) - 1) * spacing / 2.0, 'd': (len(lines) - 1) * spacing}.get(anchor[1], 0)
+    max_width = max(widths)
+    for line, width in zip(lines, widths):
+        left = x - {'m': (max_width - width) / 2.0, 'r': max_width - width}.get(anchor[0], 0)
+        # Come FreeType con le coordinate frazionarie: mezzo pixel va a destra, ma non in basso
+        mask, offset = font._line_mask(line, anchor)
+        draw.bitmap((math.floor(left + 0.5) + offset[0], math.ceil(top - 0.5) + offset[1]), mask, fill=fill)
+        top += spacing
+
+
+def _draw_text_clipped(draw, xy, text, font, fill, anchor, clip, width=None):
+    """
+    Disegna solo i caratteri di un testo che cadono in orizzontale nel rettangolo clip
+
+    Il primo carattere disegnato viene posizionato esattamente dove sarebbe
+    nel testo completo (kerning compreso), quindi i pixel dentro clip sono
+    identici a quelli di draw.text sull'intero testo.
+
+    Args:
+        width: larghezza del testo se già nota (es. dal layout di Paragraph)
+    """
+    if ('\n' in text or (anchor and anchor[0] != 'l') or
+            getattr(font, 'layout_engine', None) != ImageFont.Layout.BASIC):
+        # Niente taglio dei caratteri: si salta solo il testo tutto fuori da clip
+        if _intersect_bbox(_text_bbox(xy, text, font, anchor), clip):
+            _draw_text(draw, xy, text, font, fill, anchor)
+        return
+
+    # Estensione approssimata dagli avanzamenti, con un margine per i glifi che sporgono
+    mode = draw.fontmode
+    margin = _line_height(font) // 2 + 1
+    if width is None:
+        width = text_width(text, font, mode)
+    if xy[0] + width + margin < clip[0] or xy[0] - margin > clip[2]:
+        return
+    if xy[0] - margin >= clip[0] and xy[0] + width + margin <= clip[2]:
+        _draw_text(draw, xy, text, font, fill, anchor)
+        return
+
+    start, end = 0, len(text)
+    x = xy[0]
+    for i, ch in enumerate(text):
+        advance = text_width(ch, font, mode)
+        if x + advance < clip[0] - margin:
+            start = i + 1
+        if x > clip[2] + margin:
+            end = i
+            break
+        x += advance
+    if start >= end:
+        return
+
+    # Posizione esatta del primo carattere nel testo completo
+    offset = font.getlength(text[:start + 1], mode) - font.getlength(text[start], mode) if start else 0
+    _draw_text(draw, (xy[0] + offset, xy[1]), text[start:end], font, fill, anchor)
+
+
+def _paste_clipped(image, img, x, y, clip):
+    """Incolla solo la parte di img che cade nel rettangolo clip"""
+    box = _intersect_bbox((x, y, x + img.width, y + img.height), clip)
+    if box is None:
+        return
+    if box != (x, y, x + img.width, y + img.height):
+        img = img.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+    image.paste(img, box[:2])
+
+
+def _mask_clipped(draw, mask, x, y, fill, background, clip=None):
+    """
+    Cella con sfondo background e la maschera mask disegnata con fill, limitata a clip
+
+    I colori passano da draw, quindi su ColorCanvas finiscono nei loro piani
+    e su GrayCanvas restano grigi (un'immagine '1' incollata sarebbe B/N).
+    """
+    full = (x, y, x + mask.width, y + mask.height)
+    box = full if clip is None else _intersect_bbox(full, clip)
+    if box is None or box[0] >= box[2] or box[1] >= box[3]:
+        return
+    if box != full:
+        mask = mask.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+    draw.rectangle((box[0], box[1], box[2] - 1, box[3] - 1), fill=background)
+    draw.bitmap(box[:2], mask, fill=fill)
+
+
+class DataSource:
+    """
+    Sorgente di dati osservabile a cui collegare le proprietà dei widget
+
+    Quando il valore cambia, i widget collegati vengono aggiornati e invalidati
+    sul loro canvas; un valore uguale al precedente non provoca nulla.
+
+    Example:
+        livello = DataSource(0)
+        canvas.add_widget(ProgressBar(10, 100, 150, 15, 0).bind('progress', livello))
+        livello.set(40)
+        regione = canvas.update()   # ridisegna solo la ProgressBar
+    """
+
+    def __init__(self, value=None):
+        self._value = value
+        # Widget -> [(proprietà, transform)], con riferimenti deboli: un widget
+        # tolto dal canvas (es. con clear()) e non più usato non resta in vita qui
+        self._bindings = weakref.WeakKeyDictionary()
+
+    @property
+    def value(self):
+        return self._value
+
+    def set(self, value):
+        """
+        Imposta un nuovo valore e aggiorna i widget collegati
+
+        Returns:
+            True se il valore è cambiato
+        """
+        if value == self._value:
+            return False
+        self._value = value
+        self.notify()
+        return True
+
+    def notify(self):
+        """Propaga il valore corrente ai widget (es. dopo aver modificato una lista sul posto)"""
+        for widget, bindings in list(self._bindings.items()):
+            for name, transform in bindings:
+                widget.set(name, transform(self._value) if transform else self._value)
+
+    def _bind(self, widget, name, transform):
+        self._bindings.setdefault(widget, []).append((name, transform))
+
+    def unbind(self, widget):
+        """Scollega un widget dalla sorgente"""
+        self._bindings.pop(widget, None)
+
+
+class Widget:
+    """Classe base per tutti i widget"""
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self._canvas = None
+
+    # True per i widget che disegnano solo su coordinate intere (rettangoli,
+    # testo, bitmap): spostati in una sotto-immagine danno gli stessi pixel
+    # anche se parte del widget finisce a coordinate negative
+    _integer_coords = False
+
+    def draw(self, draw, image, fonts):
+        """Da implementare nelle sottoclassi"""
+        raise NotImplementedError
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        """
+        Disegna il widget limitandosi al rettangolo clip (x0, y0, x1, y1)
+
+        I pixel fuori da clip possono restare non disegnati, quelli dentro
+        devono essere identici a draw(). Il default disegna tutto il widget;
+        i widget costosi lo ridefiniscono per saltare il lavoro fuori da clip.
+        """
+        self.draw(draw, image, fonts)
+
+    def get_bbox(self, fonts):
+        """
+        Bounding box (x0, y0, x1, y1) dei pixel toccati dal widget, x1/y1 esclusi
+
+        Il default vale per i widget con width/height (rettangoli disegnati da
+        x a x+width inclusi). Restituisce None se l'area non è nota.
+        """
+        if hasattr(self, 'width') and hasattr(self, 'height'):
+            x0, y0 = math.floor(self.x), math.floor(self.y)
+            return (x0, y0, math.ceil(self.x + self.width) + 1, math.ceil(self.y + self.height) + 1)
+        return None
+
+    def _normalize(self, name, value):
+        """Normalizza il valore di una proprietà come farebbe il costruttore"""
+        return value
+
+    def _state(self, fonts):
+        """
+        Attributi che determinano i pixel del widget, per l'impronta di FrameCache
+
+        Il default sono gli attributi pubblici; le sottoclassi con risorse su
+        file o sorgenti non ripetibili (iteratori) li sostituiscono.
+        """
+        return {name: value for name, value in vars(self).items() if not name.startswith('_')}
+
+    def set(self, name, value):
+        """
+        Modifica una proprietà del widget e lo invalida sul canvas se è cambiata
+
+        Returns:
+            True se la proprietà è cambiata
+        """
+        value = self._normalize(name, value)
+        if getattr(self, name) == value:
+            return False
+        if self._canvas is not None:
+            self._canvas.invalidate_widget(self)
+        setattr(self, name, value)
+        return True
+
+    def bind(self, name, source, transform=None):
+        """
+        Collega una proprietà a una DataSource
+
+        Args:
+            name: nome della proprietà (es. 'text', 'progress', 'level')
+            source: DataSource da cui leggere il valore
+            transform: funzione opzionale valore -> proprietà (es. formattazione)
+
+        Returns:
+            il widget stesso, per poterlo passare direttamente ad add_widget
+        """
+        source._bind(self, name, transform)
+        self.set(name, transform(source.value) if transform else source.value)
+        return self
+
+    def _shift(self, dx, dy):
+        """Sposta il widget di (dx, dy) sul posto (le sottoclassi spostano anche gli altri punti)"""
+        self.x += dx
+        self.y += dy
+
+    def translated(self, dx, dy):
+        """Copia del widget spostata di (dx, dy), usata per disegnare in sotto-immagini"""
+        widget = copy.copy(self)
+        widget._shift(dx, dy)
+        return widget
+
+    def move_to(self, x, y):
+        """
+        Sposta il widget in (x, y) e lo invalida sul canvas se la posizione è cambiata
+
+        Returns:
+            True se il widget si è spostato
+        """
+        if (x, y) == (self.x, self.y):
+            return False
+        if self._canvas is not None:
+            self._canvas.invalidate_widget(self)
+        self._shift(x - self.x, y - self.y)
+        return True
+
+
+class Text(Widget):
+    """Widget per testo semplice"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, text, font_size='medium', font=None, fill=0, anchor=None):
+        """
+        Args:
+            x, y: posizione
+            text: testo da visualizzare
+            font_size: 'small', 'medium', 'large', 'xlarge' (usato se font=None)
+            font: nome del font personalizzato (es. 'lato_medium', 'custom_title')
+                  se specificato, ha priorità su font_size
+            fill: colore (0=nero, 255=bianco)
+            anchor: ancora del testo ('lt', 'mm', etc.)
+        """
+        super().__init__(x, y)
+        self.text = str(text)
+        self.font_size = font_size
+        self.font = font  # Font personalizzato (opzionale)
+        self.fill = fill
+        self.anchor = anchor
+
+    def draw(self, draw, image, fonts):
+        # Usa font personalizzato se specificato, altrimenti usa font_size
+        font = _resolve_font(fonts, self.font, self.font_size)
+
+        _draw_text(draw, (self.x, self.y), self.text, font, self.fill, self.anchor)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        font = _resolve_font(fonts, self.font, self.font_size)
+        _draw_text_clipped(draw, (self.x, self.y), self.text, font, self.fill, self.anchor, clip)
+
+    def get_bbox(self, fonts):
+        font = _resolve_font(fonts, self.font, self.font_size)
+        return _text_bbox((self.x, self.y), self.text, font, self.anchor)
+
+    def _normalize(self, name, value):
+        return str(value) if name == 'text' else value
+
+
+class Paragraph(Widget):
+    """Widget per testo multilinea con a capo automatico"""
+
+    _integer_coords = True
+
+    # Cache dei layout: (testo, font, larghezza, max_lines, ellipsis) -> righe
+    _layout_cache = OrderedDict()
+    _layout_cache_size = 256
+    _layout_cache_lock = threading.Lock()
+
+    def __init__(self, x, y, width, text, font_size='medium', font=None, fill=0,
+                 align='left', line_spacing=2, max_lines=None, ellipsis='...'):
+        """
+        Args:
+            x, y: posizione top-left
+            width: larghezza massima delle righe in pixel
+            text: testo da visualizzare ('\\n' forza un a capo)
+            font_size: 'small', 'medium', 'large', 'xlarge' (usato se font=None)
+            font: nome del font personalizzato (ha priorità su font_size)
+            fill: colore (0=nero, 255=bianco)
+            align: 'left', 'center' o 'right'
+            line_spacing: spazio aggiuntivo tra le righe in pixel
+            max_lines: numero massimo di righe (None = illimitato)
+            ellipsis: testo aggiunto all'ultima riga se il testo viene troncato
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.text = str(text)
+        self.font_size = font_size
+        self.font = font
+        self.fill = fill
+        self.align = align
+        self.line_spacing = line_spacing
+        self.max_lines = max_lines
+        self.ellipsis = ellipsis
+
+    def _normalize(self, name, value):
+        return str(value) if name == 'text' else value
+
+    @staticmethod
+    def _wrap_paragraph(text, font, width, mode='1'):
+        """Spezza un paragrafo (senza '\\n') in righe, restituisce [(riga, larghezza)]"""
+        lines = []
+        space = text_width(' ', font, mode)
+        current, current_width = '', 0
+
+        for word in text.split(' '):
+            word_width = text_width(word, font, mode)
+
+            if current and current_width + space + word_width <= width:
+                current += ' ' + word
+                current_width += space + word_width
+                continue
+
+            if current:
+                lines.append((current, current_width))
+                current, current_width = '', 0
+
+            # Parola più lunga della riga: spezza carattere per carattere
+            while word_width > width and len(word) > 1:
+                part, part_width = '', 0
+                for ch in word:
+                    ch_width = text_width(ch, font, mode)
+                    if part and part_width + ch_width > width:
+                        break
+                    part += ch
+                    part_width += ch_width
+                lines.append((part, part_width))
+                word = word[len(part):]
+                word_width -= part_width
+
+            current, current_width = word, word_width
+
+        lines.append((current, current_width))
+        return lines
+
+    def _truncate(self, line, line_width, font, mode):
+        """Accorcia l'ultima riga finché ci sta con l'ellipsis"""
+        ellipsis_width = text_width(self.ellipsis, font, mode)
+        while line and line_width + ellipsis_width > self.width:
+            line_width -= text_width(line[-1], font, mode)
+            line = line[:-1]
+        line = line.rstrip()
+        return line + self.ellipsis, text_width(line, font, mode) + ellipsis_width
+
+    def layout(self, font, mode='1'):
+        """
+        Calcola le righe del paragrafo per il font dato
+
+        Args:
+            font: font PIL
+            mode: modalità di rendering del testo ('1' o 'L', vedi ImageDraw.fontmode)
+
+        Returns:
+            lista di tuple (riga, larghezza in pixel)
+        """
+        key = (self.text, font, mode, self.width, self.max_lines, self.ellipsis)
+        cache = Paragraph._layout_cache
+        with Paragraph._layout_cache_lock:
+            lines = cache.get(key)
+            if lines is not None:
+                cache.move_to_end(key)
+                return lines
+
+        lines = []
+        for paragraph in self.text.split('\n'):
+            lines.extend(self._wrap_paragraph(paragraph, font, self.width, mode))
+            if self.max_lines and len(lines) > self.max_lines:
+                break
+
+        if self.max_lines and len(lines) > self.max_lines:
+            lines = lines[:self.max_lines]
+            lines[-1] = self._truncate(*lines[-1], font, mode)
+
+        with Paragraph._layout_cache_lock:
+            cache[key] = lines
+            if len(cache) > Paragraph._layout_cache_size:
+                cache.popitem(last=False)
+        return lines
+
+    def draw(self, draw, image, fonts):
+        self.draw_clipped(draw, image, fonts, None)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        font = _resolve_font(fonts, self.font, self.font_size)
+        step = _line_height(font) + self.line_spacing
+        margin = step // 4 + 1
+
+        for i, (line, line_width) in enumerate(self.layout(font, draw.fontmode)):
+            line_y = self.y + i * step
+            if clip is not None and (line_y + step + margin <= clip[1] or line_y - margin >= clip[3]):
+                continue
+            if self.align == 'center':
+                line_x = self.x + (self.width - line_width) / 2
+            elif self.align == 'right':
+                line_x = self.x + self.width - line_width
+            else:
+                line_x = self.x
+            if clip is None:
+                _draw_text(draw, (line_x, line_y), line, font, self.fill)
+            else:
+                _draw_text_clipped(draw, (line_x, line_y), line, font, self.fill, None, clip, line_width)
+
+    def get_bbox(self, fonts):
+        font = _resolve_font(fonts, self.font, self.font_size)
+        lines = self.layout(font)
+        step = _line_height(font) + self.line_spacing
+        x0, y0 = math.floor(self.x), math.floor(self.y)
+        # Margine per glifi che sporgono oltre l'avanzamento (corsivi, kerning)
+        margin = step // 4 + 1
+        return (x0 - margin, y0, math.ceil(self.x + self.width) + margin,
+                math.ceil(self.y + len(lines) * step) + 1)
+
+
+class Marquee(Widget):
+    """
+    Testo che scorre in una striscia (notizie, allarmi)
+
+    Il messaggio viene rasterizzato una sola volta in una maschera 1-bit lunga
+    un periodo (testo + gap); a ogni passo la finestra visibile viene
+    ritagliata dalla maschera e disegnata con draw.bitmap, senza ridisegnare
+    il testo (su ColorCanvas fill e background finiscono nei loro piani,
+    su GrayCanvas restano grigi). Il bounding box è
+    sempre il rettangolo fisso della striscia (che viene coperto per intero
+    con lo sfondo), quindi dopo step() update() restituisce solo quella
+    regione, da mandare con un refresh parziale.
+
+    Example:
+        ticker = Marquee(0, 100, 250, 22, "Allerta meteo: vento forte")
+        canvas.add_widget(ticker)
+        while True:
+            ticker.step()
+            canvas.update()
+            epd.displayPartial(canvas.get_buffer(270))
+    """
+
+    _integer_coords = True
+
+    def __init__(self, x, y, width, height, text, font_size='medium', font=None, fill=0,
+                 background=255, speed=8, gap=32, offset=0):
+        """
+        Args:
+            x, y: posizione top-left della striscia
+            width, height: dimensioni della striscia
+            text: messaggio da far scorrere
+            font_size, font: come in Text
+            fill: colore del testo
+            background: colore dello sfondo della striscia
+            speed: pixel di avanzamento a ogni step()
+            gap: spazio in pixel tra la fine del messaggio e la ripetizione successiva
+            offset: posizione iniziale dello scorrimento in pixel
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.text = str(text)
+        self.font_size = font_size
+        self.font = font
+        self.fill = fill
+        self.background = background
+        self.speed = speed
+        self.gap = gap
+        self.offset = offset
+        # Striscia rasterizzata, condivisa con le copie fatte da translated()
+        self._strip = {}
+
+    def _normalize(self, name, value):
+        return str(value) if name == 'text' else value
+
+    def _strip_image(self, fonts):
+        """Maschera del messaggio (255 = testo) rasterizzata una volta sola, seguita dal gap"""
+        font = _resolve_font(fonts, self.font, self.font_size)
+        key = (self.text, font, self.height, self.gap)
+        if self._strip.get('key') != key:
+            text_end = _measure_draw.textbbox((0, 0), self.text, font=font, anchor='lm')[2]
+            strip = Image.new('1', (max(1, math.ceil(text_end) + self.gap), self.height), 0)
+            _draw_text(ImageDraw.Draw(strip), (0, self.height / 2), self.text, font, 255, 'lm')
+            # Modificato sul posto: update() e render_region disegnano da copie di translated()
+            self._strip.clear()
+            self._strip.update(key=key, image=strip)
+        return self._strip['image']
+
+    def step(self, pixels=None):
+        """
+        Fa avanzare il testo di speed pixel (o di pixels) e invalida la striscia
+
+        Returns:
+            True se la posizione è cambiata
+        """
+        return self.set('offset', self.offset + (self.speed if pixels is None else pixels))
+
+    def draw(self, draw, image, fonts):
+        self.draw_clipped(draw, image, fonts, None)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        x0, y0, x1, y1 = self.get_bbox(fonts)
+        if clip is not None:
+            box = _intersect_bbox((x0, y0, x1, y1), clip)
+            if box is None:
+                return
+            x0, y0, x1, y1 = box
+
+        # Il pixel s della striscia cade in start + s + k * period
+        strip = self._strip_image(fonts)
+        period = strip.width
+        start = self.x - self.offset % period
+        pos = start + (x0 - start) // period * period
+        draw.rectangle((x0, y0, x1 - 1, y1 - 1), fill=self.background)
+        while pos < x1:
+            a, b = max(x0, pos), min(x1, pos + period)
+            draw.bitmap((a, y0), strip.crop((a - pos, y0 - self.y, b - pos, y1 - self.y)), fill=self.fill)
+            pos += period
+
+    def get_bbox(self, fonts):
+        return (self.x, self.y, self.x + self.width, self.y + self.height)
+
+
+def _fit_text(text, font, width, ellipsis='...', mode='1'):
+    """Accorcia un testo (con ellipsis) finché la sua larghezza sta in width"""
+    if text_width(text, font, mode) <= width:
+        return text
+    available = width - text_width(ellipsis, font, mode)
+    used = 0
+    for i, ch in enumerate(text):
+        used += text_width(ch, font, mode)
+        if used > available:
+            return text[:i] + ellipsis if i else ''
+    return text
+
+
+class _RowSource:
+    """
+    Accesso per indice alle righe di una sequenza o di un iteratore
+
+    Da un iteratore le righe vengono lette solo quando servono e conservate,
+    così si può tornare alle pagine precedenti.
+    """
+
+    def __init__(self, rows):
+        if hasattr(rows, '__getitem__') and hasattr(rows, '__len__'):
+            self._sequence = rows
+            self._iterator = None
+        else:
+            self._sequence = []
+            self._iterator = iter(rows)
+
+    def __len__(self):
+        """Righe note finora (per un iteratore non ancora esaurito sono solo quelle lette)"""
+        return len(self._sequence)
+
+    @property
+    def exhausted(self):
+        return self._iterator is None
+
+    def get(self, start, count):
+        """Righe da start a start + count (meno se la sorgente finisce prima)"""
+        end = start + count
+        while self._iterator is not None and len(self._sequence) < end:
+            try:
+                self._sequence.append(next(self._iterator))
+            except StopIteration:
+                self._iterator = None
+        return self._sequence[start:end]
+
+
+class Table(Widget):
+    """
+    Tabella virtualizzata per elenchi lunghi (inventari, log, ...)
+
+    Vengono lette e disegnate solo le righe visibili: ogni riga è
+    rasterizzata una volta in un'immagine 1-bit (in cache per contenuto) e poi
+    incollata, quindi scorrere o tornare a una pagina già vista non ridisegna
+    il testo. Le larghezze delle colonne si calcolano una volta dalla misura
+    (in cache) dell'intestazione e delle prime sample_rows righe: il costo di
+    una pagina non dipende dal numero totale di righe.
+
+    Example:
+        table = Table(0, 0, 400, 300, articoli, headers=['Codice', 'Articolo', 'Qtà'],
+                      align=['left', 'left', 'right'])
+        canvas.add_widget(table)
+        table.next_page()
+        canvas.update()
+    """
+
+    _integer_coords = True
+
+    def __init__(self, x, y, width, height, rows, headers=None, columns=None, col_widths=None,
+                 align=None, font_size='small', font=None, header_font=None, fill=0,
+                 padding=3, grid=True, first_row=0, sample_rows=50, cache_rows=64):
+        """
+        Args:
+            x, y: posizione top-left
+            width, height: dimensioni della tabella
+            rows: sequenza o iteratore di righe (liste/tuple di celle o dizionari)
+            headers: titoli delle colonne (None = senza intestazione)
+            columns: indici o chiavi delle celle da mostrare (default tutte, nell'ordine)
+            col_widths: larghezze delle colonne in pixel (None = dalla misura del testo)
+            align: 'left', 'right' o 'center' per ogni colonna
+            font_size, font: font delle celle, come in Text
+            header_font: nome del font dell'intestazione (default quello delle celle)
+            fill: colore del testo e delle linee (le righe sono in B/N: ogni
+                inchiostro della palette diventa nero, il bianco resta bianco)
+            padding: margine del testo nelle celle in pixel
+            grid: disegna bordo e linee tra righe e colonne
+            first_row: indice della prima riga visibile
+            sample_rows: righe misurate per calcolare le larghezze delle colonne
+            cache_rows: righe rasterizzate tenute in cache
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.rows = rows
+        self.headers = headers
+        self.columns = columns
+        self.col_widths = col_widths
+        self.align = align
+        self.font_size = font_size
+        self.font = font
+        self.header_font = header_font
+        self.fill = fill
+        self.padding = padding
+        self.grid = grid
+        self.first_row = first_row
+        self.sample_rows = sample_rows
+        self.cache_rows = cache_rows
+        # Sorgente, larghezze e righe rasterizzate, condivise con le copie di translated()
+        self._cache = {'rows': OrderedDict()}
+
+    def _source(self):
+        cached = self._cache.get('source')
+        if cached is None or cached[0] is not self.rows:
+            cached = self._cache['source'] = (self.rows, _RowSource(self.rows))
+        return cached[1]
+
+    def _cells(self, row):
+        columns = self.columns
+        if columns is None:
+            columns = list(row) if isinstance(row, dict) else range(len(row))
+        return tuple('' if row[c] is None else str(row[c]) for c in columns)
+
+    def _row_height(self, font):
+        return _line_height(font) + 2 * self.padding + (1 if self.grid else 0)
+
+    def visible_rows(self, fonts):
+        """Numero di righe che stanno nella tabella"""
+        font = _resolve_font(fonts, self.font, self.font_size)
+        header = self._row_height(self._header_font(fonts)) if self.headers else 0
+        return max(0, (self.height - header - (1 if self.grid else 0)) // self._row_height(font))
+
+    def _header_font(self, fonts):
+        return _resolve_font(fonts, self.header_font, self.font_size)
+
+    def _widths(self, font, header_font):
+        """Larghezze delle colonne: misurate una volta e adattate alla tabella"""
+        key = (font, header_font, self.width, self.padding, self.sample_rows,
+               self.headers and tuple(self.headers), self.columns and tuple(self.columns),
+               self.col_widths and tuple(self.col_widths))
+        cached = self._cache.get('widths')
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        if self.col_widths:
+            widths = list(self.col_widths)
+        else:
+            sample = [self._cells(row) for row in self._source().get(0, self.sample_rows)]
+            count = max([len(self.headers or ())] + [len(cells) for cells in sample])
+            widths = [0] * count
+            if self.headers:
+                for i, title in enumerate(self.headers):
+                    widths[i] = text_width(str(title), header_font)
+            for cells in sample:
+                for i, cell in enumerate(cells):
+                    widths[i] = max(widths[i], text_width(cell, font))
+            widths = [math.ceil(w) + 2 * self.padding + 1 for w in widths]
+
+            # Adatta alla larghezza della tabella: riduce in proporzione o
+            # assegna lo spazio in più alla colonna più larga (di solito il testo)
+            total = sum(widths)
+            if total > self.width and total:
+                widths = [w * self.width // total for w in widths]
+            if widths:
+                widths[widths.index(max(widths))] += self.width - sum(widths)
+
+        self._cache['widths'] = (key, widths)
+        self._cache['rows'].clear()
+        return widths
+
+    def _render_row(self, cells, font, widths, height):
+        """Riga rasterizzata (in cache per contenuto e aspetto)"""
+        ink = _mono_color(self.fill)
+        key = (cells, font, height, tuple(widths), self.align and tuple(self.align), ink,
+               self.padding, self.grid, self.width)
+        rows = self._cache['rows']
+        img = rows.get(key)
+        if img is not None:
+            rows.move_to_end(key)
+            return img
+
+        img = Image.new('1', (self.width, height), 255 - ink)
+        draw = ImageDraw.Draw(img)
+        left = 0
+        text_y = self.padding + (1 if self.grid else 0)
+        for i, width in enumerate(widths):
+            cell = cells[i] if i < len(cells) else ''
+            inner = width - 2 * self.padding - 1
+            if cell and inner > 0:
+                text = _fit_text(cell, font, inner)
+                align = self.align[i] if self.align and i < len(self.align) else 'left'
+                if align == 'right':
+                    _draw_text(draw, (left + width - self.padding, text_y), text, font, ink, 'ra')
+                elif align == 'center':
+                    _draw_text(draw, (left + width // 2, text_y), text, font, ink, 'ma')
+                else:
+                    _draw_text(draw, (left + self.padding + 1, text_y), text, font, ink, 'la')
+            left += width
+            if self.grid and i < len(widths) - 1:
+                draw.line((left, 0, left, height - 1), fill=ink)
+        if self.grid:
+            draw.line((0, 0, self.width - 1, 0), fill=ink)
+
+        rows[key] = img
+        while len(rows) > self.cache_rows:
+            rows.popitem(last=False)
+        return img
+
+    def _layout(self, fonts):
+        """Righe visibili (immagini '1', testo con hinting monocromatico): [(y, immagine)] e la y finale"""
+        font = _resolve_font(fonts, self.font, self.font_size)
+        header_font = self._header_font(fonts)
+        widths = self._widths(font, header_font)
+        placed = []
+        y = self.y
+        if self.headers:
+            height = self._row_height(header_font)
+            placed.append((y, self._render_row(tuple(str(h) for h in self.headers), header_font,
+                                               widths, height)))
+            y += height
+        height = self._row_height(font)
+        for row in self._source().get(self.first_row, self.visible_rows(fonts)):
+            placed.append((y, self._render_row(self._cells(row), font, widths, height)))
+            y += height
+        return placed, y
+
+    def draw(self, draw, image, fonts):
+        self.draw_clipped(draw, image, fonts, None)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        placed, bottom = self._layout(fonts)
+        for y, row in placed:
+            if clip is None:
+                image.paste(row, (self.x, y))
+            else:
+                _paste_clipped(image, row, self.x, y, clip)
+        if self.grid:
+            # Stesso colore delle linee dentro le righe rasterizzate
+            ink = _mono_color(self.fill)
+            x1, y1 = self.x + self.width - 1, self.y + self.height - 1
+            draw.line((self.x, bottom, x1, bottom), fill=ink)
+            draw.rectangle((self.x, self.y, x1, y1), outline=ink)
+
+    def get_bbox(self, fonts):
+        return (self.x, self.y, self.x + self.width, self.y + self.height)
+
+    def _state(self, fonts):
+        # Solo le righe lette per disegnare: campione per le larghezze e pagina visibile
+        state = super()._state(fonts)
+        source = self._source()
+        sample = () if self.col_widths else source.get(0, self.sample_rows)
+        state['rows'] = (sample, source.get(self.first_row, self.visible_rows(fonts)))
+        return state
+
+    def scroll(self, count):
+        """
+        Sposta la prima riga visibile di count righe (negativo = indietro)
+
+        Returns:
+            True se la tabella è cambiata
+        """
+        first = max(0, self.first_row + count)
+        source = self._source()
+        source.get(first, 1)
+        if source.exhausted and len(source):
+            first = min(first, len(source) - 1)
+        return self.set('first_row', first)
+
+    def next_page(self, fonts=None):
+        """Pagina successiva (fonts = quelli del canvas, se la tabella non è ancora stata aggiunta)"""
+        return self.scroll(self._page_size(fonts))
+
+    def prev_page(self, fonts=None):
+        """Pagina precedente"""
+        return self.scroll(-self._page_size(fonts))
+
+    def _page_size(self, fonts):
+        if fonts is None:
+            fonts = self._canvas.fonts
+        return max(1, self.visible_rows(fonts))
+
+
+# Caratteri rasterizzati per Counter: (font, carattere, larghezza, altezza) -> maschera '1'
+_digit_sprites = OrderedDict()
+_digit_sprites_size = 256
+_digit_sprites_lock = threading.Lock()
+
+
+def _digit_sprite(font, ch, width, height):
+    """Maschera (255 = inchiostro) di una cella con un carattere centrato, rasterizzata una volta per processo"""
+    key = (font, ch, width, height)
+    with _digit_sprites_lock:
+        sprite = _digit_sprites.get(key)
+        if sprite is not None:
+            _digit_sprites.move_to_end(key)
+            return sprite
+    sprite = Image.new('1', (width, height), 0)
+    _draw_text(ImageDraw.Draw(sprite), (width / 2, 0), ch, font, 255, 'ma')
+    with _digit_sprites_lock:
+        _digit_sprites[key] = sprite
+        if len(_digit_sprites) > _digit_sprites_size:
+            _digit_sprites.popitem(last=False)
+    return sprite
+
+
+class Counter(Widget):
+    """
+    Contatore a celle di larghezza fissa (numeri, orari, punteggi)
+
+    Le cifre occupano tutte una cella larga quanto la cifra più larga del
+    font, i separatori (':', '.', ...) una cella della propria larghezza:
+    cambiando una cifra la disposizione resta uguale. Ogni cella è uno sprite
+    in cache, e set('text', ...) invalida solo le celle il cui carattere è
+    cambiato, quindi update() restituisce una regione piccola (una cifra
+    quando scatta un minuto). Se cambiano i separatori o la lunghezza si
+    ridisegna tutto il widget.
+
+    Example:
+        punti = Counter(10, 40, "00042", font_size='xlarge')
+        canvas.add_widget(punti)
+        punti.set('text', "00043")
+        canvas.update()                 # solo l'ultima cifra
+    """
+
+    _integer_coords = True
+
+    def __init__(self, x, y, text, font_size='large', font=None, fill=0, background=255):
+        """
+        Args:
+            x, y: posizione top-left
+            text: testo da mostrare (i numeri vengono convertiti in stringa)
+            font_size, font: come in Text
+            fill: colore delle cifre
+            background: colore di fondo delle celle
+        """
+        super().__init__(x, y)
+        self.text = str(text)
+        self.font_size = font_size
+        self.font = font
+        self.fill = fill
+        self.background = background
+
+    def _normalize(self, name, value):
+        return str(value) if name == 'text' else value
+
+    def _cells(self, font, text=None):
+        """Celle (x0, larghezza) dei caratteri, relative a self.x"""
+        digit_width = math.ceil(max(text_width(d, font) for d in '0123456789'))
+        cells = []
+        left = 0
+        for ch in self.text if text is None else text:
+            width = digit_width if ch.isdigit() else math.ceil(text_width(ch, font))
+            cells.append((left, width))
+            left += width
+        return cells
+
+    @staticmethod
+    def _pattern(text):
+        return [None if ch.isdigit() else ch for ch in text]
+
+    def set(self, name, value):
+        """Come Widget.set, ma per il testo invalida solo le celle cambiate"""
+        value = self._normalize(name, value)
+        canvas = self._canvas
+        if (name != 'text' or canvas is None or value == self.text or
+                self._pattern(value) != self._pattern(self.text)):
+            return super().set(name, value)
+
+        font = _resolve_font(canvas.fonts, self.font, self.font_size)
+        height = _line_height(font)
+        for (left, width), old, new in zip(self._cells(font), self.text, value):
+            if old != new:
+                canvas.invalidate((self.x + left, self.y, self.x + left + width, self.y + height))
+        self.text = value
+        return True
+
+    def draw(self, draw, image, fonts):
+        self.draw_clipped(draw, image, fonts, None)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        font = _resolve_font(fonts, self.font, self.font_size)
+        height = _line_height(font)
+        for (left, width), ch in zip(self._cells(font), self.text):
+            if width > 0:
+                _mask_clipped(draw, _digit_sprite(font, ch, width, height),
+                              self.x + left, self.y, self.fill, self.background, clip)
+
+    def get_bbox(self, fonts):
+        font = _resolve_font(fonts, self.font, self.font_size)
+        cells = self._cells(font)
+        width = cells[-1][0] + cells[-1][1] if cells else 0
+        return (self.x, self.y, self.x + width, self.y + _line_height(font))
+
+
+class Clock(Counter):
+    """
+    Orologio: un Counter con l'ora corrente nel formato di time.strftime
+
+    Example:
+        orologio = Clock(160, 10, '%H:%M', font_size='medium')
+        canvas.add_widget(orologio)
+        while True:
+            if orologio.tick():
+                canvas.update()         # solo le cifre cambiate
+                epd.displayPartial(canvas.get_buffer(270))
+            time.sleep(1)
+    """
+
+    def __init__(self, x, y, fmt='%H:%M', font_size='large', font=None, fill=0, background=255, now=None):
+        """
+        Args:
+            x, y: posizione top-left
+            fmt: formato di time.strftime
+            font_size, font, fill, background: come in Counter
+            now: ora iniziale (struct_time o secondi epoch, None = adesso)
+        """
+        self.fmt = fmt
+        super().__init__(x, y, self._format(now), font_size, font, fill, background)
+
+    def _format(self, now):
+        if now is None or isinstance(now, (int, float)):
+            now = time.localtime(now)
+        return time.strftime(self.fmt, now)
+
+    def tick(self, now=None):
+        """
+        Aggiorna l'ora (now come nel costruttore)
+
+        Returns:
+            True se il testo è cambiato
+        """
+        return self.set('text', self._format(now))
+
+
+class Box(Widget):
+    """Widget per box/rettangoli"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, width, height, fill=255, outline=0, outline_width=1):
+        """
+        Args:
+            x, y: posizione top-left
+            width, height: dimensioni
+            fill: colore riempimento
+            outline: colore bordo
+            outline_width: spessore bordo
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.fill = fill
+        self.outline = outline
+        self.outline_width = outline_width
+
+    def draw(self, draw, image, fonts):
+        draw.rectangle(
+            (self.x, self.y, self.x + self.width, self.y + self.height),
+            fill=self.fill,
+            outline=self.outline,
+            width=self.outline_width
+        )
+
+class StatusBox(Widget):
+    """Box con testo per indicatori di stato (ON/OFF)"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, width, height, text, is_active=False, font_size='medium'):
+        """
+        Args:
+            x, y: posizione
+            width, height: dimensioni
+            text: testo da visualizzare
+            is_active: True per stato attivo (invertito)
+            font_size: dimensione font
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.text = text
+        self.is_active = is_active
+        self.font_size = font_size
+
+    def draw(self, draw, image, fonts):
+        # Box esterno
+        draw.rectangle(
+            (self.x, self.y, self.x + self.width, self.y + self.height),
+            outline=0, fill=255
+        )
+
+        # Box interno (invertito se attivo)
+        draw.rectangle(
+            (self.x + 2, self.y + 2, self.x + self.width - 2, self.y + self.height - 2),
+            outline=0, fill=0 if self.is_active else 255
+        )
+
+        # Testo centrato (colore invertito se attivo)
+        text_fill = 255 if self.is_active else 0
+        font = fonts.get(self.font_size, fonts['medium'])
+        text_x = self.x + self.width / 2
+        text_y = self.y + self.height / 2
+        _draw_text(draw, (text_x, text_y + 1), self.text, font, text_fill, "mm")
+
+    def get_bbox(self, fonts):
+        font = fonts.get(self.font_size, fonts['medium'])
+        text_bbox = _text_bbox((self.x + self.width / 2, self.y + self.height / 2 + 1),
+                               self.text, font, "mm")
+        return _union_bbox(super().get_bbox(fonts), text_bbox)
+
+
+class NotchBar(Widget):
+    """Barra verticale con tacche discrete"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, width, height, level, num_notches=5, spacing=3, color=0):
+        """
+        Args:
+            x, y: posizione top-left
+            width: larghezza barra
+            height: altezza barra
+            level: livello in percentuale (0-100)
+            num_notches: numero di tacche
+            spacing: spazio tra le tacche
+            color: colore delle tacche piene (0=nero, o 'red'/'yellow' su ColorCanvas)
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.level = level
+        self.num_notches = num_notches
+        self.spacing = spacing
+        self.color = color
+
+    def draw(self, draw, image, fonts):
+        # Calcola quante tacche devono essere piene
+        filled_notches = round(self.level * self.num_notches / 100)
+        filled_notches = min(self.num_notches, max(0, filled_notches))
+
+        # Calcola dimensioni tacche
+        total_spacing = self.spacing * (self.num_notches - 1)
+        available_height = self.height - total_spacing
+        notch_height = available_height // self.num_notches
+
+        # Disegna le tacche dal basso verso l'alto
+        for i in range(self.num_notches):
+            y_bottom = self.y + self.height - (i * (notch_height + self.spacing))
+            y_top = y_bottom - notch_height
+
+            # Bordo della tacca
+            draw.rectangle(
+                (self.x, y_top, self.x + self.width, y_bottom),
+                outline=0, fill=255
+            )
+
+            # Riempimento se necessario
+            if i < filled_notches:
+                draw.rectangle(
+                    (self.x + 2, y_top + 2, self.x + self.width - 2, y_bottom - 2),
+                    fill=self.color
+                )
+
+class ProgressBar(Widget):
+    """Barra di progresso orizzontale"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, width, height, progress, show_percentage=True, font_size='small', color=0):
+        """
+        Args:
+            x, y: posizione
+            width, height: dimensioni
+            progress: progresso in percentuale (0-100)
+            show_percentage: mostra il testo con la percentuale
+            font_size: dimensione font per la percentuale
+            color: colore del riempimento (0=nero, o 'red'/'yellow' su ColorCanvas)
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.progress = max(0, min(100, progress))
+        self.show_percentage = show_percentage
+        self.font_size = font_size
+        self.color = color
+
+    def draw(self, draw, image, fonts):
+        # Bordo esterno
+        draw.rectangle(
+            (self.x, self.y, self.x + self.width, self.y + self.height),
+            outline=0, fill=255
+        )
 
         # Riempimento in base al progresso
         fill_width = int((self.width - 4) * self.progress / 100)
         if fill_width > 0:
             draw.rectangle(
                 (self.x + 2, self.y + 2, self.x + 2 + fill_width, self.y + self.height - 2),
-                fill=0
+                fill=self.color
+            )
+
+        # Testo percentuale (opzionale)
+        if self.show_percentage:
+            text = f"{int(self.progress)}%"
+            font = fonts.get(self.font_size, fonts['small'])
+            text_x = self.x + self.width / 2
+            text_y = self.y + self.height / 2
+
+            # Disegna testo bianco su sfondo nero per leggibilità
+            bbox = draw.textbbox((text_x, text_y), text, font=font, anchor="mm")
+            draw.rectangle(bbox, fill=255)
+            _draw_text(draw, (text_x, text_y), text, font, 0, "mm")
+
+    def _normalize(self, name, value):
+        return max(0, min(100, value)) if name == 'progress' else value
+
+    def get_bbox(self, fonts):
+        bbox = super().get_bbox(fonts)
+        if self.show_percentage:
+            font = fonts.get(self.font_size, fonts['small'])
+            text_bbox = _text_bbox((self.x + self.width / 2, self.y + self.height / 2),
+                                   f"{int(self.progress)}%", font, "mm")
+            # Il rettangolo di sfondo del testo include l'estremo destro/inferiore
+            bbox = _union_bbox(bbox, (text_bbox[0], text_bbox[1], text_bbox[2] + 1, text_bbox[3] + 1))
+        return bbox
+
+
+class SVGIcon(Widget):
+    """Widget per icone SVG"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, svg_string, size=None):
+        """
+        Args:
+            x, y: posizione
+            svg_string: contenuto SVG come stringa
+            size: tupla (width, height) per ridimensionare
+        """
+        super().__init__(x, y)
+        self.svg_string = svg_string
+        self.size = size
+
+    def draw(self, draw, image, fonts):
+        img = render_svg(self.svg_string, self.size)
+        image.paste(img, (self.x, self.y))
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        _paste_clipped(image, render_svg(self.svg_string, self.size), self.x, self.y, clip)
+
+    def get_bbox(self, fonts):
+        width, height = self.size or render_svg(self.svg_string).size
+        return (self.x, self.y, self.x + width, self.y + height)
+
+
+# Contenuto dei file SVG: percorso -> (mtime, testo)
+_svg_files = {}
+
+
+def _read_svg_file(path):
+    """Testo di un file SVG, riletto dal disco solo se è stato modificato"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _svg_files.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r') as f:
+            cached = _svg_files[path] = (mtime, f.read())
+    return cached[1]
+
+
+class SVG(Widget):
+    """Widget per SVG - supporta sia stringhe che file"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, svg_source, size=None, is_file=False):
+        """
+        Args:
+            x, y: posizione
+            svg_source: stringa SVG o percorso al file SVG
+            size: tupla (width, height) per ridimensionare
+            is_file: True se svg_source è un percorso file, False se è una stringa
+        """
+        super().__init__(x, y)
+        self.svg_source = svg_source
+        self.size = size
+        self.is_file = is_file
+
+    def _svg_string(self):
+        # Carica SVG da file (riletto solo se cambia) o stringa
+        if self.is_file:
+            return _read_svg_file(self.svg_source)
+        return self.svg_source
+
+    def _state(self, fonts):
+        state = super()._state(fonts)
+        if self.is_file:
+            state['svg_source'] = _file_state(self.svg_source)
+        return state
+
+    def draw(self, draw, image, fonts):
+        # Converte SVG in immagine B/N (con cache) e incolla
+        img = render_svg(self._svg_string(), self.size)
+        image.paste(img, (self.x, self.y))
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        _paste_clipped(image, render_svg(self._svg_string(), self.size), self.x, self.y, clip)
+
+    def get_bbox(self, fonts):
+        if self.size:
+            width, height = self.size
+        else:
+            width, height = render_svg(self._svg_string()).size
+        return (self.x, self.y, self.x + width, self.y + height)
+
+
+# Immagini raster già convertite in B/N: (sorgente, size, crop, dither) -> immagine '1'
+_raster_cache = OrderedDict()
+_raster_cache_size = 32
+_raster_cache_lock = threading.Lock()
+
+
+def _raster_source(source):
+    """
+    Sorgente raster normalizzata: i percorsi restano tali, il contenuto in
+    memoria diventa bytes (i file aperti e gli stream vengono letti tutti)
+
+    Raises:
+        TypeError: se non è un percorso, dei bytes o un file aperto in binario
+    """
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        data = source.read()
+        if not isinstance(data, (bytes, bytearray)):
+            raise TypeError("Il file dell'immagine va aperto in modalità binaria ('rb')")
+        return bytes(data)
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    raise TypeError(f"Sorgente immagine non supportata: {type(source).__name__} "
+                    "(serve un percorso, dei bytes o un file aperto)")
+
+
+def _raster_source_key(source):
+    """Chiave di cache di una sorgente normalizzata: contenuto in memoria o file (con mtime e dimensione)"""
+    if isinstance(source, bytes):
+        return ('bytes', hashlib.blake2b(source, digest_size=16).hexdigest())
+    return _file_state(source)
+
+
+def _fill_size(size, width, height):
+    """Completa una dimensione None mantenendo le proporzioni di width x height"""
+    if size is None:
+        return (width, height)
+    target_w, target_h = size
+    if target_w is None:
+        target_w = max(1, round(width * target_h / height))
+    elif target_h is None:
+        target_h = max(1, round(height * target_w / width))
+    return (target_w, target_h)
+
+
+def load_image(source, size=None, crop=None, dither=True):
+    """
+    Carica un'immagine raster (JPEG, PNG, ...) in B/N, con cache condivisa tra i canvas
+
+    Il ritaglio avviene prima del ridimensionamento e i JPEG vengono decodificati
+    direttamente a risoluzione ridotta (draft): una foto da 12 Mpx per un
+    pannello da 250x122 non viene mai espansa a piena risoluzione. Resta in
+    memoria solo il risultato a 1 bit.
+
+    Args:
+        source: percorso del file, contenuto (bytes) dell'immagine o file aperto in binario
+        size: tupla (width, height) finale; uno dei due può essere None per
+            mantenere le proporzioni (None = dimensioni del ritaglio)
+        crop: regione (x0, y0, x1, y1) in pixel dell'immagine originale
+        dither: Floyd-Steinberg come per gli SVG (False = soglia, es. per le mappe)
+
+    Returns:
+        immagine PIL in modalità '1' (da non modificare: è condivisa)
+
+    Raises:
+        TypeError: sorgente di tipo non supportato
+    """
+    source = _raster_source(source)
+    return _load_image(source, _raster_source_key(source), size, crop, dither)
+
+
+def _load_image(source, source_key, size, crop, dither):
+    """load_image con sorgente già normalizzata e chiave già calcolata"""
+    key = (source_key, size and tuple(size), crop and tuple(crop), dither)
+    with _raster_cache_lock:
+        img = _raster_cache.get(key)
+        if img is not None:
+            _raster_cache.move_to_end(key)
+            return img
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        full_w, full_h = img.size
+        box = tuple(crop) if crop else (0, 0, full_w, full_h)
+        crop_w, crop_h = box[2] - box[0], box[3] - box[1]
+        target = _fill_size(size, crop_w, crop_h)
+
+        # Decodifica ridotta (solo JPEG: scala 1/2, 1/4, 1/8) che copre ancora
+        # il ritaglio alla risoluzione finale, direttamente in scala di grigi
+        img.draft('L', (math.ceil(full_w * target[0] / crop_w), math.ceil(full_h * target[1] / crop_h)))
+        if img.size != (full_w, full_h):
+            sx, sy = img.width / full_w, img.height / full_h
+            box = (box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy)
+
+        img = _to_1bit(img, target, box, dither, reducing_gap=2.0)
+
+    with _raster_cache_lock:
+        _raster_cache[key] = img
+        if len(_raster_cache) > _raster_cache_size:
+            _raster_cache.popitem(last=False)
+    return img
+
+
+class RasterImage(Widget):
+    """
+    Widget per immagini raster (foto, snapshot di telecamere, tile di mappe)
+
+    Example:
+        RasterImage(0, 0, '/tmp/snapshot.jpg', size=(250, 122))
+        RasterImage(0, 0, 'mappa.png', size=(200, None), crop=(1024, 512, 1536, 1024), dither=False)
+    """
+
+    _integer_coords = True
+
+    def __init__(self, x, y, source, size=None, crop=None, dither=True):
+        """
+        Args:
+            x, y: posizione
+            source: percorso del file, contenuto (bytes) dell'immagine o file aperto
+                in binario (letto subito)
+            size: tupla (width, height); uno dei due può essere None per mantenere le proporzioni
+            crop: regione (x0, y0, x1, y1) dell'immagine originale da mostrare
+            dither: Floyd-Steinberg (True) o soglia semplice (False)
+        """
+        super().__init__(x, y)
+        self.source = _raster_source(source)
+        self.size = size
+        self.crop = crop
+        self.dither = dither
+        # Chiave del contenuto in memoria, condivisa con le copie di translated()
+        self._cache = {}
+
+    def _normalize(self, name, value):
+        return _raster_source(value) if name == 'source' else value
+
+    def _source_key(self):
+        # I bytes si hashano una volta per sorgente; per i file si ricontrolla mtime a ogni disegno
+        if not isinstance(self.source, bytes):
+            return _raster_source_key(self.source)
+        cached = self._cache.get('key')
+        if cached is None or cached[0] is not self.source:
+            cached = self._cache['key'] = (self.source, _raster_source_key(self.source))
+        return cached[1]
+
+    def _image(self):
+        return _load_image(self.source, self._source_key(), self.size, self.crop, self.dither)
+
+    def _state(self, fonts):
+        state = super()._state(fonts)
+        state['source'] = self._source_key()
+        return state
+
+    def draw(self, draw, image, fonts):
+        image.paste(self._image(), (self.x, self.y))
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        _paste_clipped(image, self._image(), self.x, self.y, clip)
+
+    def get_bbox(self, fonts):
+        if self.size and None not in self.size:
+            width, height = self.size
+        else:
+            width, height = self._image().size
+        return (self.x, self.y, self.x + width, self.y + height)
+
+
+# Formato file dell'atlante: magic, larghezza, altezza, lunghezza indice, offset bitmap
+_ATLAS_MAGIC = b'EINKATL1'
+_ATLAS_HEADER = struct.Struct('<8sIIII')
+
+
+def build_icon_atlas(svg_dir, output_path, sizes, atlas_width=512):
+    """
+    Rasterizza una directory di SVG in un unico atlante 1-bit
+
+    Ogni icona viene disegnata a tutte le dimensioni richieste e disposta a
+    ripiani nel bitmap (con x allineata al byte). L'indice dei sotto-rettangoli
+    è salvato in JSON in testa al file. Richiede cairosvg solo qui, non a runtime.
+
+    Args:
+        svg_dir: directory con i file .svg (il nome file senza estensione è il nome icona)
+        output_path: file dell'atlante da scrivere
+        sizes: lista di dimensioni, come interi (lato) o tuple (width, height)
+        atlas_width: larghezza del bitmap dell'atlante in pixel (multiplo di 8)
+
+    Returns:
+        numero di icone scritte
+    """
+    sizes = [(size, size) if isinstance(size, int) else tuple(size) for size in sizes]
+
+    icons = []
+    for filename in sorted(os.listdir(svg_dir)):
+        if not filename.lower().endswith('.svg'):
+            continue
+        name = os.path.splitext(filename)[0]
+        with open(os.path.join(svg_dir, filename), 'r') as f:
+            svg_string = f.read()
+        for size in sizes:
+            icons.append((name, size, render_svg(svg_string, size)))
+
+    # Disposizione a ripiani, icone più alte per prime
+    icons.sort(key=lambda icon: -icon[2].height)
+    index = {}
+    x = y = shelf_height = 0
+    for name, size, img in icons:
+        if x + img.width > atlas_width:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        index[f"{name}@{size[0]}x{size[1]}"] = [x, y, img.width, img.height]
+        x += (img.width + 7) // 8 * 8
+        shelf_height = max(shelf_height, img.height)
+    atlas_height = y + shelf_height
+
+    atlas = Image.new('1', (atlas_width, max(1, atlas_height)), 255)
+    for name, size, img in icons:
+        atlas.paste(img, tuple(index[f"{name}@{size[0]}x{size[1]}"][:2]))
+
+    index_data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    data_offset = (_ATLAS_HEADER.size + len(index_data) + 7) // 8 * 8
+    with open(output_path, 'wb') as f:
+        f.write(_ATLAS_HEADER.pack(_ATLAS_MAGIC, atlas.width, atlas.height, len(index_data), data_offset))
+        f.write(index_data)
+        f.write(b'\0' * (data_offset - _ATLAS_HEADER.size - len(index_data)))
+        f.write(atlas.tobytes('raw'))
+    return len(icons)
+
+
+class IconAtlas:
+    """
+    Atlante di icone pre-rasterizzate, creato con build_icon_atlas
+
+    Il file viene mappato in memoria: le icone si estraggono copiando solo le
+    righe del loro rettangolo, senza decodificare SVG o PNG (e senza cairosvg).
+
+    Example:
+        atlas = IconAtlas('pic/icons.atlas')
+        canvas.add_widget(AtlasIcon(10, 10, atlas, 'sole', size=48))
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: file dell'atlante
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, self.height, index_len, self._data_offset = _ATLAS_HEADER.unpack_from(self._mmap)
+        if magic != _ATLAS_MAGIC:
+            raise ValueError(f"{path} non è un atlante di icone valido")
+        start = _ATLAS_HEADER.size
+        self.index = json.loads(self._mmap[start:start + index_len].decode('utf-8'))
+        self._stride = (self.width + 7) // 8
+        self._icons = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        """Nomi delle icone disponibili"""
+        return sorted({key.rsplit('@', 1)[0] for key in self.index})
+
+    def sizes(self, name):
+        """Dimensioni disponibili per un'icona, come tuple (width, height)"""
+        prefix = name + '@'
+        return [tuple(int(v) for v in key[len(prefix):].split('x'))
+                for key in self.index if key.startswith(prefix)]
+
+    def _key(self, name, size):
+        if size is None:
+            sizes = self.sizes(name)
+            if len(sizes) != 1:
+                raise KeyError(f"Icona '{name}': specificare la dimensione tra {sizes}")
+            size = sizes[0]
+        elif isinstance(size, int):
+            size = (size, size)
+        return f"{name}@{size[0]}x{size[1]}"
+
+    def get(self, name, size=None):
+        """
+        Restituisce l'icona come immagine '1' (condivisa, da non modificare)
+
+        Args:
+            name: nome dell'icona
+            size: lato o tupla (width, height); None se l'icona ha una sola dimensione
+        """
+        key = self._key(name, size)
+        img = self._icons.get(key)
+        if img is None:
+            x, y, width, height = self.index[key]
+            row_bytes = (width + 7) // 8
+            start = self._data_offset + y * self._stride + x // 8
+            rows = b''.join(
+                self._mmap[offset:offset + row_bytes]
+                for offset in range(start, start + height * self._stride, self._stride)
             )
+            img = Image.frombytes('1', (width, height), rows)
+            with self._lock:
+                self._icons[key] = img
+        return img
+
+    def close(self):
+        """Chiude il file mappato"""
+        self._icons = {}
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AtlasIcon(Widget):
+    """Widget per icone prese da un IconAtlas (nessuna rasterizzazione a runtime)"""
+
+    _integer_coords = True
+
+    def __init__(self, x, y, atlas, name, size=None):
+        """
+        Args:
+            x, y: posizione
+            atlas: IconAtlas da cui prendere l'icona
+            name: nome dell'icona (nome del file SVG senza estensione)
+            size: lato o tupla (width, height); None se l'icona ha una sola dimensione
+        """
+        super().__init__(x, y)
+        self.atlas = atlas
+        self.name = name
+        self.size = size
+
+    def draw(self, draw, image, fonts):
+        image.paste(self.atlas.get(self.name, self.size), (self.x, self.y))
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        _paste_clipped(image, self.atlas.get(self.name, self.size), self.x, self.y, clip)
+
+    def get_bbox(self, fonts):
+        width, height = self.atlas.get(self.name, self.size).size
+        return (self.x, self.y, self.x + width, self.y + height)
+
+
+# Immagini di lavoro riusate, per thread: (modo, dimensioni) -> (immagine, draw)
+_scratch = threading.local()
+
+
+def _scratch_image(mode, size, color):
+    """
+    Immagine temporanea riusata tra un frame e l'altro, riempita con color
+
+    Ogni thread ha le sue, quindi si possono usare anche da add_widgets in
+    parallelo; il contenuto vale fino alla prossima richiesta della stessa.
+    """
+    images = getattr(_scratch, 'images', None)
+    if images is None:
+        images = _scratch.images = {}
+    entry = images.get((mode, size))
+    if entry is None:
+        img = Image.new(mode, size, color)
+        entry = images[(mode, size)] = (img, ImageDraw.Draw(img))
+    else:
+        entry[0].paste(color, (0, 0) + size)
+    return entry
+
+
+# Retinature già rasterizzate: (dimensioni, area, tipo, passo, origine) -> immagine '1'
+_hatch_cache = OrderedDict()
+_hatch_cache_size = 32
+_hatch_cache_lock = threading.Lock()
+
+
+def _hatch_image(size, area, pattern_type, spacing, origin):
+    """Immagine '1' con la retinatura (0 = inchiostro) solo dentro area (condivisa, da non modificare)"""
+    key = (size, area, pattern_type, spacing, origin)
+    with _hatch_cache_lock:
+        img = _hatch_cache.get(key)
+        if img is not None:
+            _hatch_cache.move_to_end(key)
+            return img
+    pattern = PackedBitmap(*size)
+    pattern.pattern_fill(*area, hatch_pattern(pattern_type, spacing), origin)
+    img = pattern.get_image()
+    with _hatch_cache_lock:
+        _hatch_cache[key] = img
+        if len(_hatch_cache) > _hatch_cache_size:
+            _hatch_cache.popitem(last=False)
+    return img
+
+
+class DonutChart(Widget):
+    """Widget per grafici a ciambella (donut chart)"""
+
+    def __init__(self, x, y, diameter, data, labels=None, hole_ratio=0.5, show_labels=True, font_size='small', use_patterns=True,
+                 colors=None):
+        """
+        Args:
+            x, y: posizione del centro del grafico
+            diameter: diametro del grafico
+            data: lista di valori numerici (verranno convertiti in percentuali)
+            labels: lista di etichette (opzionale)
+            hole_ratio: rapporto del buco centrale (0.0-1.0, default 0.5)
+            show_labels: mostra le etichette con percentuali
+            font_size: dimensione font per le etichette
+            use_patterns: usa retinature invece di riempimenti solidi
+            colors: lista di colori di riempimento dei settori (es. GRAY2, GRAY3 su
+                    GrayCanvas o 'red' su ColorCanvas), ha priorità su use_patterns
+        """
+        super().__init__(x, y)
+        self.diameter = diameter
+        self.data = data
+        self.labels = labels or [f"Seg {i+1}" for i in range(len(data))]
+        self.hole_ratio = max(0.0, min(1.0, hole_ratio))
+        self.show_labels = show_labels
+        self.font_size = font_size
+        self.use_patterns = use_patterns
+        self.colors = colors
+
+    def _apply_pattern(self, draw, bbox, start_angle, end_angle, pattern_type, spacing=4, clip=None):
+        """Applica un pattern di retinatura a un settore (solo dentro clip, se indicato)"""
+        x1, y1, x2, y2 = (int(v) for v in bbox)
+        area = (x1, y1, x2, y2) if clip is None else _intersect_bbox((x1, y1, x2, y2), clip)
+        if area is None:
+            return
+
+        # Maschera del settore (255 = settore), riusata tra un disegno e l'altro
+        offset = 10
+        mask, mask_draw = _scratch_image('1', (self.diameter + 20, self.diameter + 20), 0)
+        mask_bbox = [offset, offset, self.diameter + offset, self.diameter + offset]
+        mask_draw.pieslice(mask_bbox, start_angle, end_angle, fill=255)
+
+        # Rimuovi il buco centrale dalla maschera
+        hole_radius = int((self.diameter // 2) * self.hole_ratio)
+        if hole_radius > 0:
+            center = self.diameter // 2 + offset
+            hole_bbox = [
+                center - hole_radius,
+                center - hole_radius,
+                center + hole_radius,
+                center + hole_radius
+            ]
+            mask_draw.ellipse(hole_bbox, fill=0)
+
+        # Retinatura sull'area del settore, ancorata all'angolo del bbox
+        # (le diagonali / partono dall'angolo in basso a sinistra)
+        origin = (offset, offset + y2 - y1 if pattern_type == 'diagonal1' else offset)
+        pattern = _hatch_image(mask.size, (area[0] - x1 + offset, area[1] - y1 + offset,
+                                           area[2] - x1 + offset - 1, area[3] - y1 + offset - 1),
+                               pattern_type, spacing, origin)
+
+        # Inchiostro dove sia il settore sia la retinatura sono neri
+        mask.paste(0, (0, 0), pattern)
+        draw.bitmap((x1 - offset, y1 - offset), mask, fill=0)
+
+    def _sector_bbox(self, start_angle, end_angle):
+        """Bounding box di un settore (centro compreso) con il bordo di 2 pixel"""
+        radius = self.diameter // 2
+        angles = [start_angle, end_angle] + [a for a in range(-90, 361, 90) if start_angle < a < end_angle]
+        xs = [self.x] + [self.x + radius * math.cos(math.radians(a)) for a in angles]
+        ys = [self.y] + [self.y + radius * math.sin(math.radians(a)) for a in angles]
+        return (math.floor(min(xs)) - 3, math.floor(min(ys)) - 3, math.ceil(max(xs)) + 4, math.ceil(max(ys)) + 4)
+
+    def draw(self, draw, image, fonts):
+        self.draw_clipped(draw, image, fonts, None)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        if not self.data:
+            return
+
+        # Calcola il totale e le percentuali
+        total = sum(self.data)
+        if total == 0:
+            return
+
+        # Calcola il bounding box per il cerchio
+        radius = self.diameter // 2
+        bbox = [
+            self.x - radius,
+            self.y - radius,
+            self.x + radius,
+            self.y + radius
+        ]
+
+        # Disegna i settori
+        start_angle = -90  # Inizia dall'alto
+
+        # Pattern disponibili
+        pattern_types = ['horizontal', 'vertical', 'diagonal1', 'diagonal2', 'dots', 'crosshatch']
+
+        labels = self._labels()
+        font = fonts.get(self.font_size, fonts['small'])
+
+        for i, value in enumerate(self.data):
+            # Calcola l'angolo del settore
+            angle = 360 * value / total
+            end_angle = start_angle + angle
+
+            # Con clip, salta i settori che non lo toccano
+            visible = clip is None or _intersect_bbox(self._sector_bbox(start_angle, end_angle), clip)
+
+            if not visible:
+                pass
+            elif self.colors:
+                # Disegna il settore con il colore indicato (grigi reali, inchiostri colorati)
+                fill_color = self.colors[i % len(self.colors)]
+                draw.pieslice(bbox, start_angle, end_angle, fill=fill_color, outline=0, width=2)
+            elif self.use_patterns:
+                # Disegna il settore con sfondo bianco e bordo
+                draw.pieslice(bbox, start_angle, end_angle, fill=255, outline=0, width=2)
+
+                # Applica il pattern
+                pattern_type = pattern_types[i % len(pattern_types)]
+                self._apply_pattern(draw, bbox, start_angle, end_angle, pattern_type, spacing=3, clip=clip)
+            else:
+                # Disegna il settore con riempimento solido
+                fill_color = 0 if i % 2 == 0 else 255
+                draw.pieslice(bbox, start_angle, end_angle, fill=fill_color, outline=0, width=2)
+
+            # Etichette del settore (all'esterno del grafico)
+            for xy, text, anchor in labels.get(i, ()):
+                if clip is None:
+                    _draw_text(draw, xy, text, font, 0, anchor)
+                else:
+                    _draw_text_clipped(draw, xy, text, font, 0, anchor, clip)
+
+            start_angle = end_angle
+
+        # Disegna il buco centrale
+        hole_radius = int(radius * self.hole_ratio)
+        if hole_radius > 0:
+            hole_bbox = [
+                self.x - hole_radius,
+                self.y - hole_radius,
+                self.x + hole_radius,
+                self.y + hole_radius
+            ]
+            draw.ellipse(hole_bbox, fill=255, outline=0, width=2)
+
+    def _labels(self):
+        """
+        Calcola le etichette dei settori
+
+        Returns:
+            dizionario {indice settore: [(xy, testo, ancora), ...]}
+        """
+        labels = {}
+        total = sum(self.data)
+        if not self.show_labels or total == 0:
+            return labels
+
+        radius = self.diameter // 2
+        start_angle = -90
+        for i, value in enumerate(self.data):
+            angle = 360 * value / total
+            end_angle = start_angle + angle
+
+            if angle > 3:  # Mostra solo se il settore è abbastanza grande
+                mid_angle = (start_angle + end_angle) / 2
+
+                # Posizione esterna al cerchio
+                label_radius = radius * 1.3  # Fuori dal cerchio
+                label_x = self.x + label_radius * math.cos(math.radians(mid_angle))
+                label_y = self.y + label_radius * math.sin(math.radians(mid_angle))
+
+                # Prepara il testo
+                percentage = (value / total) * 100
+                label_text = self.labels[i] if i < len(self.labels) else f"Seg{i+1}"
+
+                # Determina l'ancora in base alla posizione
+                if mid_angle > -45 and mid_angle <= 45:  # Destra
+                    anchor = "lm"
+                elif mid_angle > 45 and mid_angle <= 135:  # Basso
+                    anchor = "mt"
+                elif mid_angle > 135 or mid_angle <= -135:  # Sinistra
+                    anchor = "rm"
+                else:  # Alto
+                    anchor = "mb"
+
+                # Etichetta e percentuale su due righe separate (anchor non supporta multilinea)
+                labels[i] = [
+                    ((label_x, label_y - 6), label_text, anchor),
+                    ((label_x, label_y + 6), f"{percentage:.0f}%", anchor),
+                ]
+
+            start_angle = end_angle
+        return labels
+
+    def get_bbox(self, fonts):
+        if not self.data or sum(self.data) == 0:
+            return (self.x, self.y, self.x, self.y)
+        radius = self.diameter // 2
+        bbox = (self.x - radius - 1, self.y - radius - 1, self.x + radius + 2, self.y + radius + 2)
+        font = fonts.get(self.font_size, fonts['small'])
+        for items in self._labels().values():
+            for xy, text, anchor in items:
+                bbox = _union_bbox(bbox, _text_bbox(xy, text, font, anchor))
+        return bbox
+
+
+class Line(Widget):
+    """Widget per linee"""
+
+    def __init__(self, x1, y1, x2, y2, fill=0, width=1):
+        """
+        Args:
+            x1, y1: punto iniziale
+            x2, y2: punto finale
+            fill: colore
+            width: spessore
+        """
+        super().__init__(x1, y1)
+        self.x2 = x2
+        self.y2 = y2
+        self.fill = fill
+        self.width = width
+
+    def draw(self, draw, image, fonts):
+        draw.line((self.x, self.y, self.x2, self.y2), fill=self.fill, width=self.width)
+
+    def get_bbox(self, fonts):
+        pad = self.width // 2 + 1
+        return (math.floor(min(self.x, self.x2)) - pad, math.floor(min(self.y, self.y2)) - pad,
+                math.ceil(max(self.x, self.x2)) + pad + 1, math.ceil(max(self.y, self.y2)) + pad + 1)
+
+    def _shift(self, dx, dy):
+        super()._shift(dx, dy)
+        self.x2 += dx
+        self.y2 += dy
+
+
+class SimpleGraph(Widget):
+    """Grafico a linee semplice"""
+
+    def __init__(self, x, y, width, height, data, min_val=None, max_val=None):
+        """
+        Args:
+            x, y: posizione
+            width, height: dimensioni
+            data: lista di valori numerici
+            min_val, max_val: range valori (None per auto)
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.data = data
+        self._auto_range = (min_val is None, max_val is None)
+        self.min_val = min_val if min_val is not None else min(data) if data else 0
+        self.max_val = max_val if max_val is not None else max(data) if data else 100
+
+    def set(self, name, value):
+        if name == 'data':
+            value = list(value)
+        elif name in ('min_val', 'max_val'):
+            # Un limite esplicito resta fisso anche con nuovi dati, None lo rende automatico
+            is_min = name == 'min_val'
+            auto = value is None
+            self._auto_range = (auto, self._auto_range[1]) if is_min else (self._auto_range[0], auto)
+            if auto:
+                value = (min(self.data) if self.data else 0) if is_min else (max(self.data) if self.data else 100)
+        changed = super().set(name, value)
+        if changed and name == 'data':
+            # Ricalcola il range automatico sui nuovi dati
+            if self._auto_range[0]:
+                self.min_val = min(value) if value else 0
+            if self._auto_range[1]:
+                self.max_val = max(value) if value else 100
+        return changed
+
+    def draw(self, draw, image, fonts):
+        self.draw_clipped(draw, image, fonts, None)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        if not self.data or len(self.data) < 2:
+            return
+
+        # Bordo
+        draw.rectangle(
+            (self.x, self.y, self.x + self.width, self.y + self.height),
+            outline=0, fill=255
+        )
+
+        # Normalizza i dati
+        value_range = self.max_val - self.min_val
+        if value_range == 0:
+            return
+
+        # Calcola i punti
+        points = []
+        step = (self.width - 4) / (len(self.data) - 1)
+
+        for i, val in enumerate(self.data):
+            px = self.x + 2 + int(i * step)
+            normalized = (val - self.min_val) / value_range
+            py = self.y + self.height - 2 - int(normalized * (self.height - 4))
+            points.append((px, py))
+
+        # Disegna la linea (con clip, solo i tratti consecutivi che lo toccano)
+        if clip is None:
+            draw.line(points, fill=0, width=2)
+            return
+        run = []
+        for a, b in zip(points, points[1:]):
+            segment = (min(a[0], b[0]) - 2, min(a[1], b[1]) - 2, max(a[0], b[0]) + 3, max(a[1], b[1]) + 3)
+            if _intersect_bbox(segment, clip):
+                run = run or [a]
+                run.append(b)
+            elif run:
+                draw.line(run, fill=0, width=2)
+                run = []
+        if run:
+            draw.line(run, fill=0, width=2)
+
+
+# Aree di disegno dei grafici già renderizzate: chiave -> immagine '1'
+_plot_cache = OrderedDict()
+_plot_cache_size = 32
+_plot_cache_lock = threading.Lock()
+
+
+def nice_ticks(lo, hi, count=5):
+    """
+    Valori "tondi" (1, 2, 5 x 10^n) per le tacche di un asse tra lo e hi
+
+    Args:
+        lo, hi: estremi dell'asse
+        count: numero indicativo di tacche
+
+    Returns:
+        lista di valori crescenti compresi tra lo e hi
+    """
+    if hi < lo:
+        lo, hi = hi, lo
+    if hi == lo:
+        return [lo]
+    raw = (hi - lo) / max(1, count - 1)
+    magnitude = 10 ** math.floor(math.log10(raw))
+    # Il passo tondo che dà il numero di tacche più vicino a quello richiesto
+    step = min((m * magnitude for m in (1, 2, 5, 10)), key=lambda s: abs((hi - lo) / s + 1 - count))
+    first = math.ceil(lo / step - 1e-9)
+    last = math.floor(hi / step + 1e-9)
+    return [round(i * step, 12) for i in range(first, last + 1)]
+
+
+def _format_tick(value):
+    return str(int(value)) if value == int(value) else f"{value:g}"
+
+
+def decimate(values, buckets):
+    """
+    Riduce una serie a buckets colonne conservando i picchi
+
+    Per ogni colonna restituisce (primo, minimo, massimo, ultimo): tracciando il
+    tratto verticale min-max e collegando l'ultimo valore di una colonna al
+    primo della successiva si ottiene lo stesso disegno della serie completa.
+    Il ciclo Python è sulle colonne, min/max sulle fette girano in C.
+    """
+    n = len(values)
+    bounds = [i * n // buckets for i in range(buckets + 1)]
+    columns = []
+    for start, end in zip(bounds, bounds[1:]):
+        if end > start:
+            chunk = values[start:end]
+            columns.append((chunk[0], min(chunk), max(chunk), chunk[-1]))
+    return columns
+
+
+class _PlotArea:
+    """Rettangolo di disegno di un grafico (estremi inclusi) con la scala dei valori"""
+
+    def __init__(self, x0, y0, x1, y1, lo, hi):
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.lo, self.hi = lo, hi
+        self.columns = x1 - x0 + 1
+        self._scale = (y1 - y0) / (hi - lo)
+
+    def ys(self, values):
+        """Righe in pixel dei valori (fuori scala vengono portati sul bordo)"""
+        y0, y1, lo, scale = self.y0, self.y1, self.lo, self._scale
+        return [min(y1, max(y0, y1 - round((v - lo) * scale))) for v in values]
+
+    def xs(self, n):
+        """Colonne in pixel di n campioni distribuiti sulla larghezza"""
+        if n == 1:
+            return [self.x0]
+        span = self.columns - 1
+        return [self.x0 + i * span // (n - 1) for i in range(n)]
+
+    def polyline(self, values):
+        """
+        Punti di una serie, con al massimo 4 punti per colonna
+
+        Le serie più lunghe della larghezza vengono decimate (vedi decimate),
+        quindi il costo dipende dai pixel e non dal numero di campioni.
+        """
+        if len(values) <= self.columns:
+            return list(zip(self.xs(len(values)), self.ys(values)))
+        columns = decimate(values, self.columns)
+        ys = self.ys([v for column in columns for v in column])
+        points = []
+        for i, x in enumerate(range(self.x0, self.x0 + len(columns))):
+            first, low, high, last = ys[i * 4:i * 4 + 4]
+            points += [(x, first), (x, low), (x, high), (x, last)]
+        return points
+
+
+# Stili delle serie: (spessore, tratteggio (pixel pieni, pixel vuoti) o None)
+_LINE_STYLES = {
+    'solid': (2, None),
+    'thin': (1, None),
+    'dashed': (2, (6, 3)),
+    'dotted': (1, (1, 2)),
+}
+
+
+def _stripes(width, height, on, off):
+    """Maschera '1' a colonne: nero per on pixel, bianco per off pixel"""
+    period = on + off
+    row = bytes(0 if x % period < on else 255 for x in range(width))
+    return Image.frombytes('L', (width, 1), row).resize((width, height), Image.Resampling.NEAREST).convert('1')
+
+
+class _Chart(Widget):
+    """
+    Base dei grafici: scala, assi, decimazione e cache dell'area disegnata
+
+    Il grafico viene disegnato in un'immagine '1' (nero su bianco) che resta in
+    cache finché dati visibili, dimensioni, stile e font non cambiano; spostare
+    il widget o ridisegnarlo con gli stessi dati costa solo l'incolla.
+    """
+
+    def __init__(self, x, y, width, height, min_val=None, max_val=None, window=None,
+                 show_axis=False, tick_count=4, font_size='small', border=False):
+        """
+        Args:
+            x, y: posizione top-left
+            width, height: dimensioni
+            min_val, max_val: range dei valori (None = automatico sui dati visibili)
+            window: mostra solo gli ultimi window campioni (None = tutti)
+            show_axis: disegna l'asse verticale con tacche ed etichette
+            tick_count: numero indicativo di tacche sull'asse
+            font_size: font delle etichette
+            border: disegna un bordo attorno al grafico
+        """
+        super().__init__(x, y)
+        self.width = width
+        self.height = height
+        self.min_val = min_val
+        self.max_val = max_val
+        self.window = window
+        self.show_axis = show_axis
+        self.tick_count = tick_count
+        self.font_size = font_size
+        self.border = border
+
+    def _visible(self, values):
+        return values[-self.window:] if self.window else values
+
+    def _series(self):
+        """Serie visibili (liste di valori); da implementare nelle sottoclassi"""
+        raise NotImplementedError
+
+    def _value_range(self, series):
+        values = [v for s in series if s for v in (min(s), max(s))]
+        lo = self.min_val if self.min_val is not None else min(values, default=0)
+        hi = self.max_val if self.max_val is not None else max(values, default=100)
+        if hi == lo:
+            lo, hi = lo - 1, hi + 1
+        return lo, hi
+
+    def _plot_key(self, series, font, fontmode):
+        # Posizione esclusa: il grafico spostato riusa la stessa immagine
+        attrs = tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(vars(self).items())
+                      if not k.startswith('_') and k not in ('x', 'y', 'data', 'series'))
+        digests = tuple(hashlib.blake2b(struct.pack(f'<{len(s)}d', *s), digest_size=16).digest()
+                        for s in series)
+        return (type(self).__name__, attrs, digests, font, fontmode)
+
+    def _area(self, draw, series, font, bottom=0):
+        """Calcola l'area di disegno (lasciando bottom pixel liberi in basso) e disegna bordo e asse"""
+        lo, hi = self._value_range(series)
+        margin = 2 if self.border else 1
+        if self.border:
+            draw.rectangle((0, 0, self.width, self.height), outline=0)
+        if not self.show_axis:
+            return _PlotArea(margin, margin, self.width - margin, self.height - margin - bottom, lo, hi)
+
+        ticks = nice_ticks(lo, hi, self.tick_count)
+        labels = [_format_tick(t) for t in ticks]
+        label_width = math.ceil(max(text_width(label, font, draw.fontmode) for label in labels))
+        half_line = _line_height(font) // 2
+        area = _PlotArea(margin + label_width + 5, margin + half_line,
+                         self.width - margin, self.height - margin - max(half_line, bottom), lo, hi)
+        draw.line((area.x0 - 1, area.y0, area.x0 - 1, area.y1), fill=0)
+        for label, y in zip(labels, area.ys(ticks)):
+            draw.line((area.x0 - 4, y, area.x0 - 1, y), fill=0)
+            _draw_text(draw, (area.x0 - 6, y), label, font, 0, 'rm')
+        return area
+
+    def _render(self, draw, image, area, series, font):
+        """Disegna i dati nell'area; da implementare nelle sottoclassi"""
+        raise NotImplementedError
+
+    def plot(self, font, fontmode='1'):
+        """Immagine '1' del grafico (condivisa tramite cache, da non modificare)"""
+        series = [self._visible(s) for s in self._series()]
+        key = self._plot_key(series, font, fontmode)
+        with _plot_cache_lock:
+            img = _plot_cache.get(key)
+            if img is not None:
+                _plot_cache.move_to_end(key)
+                return img
+
+        img = Image.new('1', (self.width + 1, self.height + 1), 255)
+        draw = ImageDraw.Draw(img)
+        draw.fontmode = fontmode
+        area = self._area(draw, series, font)
+        if area.columns > 0 and area.y1 > area.y0:
+            self._render(draw, img, area, series, font)
+
+        with _plot_cache_lock:
+            _plot_cache[key] = img
+            if len(_plot_cache) > _plot_cache_size:
+                _plot_cache.popitem(last=False)
+        return img
+
+    def draw(self, draw, image, fonts):
+        self.draw_clipped(draw, image, fonts, None)
+
+    def draw_clipped(self, draw, image, fonts, clip):
+        img = self.plot(_resolve_font(fonts, None, self.font_size), draw.fontmode)
+        if clip is None:
+            image.paste(img, (self.x, self.y))
+        else:
+            _paste_clipped(image, img, self.x, self.y, clip)
+
+
+class LineChart(_Chart):
+    """
+    Grafico a linee con più serie
+
+    Example:
+        canvas.add_widget(LineChart(10, 10, 300, 120, [interna, esterna],
+                                    show_axis=True, styles=['solid', 'dashed']))
+    """
+
+    def __init__(self, x, y, width, height, series, styles=None, min_val=None, max_val=None,
+                 window=None, show_axis=True, tick_count=4, font_size='small', border=False):
+        """
+        Args:
+            x, y: posizione top-left
+            width, height: dimensioni
+            series: lista di serie (liste di valori numerici)
+            styles: stile di ogni serie: 'solid', 'dashed', 'dotted' o 'thin'
+                    (default: nell'ordine, ripetuti se le serie sono di più)
+            min_val, max_val, window, show_axis, tick_count, font_size, border: vedi _Chart
+        """
+        super().__init__(x, y, width, height, min_val, max_val, window, show_axis, tick_count,
+                         font_size, border)
+        self.series = [list(s) for s in series]
+        self.styles = list(styles or _LINE_STYLES)
+
+    def _normalize(self, name, value):
+        return [list(s) for s in value] if name == 'series' else value
+
+    def _series(self):
+        return self.series
+
+    def _points(self, area, values):
+        return area.polyline(values)
+
+    def _render(self, draw, image, area, series, font):
+        for i, values in enumerate(series):
+            if not values:
+                continue
+            width, dash = _LINE_STYLES[self.styles[i % len(self.styles)]]
+            points = self._points(area, values)
+            if len(points) == 1:
+                points = points * 2
+            if dash is None:
+                draw.line(points, fill=0, width=width)
+                continue
+            # Tratteggio: la linea su un livello a parte, tenuta solo nelle colonne "piene"
+            layer = Image.new('1', image.size, 255)
+            ImageDraw.Draw(layer).line(points, fill=0, width=width)
+            dashed = ImageChops.logical_or(layer, _stripes(image.width, image.height, *dash))
+            image.paste(ImageChops.logical_and(image, dashed))
+
+
+class StepChart(LineChart):
+    """Grafico a gradini: ogni valore resta costante fino al campione successivo"""
+
+    def _points(self, area, values):
+        points = area.polyline(values)
+        steps = points[:1]
+        for (_, y), (x, next_y) in zip(points, points[1:]):
+            steps += [(x, y), (x, next_y)]
+        return steps
+
+
+class Sparkline(_Chart):
+    """Linea compatta senza assi, con un punto sull'ultimo valore"""
+
+    def __init__(self, x, y, width, height, data, min_val=None, max_val=None, window=None,
+                 show_last=True, border=False):
+        """
+        Args:
+            x, y: posizione top-left
+            width, height: dimensioni
+            data: lista di valori numerici
+            min_val, max_val: range valori (None per auto)
+            window: mostra solo gli ultimi window campioni (None = tutti)
+            show_last: evidenzia l'ultimo valore con un punto
+            border: disegna un bordo attorno alla linea
+        """
+        super().__init__(x, y, width, height, min_val, max_val, window, border=border)
+        self.data = list(data)
+        self.show_last = show_last
+
+    def _normalize(self, name, value):
+        return list(value) if name == 'data' else value
+
+    def _series(self):
+        return [self.data]
+
+    def _area(self, draw, series, font, bottom=0):
+        area = super()._area(draw, series, font, bottom)
+        if self.show_last:
+            # Spazio per il punto finale
+            area = _PlotArea(area.x0, area.y0 + 1, area.x1 - 1, area.y1 - 1, area.lo, area.hi)
+        return area
+
+    def _render(self, draw, image, area, series, font):
+        values = series[0]
+        if not values:
+            return
+        points = area.polyline(values)
+        draw.line(points if len(points) > 1 else points * 2, fill=0, width=1)
+        if self.show_last:
+            x, y = area.x1, area.ys(values[-1:])[0]
+            draw.rectangle((x - 1, y - 1, x + 1, y + 1), fill=0)
+
+
+class BarChart(_Chart):
+    """
+    Grafico a barre (anche con valori negativi)
+
+    Se i valori sono più delle barre che stanno nella larghezza, vengono
+    raggruppati mostrando per ogni barra il valore più lontano dallo zero.
+    """
+
+    def __init__(self, x, y, width, height, data, labels=None, min_val=None, max_val=None, window=None,
+                 bar_spacing=2, fill=0, show_axis=True, tick_count=4, font_size='small', border=False):
+        """
+        Args:
+            x, y: posizione top-left
+            width, height: dimensioni
+            data: lista di valori numerici
+            labels: etichette sotto le barre (opzionale, mostrate se i valori non sono raggruppati)
+            min_val, max_val: range valori (None per auto, lo zero è sempre compreso)
+            window: mostra solo gli ultimi window valori (None = tutti)
+            bar_spacing: spazio tra le barre in pixel
+            fill: riempimento delle barre (0 = pieno, 255 = solo bordo)
+            show_axis, tick_count, font_size, border: vedi _Chart
+        """
+        super().__init__(x, y, width, height, min_val, max_val, window, show_axis, tick_count,
+                         font_size, border)
+        self.data = list(data)
+        self.labels = list(labels) if labels else None
+        self.bar_spacing = bar_spacing
+        self.fill = fill
+
+    def _normalize(self, name, value):
+        return list(value) if name in ('data', 'labels') and value is not None else value
+
+    def _series(self):
+        return [self.data]
+
+    def _value_range(self, series):
+        lo, hi = super()._value_range(series)
+        if self.min_val is None:
+            lo = min(lo, 0)
+        if self.max_val is None:
+            hi = max(hi, 0)
+        return lo, hi
+
+    def _area(self, draw, series, font, bottom=0):
+        if self.labels and len(series[0]) <= self.width // (self.bar_spacing + 2):
+            # Riga sotto le barre per le etichette
+            bottom = max(bottom, _line_height(font) + 2)
+        return super()._area(draw, series, font, bottom)
+
+    def _render(self, draw, image, area, series, font):
+        values = series[0]
+        max_bars = max(1, area.columns // (self.bar_spacing + 2))
+        grouped = len(values) > max_bars
+        if grouped:
+            values = [low if abs(low) > abs(high) else high for _, low, high, _ in decimate(values, max_bars)]
+        if not values:
+            return
+
+        baseline = area.ys([min(area.hi, max(area.lo, 0))])[0]
+        labels = self.labels[-len(values):] if self.labels and not grouped else []
+        slot = area.columns / len(values)
+        for i, y in enumerate(area.ys(values)):
+            x0 = area.x0 + int(i * slot) + self.bar_spacing // 2
+            x1 = max(x0, area.x0 + int((i + 1) * slot) - 1 - (self.bar_spacing - self.bar_spacing // 2))
+            draw.rectangle((x0, min(y, baseline), x1, max(y, baseline)), fill=self.fill, outline=0)
+            if i < len(labels):
+                _draw_text(draw, ((x0 + x1) // 2, area.y1 + 2), str(labels[i]), font, 0, 'mt')
+        draw.line((area.x0, baseline, area.x1, baseline), fill=0)
+
+
+def _place(item, x, y):
+    """Posiziona un elemento di layout: i Widget con move_to, gli altri oggetti assegnando x e y"""
+    if isinstance(item, Widget):
+        item.move_to(x, y)
+    else:
+        item.x, item.y = x, y
+
+
+class HorizontalLayout:
+    """Layout helper per disporre widget orizzontalmente"""
+
+    def __init__(self, x, y, spacing=10):
+        self.x = x
+        self.y = y
+        self.spacing = spacing
+        self.current_x = x
+        self.items = []
+
+    def add(self, widget, width=None):
+        """Aggiunge un widget al layout"""
+        self.items.append((widget, width))
+        _place(widget, self.current_x, self.y)
+        if width:
+            self.current_x += width + self.spacing
+        elif hasattr(widget, 'width'):
+            self.current_x += widget.width + self.spacing
+        return widget
+
+    def move_to(self, x, y):
+        """Sposta il layout: i widget già su un canvas vengono invalidati e ridisegnati al prossimo update()"""
+        self.x, self.y = x, y
+        self.relayout()
+
+    def relayout(self):
+        """Ricalcola le posizioni (es. dopo aver cambiato spacing o le dimensioni di un widget)"""
+        items, self.items = self.items, []
+        self.current_x = self.x
+        for widget, width in items:
+            self.add(widget, width)
+
+
+class VerticalLayout:
+    """Layout helper per disporre widget verticalmente"""
+
+    def __init__(self, x, y, spacing=10):
+        self.x = x
+        self.y = y
+        self.spacing = spacing
+        self.current_y = y
+        self.items = []
+
+    def add(self, widget, height=None):
+        """Aggiunge un widget al layout"""
+        self.items.append((widget, height))
+        _place(widget, self.x, self.current_y)
+        if height:
+            self.current_y += height + self.spacing
+        elif hasattr(widget, 'height'):
+            self.current_y += widget.height + self.spacing
+        return widget
+
+    def move_to(self, x, y):
+        """Sposta il layout: i widget già su un canvas vengono invalidati e ridisegnati al prossimo update()"""
+        self.x, self.y = x, y
+        self.relayout()
+
+    def relayout(self):
+        """Ricalcola le posizioni (es. dopo aver cambiato spacing o le dimensioni di un widget)"""
+        items, self.items = self.items, []
+        self.current_y = self.y
+        for widget, height in items:
+            self.add(widget, height)
+
+
+class SimulatedDisplay:
+    """
+    Display simulato con la stessa interfaccia dei driver Waveshare (epd)
+
+    Utile per test e sviluppo senza hardware: registra i frame ricevuti e può
+    simulare il tempo di trasferimento/refresh del pannello.
+    """
+
+    def __init__(self, width, height, refresh_time=0.0, partial_refresh_time=0.0, keep_frames=10):
+        """
+        Args:
+            width, height: dimensioni native del pannello (come epd.width, epd.height)
+            refresh_time: durata simulata di un refresh completo in secondi
+            partial_refresh_time: durata simulata di un refresh parziale in secondi
+            keep_frames: numero di frame recenti da conservare in self.frames
+        """
+        self.width = width
+        self.height = height
+        self.refresh_time = refresh_time
+        self.partial_refresh_time = partial_refresh_time
+        self.keep_frames = keep_frames
+        self.frames = []
+        self.planes = ()
+        self.full_refreshes = 0
+        self.partial_refreshes = 0
+        self.is_sleeping = False
+
+    def init(self):
+        self.is_sleeping = False
+        return 0
+
+    def getbuffer(self, image):
+        """Converte un'immagine PIL nel buffer del pannello (come i driver Waveshare)"""
+        if image.size == (self.height, self.width):
+            image = image.rotate(90, expand=True)
+        return bytearray(image.convert('1').tobytes('raw'))
+
+    def _push(self, kind, buf, duration, *planes):
+        if duration:
+            time.sleep(duration)
+        self.frames.append((kind, bytes(buf)))
+        if len(self.frames) > self.keep_frames:
+            del self.frames[0]
+        # Tutti i piani dell'ultimo frame (nero, rosso/giallo)
+        self.planes = (self.frames[-1][1],) + tuple(bytes(p) for p in planes)
+
+    def display(self, buf, *planes):
+        """Refresh completo; i pannelli a colori ricevono un buffer per piano"""
+        self.full_refreshes += 1
+        self._push('full', buf, self.refresh_time, *planes)
+
+    def display_4Gray(self, buf):
+        self.full_refreshes += 1
+        self._push('gray', buf, self.refresh_time)
+
+    def displayPartBaseImage(self, buf):
+        self.full_refreshes += 1
+        self._push('base', buf, self.refresh_time)
+
+    def displayPartial(self, buf):
+        self.partial_refreshes += 1
+        self._push('partial', buf, self.partial_refresh_time)
+
+    def Clear(self, color=0xFF):
+        self.full_refreshes += 1
+        self._push('full', bytes([color]) * (((self.width + 7) // 8) * self.height), self.refresh_time)
+
+    def sleep(self):
+        self.is_sleeping = True
+
+    def get_image(self):
+        """Restituisce l'ultimo frame ricevuto come immagine PIL (orientamento nativo)"""
+        if not self.frames:
+            return Image.new('1', (self.width, self.height), 255)
+        kind, data = self.frames[-1]
+        if kind == 'gray':
+            levels = Image.frombytes('P', (self.width, self.height), data, 'raw', 'P;2')
+            return levels.point([GRAY4, GRAY3, GRAY2, GRAY1] + [0] * 252).convert('L')
+        return Image.frombytes('1', (self.width, self.height), data)
+
+
+class PanelMetrics:
+    """Metriche di latenza di un pannello (tempi in millisecondi)"""
+
+    def __init__(self):
+        self.frames = 0
+        self.last_render_ms = 0.0
+        self.last_wait_ms = 0.0
+        self.last_refresh_ms = 0.0
+        self.total_render_ms = 0.0
+        self.total_wait_ms = 0.0
+        self.total_refresh_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def record(self, render_ms, wait_ms, refresh_ms):
+        self.frames += 1
+        self.last_render_ms = render_ms
+        self.last_wait_ms = wait_ms
+        self.last_refresh_ms = refresh_ms
+        self.total_render_ms += render_ms
+        self.total_wait_ms += wait_ms
+        self.total_refresh_ms += refresh_ms
+        self.max_latency_ms = max(self.max_latency_ms, render_ms + wait_ms + refresh_ms)
+
+    @property
+    def last_latency_ms(self):
+        return self.last_render_ms + self.last_wait_ms + self.last_refresh_ms
+
+    def as_dict(self):
+        """Riepilogo delle metriche (ultimi valori e medie)"""
+        n = self.frames or 1
+        return {
+            'frames': self.frames,
+            'last_render_ms': self.last_render_ms,
+            'last_wait_ms': self.last_wait_ms,
+            'last_refresh_ms': self.last_refresh_ms,
+            'last_latency_ms': self.last_latency_ms,
+            'avg_render_ms': self.total_render_ms / n,
+            'avg_wait_ms': self.total_wait_ms / n,
+            'avg_refresh_ms': self.total_refresh_ms / n,
+            'max_latency_ms': self.max_latency_ms,
+        }
+
+
+class Panel:
+    """Pannello gestito da DisplayManager: display, canvas e funzione di disegno"""
+
+    def __init__(self, name, epd, canvas, render, rotation=0):
+        self.name = name
+        self.epd = epd
+        self.canvas = canvas
+        self.render = render
+        self.rotation = rotation
+        self.metrics = PanelMetrics()
+
+
+class DisplayManager:
+    """
+    Gestisce più display e-ink da un unico processo
+
+    I pannelli vengono disegnati in parallelo su un pool di thread, mentre
+    l'invio dei frame ai display è serializzato (un pannello alla volta sul
+    bus SPI) nell'ordine in cui i frame sono pronti. Font e SVG rasterizzati
+    sono condivisi tra tutti i canvas tramite le cache di modulo.
+
+    Example:
+        manager = DisplayManager()
+        manager.add_panel('cucina', epd_cucina, disegna_cucina, rotation=270)
+        manager.add_panel('ingresso', epd_ingresso, disegna_ingresso)
+        manager.refresh()
+    """
+
+    def __init__(self, picdir=None, max_workers=None):
+        """
+        Args:
+            picdir: directory con font e risorse (default per tutti i pannelli)
+            max_workers: numero di thread di rendering (None = uno per pannello)
+        """
+        self.picdir = picdir
+        self.max_workers = max_workers
+        self.panels = OrderedDict()
+        self._bus_lock = threading.Lock()
+
+    def add_panel(self, name, epd, render, rotation=0, picdir=None, cost_model=None):
+        """
+        Aggiunge un pannello
+
+        Args:
+            name: nome univoco del pannello
+            epd: display Waveshare (o SimulatedDisplay) già inizializzato
+            render: funzione render(canvas) che aggiunge i widget al canvas
+            rotation: rotazione antioraria applicata al canvas verso il pannello
+            picdir: directory con font e risorse (default quella del manager)
+            cost_model: RefreshCostModel per contabilizzare i refresh del pannello
+                (panel.epd diventa un RefreshAccounting con screen = name)
+
+        Returns:
+            il Panel creato
+        """
+        if rotation in (90, 270):
+            width, height = epd.height, epd.width
+        else:
+            width, height = epd.width, epd.height
+        canvas = EinkCanvas(width, height, picdir or self.picdir)
+        if cost_model is not None:
+            epd = RefreshAccounting(epd, cost_model, screen=name)
+        panel = Panel(name, epd, canvas, render, rotation)
+        self.panels[name] = panel
+        return panel
+
+    def _update_panel(self, panel, partial):
+        start = time.perf_counter()
+        panel.canvas.clear()
+        panel.render(panel.canvas)
+        buf = panel.canvas.get_buffer(panel.rotation)
+        rendered = time.perf_counter()
+
+        # Un solo pannello alla volta sul bus
+        with self._bus_lock:
+            acquired = time.perf_counter()
+            if partial:
+                panel.epd.displayPartial(buf)
+            else:
+                panel.epd.display(buf)
+            done = time.perf_counter()
+
+        panel.metrics.record(
+            (rendered - start) * 1000,
+            (acquired - rendered) * 1000,
+            (done - acquired) * 1000
+        )
+        return panel.metrics
+
+    def refresh(self, names=None, partial=False):
+        """
+        Ridisegna e aggiorna i pannelli
+
+        Args:
+            names: lista di nomi dei pannelli (None = tutti)
+            partial: usa il refresh parziale (displayPartial)
+
+        Returns:
+            dizionario {nome: metriche del pannello}
+        """
+        panels = [self.panels[n] for n in names] if names else list(self.panels.values())
+        if not panels:
+            return {}
+
+        workers = self.max_workers or len(panels)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._update_panel, p, partial) for p in panels]
+            for future in futures:
+                future.result()
+
+        return {p.name: p.metrics.as_dict() for p in panels}
+
+    def get_metrics(self):
+        """Restituisce le metriche di tutti i pannelli"""
+        return {name: p.metrics.as_dict() for name, p in self.panels.items()}
+
+
+class RefreshCostModel:
+    """
+    Modello di costo dei refresh di un pannello
+
+    Ogni refresh costa un'energia fissa (diversa tra completo e parziale) più
+    una quota per pixel cambiato e una per pixel dell'area aggiornata.
+    L'usura si conta in cicli equivalenti a un refresh completo: un parziale
+    vale partial_wear cicli. I valori di default sono solo un ordine di
+    grandezza per un pannello piccolo: vanno tarati con misure sul proprio
+    hardware (es. un misuratore USB durante un ciclo di refresh).
+    """
+
+    def __init__(self, full_energy_mj=40.0, partial_energy_mj=8.0, pixel_energy_uj=0.0,
+                 area_energy_uj=0.0, full_refresh_time=2.0, partial_refresh_time=0.3,
+                 rated_cycles=1000000, partial_wear=0.1):
+        """
+        Args:
+            full_energy_mj: energia di un refresh completo in millijoule
+            partial_energy_mj: energia fissa di un refresh parziale in millijoule
+            pixel_energy_uj: energia per pixel cambiato in microjoule
+            area_energy_uj: energia per pixel dell'area aggiornata in microjoule
+            full_refresh_time, partial_refresh_time: durata dei refresh in secondi
+            rated_cycles: refresh completi garantiti dal produttore
+            partial_wear: usura di un parziale rispetto a un refresh completo
+        """
+        self.full_energy_mj = full_energy_mj
+        self.partial_energy_mj = partial_energy_mj
+        self.pixel_energy_uj = pixel_energy_uj
+        self.area_energy_uj = area_energy_uj
+        self.full_refresh_time = full_refresh_time
+        self.partial_refresh_time = partial_refresh_time
+        self.rated_cycles = rated_cycles
+        self.partial_wear = partial_wear
+
+    def cost(self, partial, changed_pixels, area):
+        """
+        Costo stimato di un refresh
+
+        Returns:
+            (energia in millijoule, durata in secondi, cicli di usura)
+        """
+        energy = self.partial_energy_mj if partial else self.full_energy_mj
+        energy += (changed_pixels * self.pixel_energy_uj + area * self.area_energy_uj) / 1000
+        if partial:
+            return energy, self.partial_refresh_time, self.partial_wear
+        return energy, self.full_refresh_time, 1.0
+
+
+class RefreshStats:
+    """Totali dei refresh di un display o di una schermata"""
+
+    def __init__(self):
+        self.full_refreshes = 0
+        self.partial_refreshes = 0
+        self.changed_pixels = 0
+        self.refreshed_area = 0
+        self.energy_mj = 0.0
+        self.busy_s = 0.0
+        self.wear_cycles = 0.0
+
+    def record(self, partial, changed_pixels, area, energy_mj, seconds, wear):
+        if partial:
+            self.partial_refreshes += 1
+        else:
+            self.full_refreshes += 1
+        self.changed_pixels += changed_pixels
+        self.refreshed_area += area
+        self.energy_mj += energy_mj
+        self.busy_s += seconds
+        self.wear_cycles += wear
+
+    @property
+    def refreshes(self):
+        return self.full_refreshes + self.partial_refreshes
+
+    def as_dict(self):
+        """Riepilogo dei totali (più le medie per refresh)"""
+        n = self.refreshes or 1
+        return {
+            'full_refreshes': self.full_refreshes,
+            'partial_refreshes': self.partial_refreshes,
+            'changed_pixels': self.changed_pixels,
+            'refreshed_area': self.refreshed_area,
+            'energy_mj': self.energy_mj,
+            'busy_s': self.busy_s,
+            'wear_cycles': self.wear_cycles,
+            'avg_changed_pixels': self.changed_pixels / n,
+            'avg_energy_mj': self.energy_mj / n,
+        }
+
+
+class RefreshAccounting:
+    """
+    Contabilità dei refresh attorno a un display (Waveshare o SimulatedDisplay)
+
+    Espone la stessa interfaccia del display e inoltra ogni chiamata; per ogni
+    refresh confronta i buffer con il frame precedente (in C, con ImageChops)
+    per contare i pixel cambiati e l'area che li contiene, e ne stima il costo
+    con il RefreshCostModel. I totali sono tenuti sia complessivi sia per
+    schermata: basta impostare screen prima di disegnare.
+
+    Example:
+        epd = RefreshAccounting(epd, RefreshCostModel(full_energy_mj=55))
+        epd.screen = 'meteo'
+        epd.display(canvas.get_buffer(270))
+        print(epd.as_dict())
+    """
+
+    def __init__(self, epd, cost_model=None, screen='default'):
+        """
+        Args:
+            epd: display da contabilizzare
+            cost_model: RefreshCostModel (None = valori di default)
+            screen: schermata a cui attribuire i refresh
+        """
+        self.epd = epd
+        self.cost_model = cost_model or RefreshCostModel()
+        self.screen = screen
+        self.totals = RefreshStats()
+        self.screens = OrderedDict()
+        self.last = None
+        self._previous = []
+
+    def __getattr__(self, name):
+        # width, height, init, sleep, getbuffer... vanno direttamente al display
+        if name == 'epd':
+            raise AttributeError(name)
+        return getattr(self.epd, name)
+
+    def _plane_image(self, buf, gray):
+        """Immagine di un piano nell'orientamento nativo, senza i bit di riempimento"""
+        if gray:
+            return Image.frombytes('L', (self.epd.width, self.epd.height), bytes(buf), 'raw', 'L;2')
+        row_bits = (self.epd.width + 7) // 8 * 8
+        image = Image.frombytes('1', (row_bits, self.epd.height), bytes(buf))
+        if row_bits != self.epd.width:
+            image = image.crop((0, 0, self.epd.width, self.epd.height))
+        return image
+
+    def _record(self, partial, buffers, gray=False):
+        images = [self._plane_image(buf, gray) for buf in buffers]
+        mask = None
+        for i, image in enumerate(images):
+            if i < len(self._previous) and self._previous[i].mode == image.mode:
+                previous = self._previous[i]
+            else:
+                # Dopo l'avvio il pannello è bianco (0xFF in tutti i formati)
+                previous = Image.new(image.mode, image.size, 255)
+            if gray:
+                diff = ImageChops.difference(image, previous).point(lambda v: 255 if v else 0, '1')
+            else:
+                diff = ImageChops.logical_xor(image, previous)
+            mask = diff if mask is None else ImageChops.logical_or(mask, diff)
+        self._previous = images
+
+        changed = mask.histogram()[255]
+        if partial:
+            bbox = mask.getbbox()
+            area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) if bbox else 0
+        else:
+            area = self.epd.width * self.epd.height
+        energy, seconds, wear = self.cost_model.cost(partial, changed, area)
+
+        stats = self.screens.get(self.screen)
+        if stats is None:
+            stats = self.screens[self.screen] = RefreshStats()
+        for target in (self.totals, stats):
+            target.record(partial, changed, area, energy, seconds, wear)
+        self.last = {'screen': self.screen, 'partial': partial, 'changed_pixels': changed,
+                     'area': area, 'energy_mj': energy, 'busy_s': seconds, 'wear_cycles': wear}
+
+    def display(self, buf, *planes):
+        self._record(False, (buf,) + planes)
+        return self.epd.display(buf, *planes)
+
+    def display_4Gray(self, buf):
+        self._record(False, (buf,), gray=True)
+        return self.epd.display_4Gray(buf)
+
+    def displayPartBaseImage(self, buf):
+        self._record(False, (buf,))
+        return self.epd.displayPartBaseImage(buf)
+
+    def displayPartial(self, buf):
+        self._record(True, (buf,))
+        return self.epd.displayPartial(buf)
+
+    def Clear(self, color=0xFF):
+        size = (self.epd.width + 7) // 8 * self.epd.height
+        self._record(False, (bytes([color & 0xFF]) * size,))
+        return self.epd.Clear(color)
+
+    @property
+    def wear_fraction(self):
+        """Frazione della vita nominale del pannello già consumata"""
+        return self.totals.wear_cycles / self.cost_model.rated_cycles
+
+    def reset(self):
+        """Azzera i totali (il frame precedente resta come riferimento)"""
+        self.totals = RefreshStats()
+        self.screens.clear()
+        self.last = None
+
+    def as_dict(self):
+        """Totali, suddivisione per schermata e usura"""
+        return {
+            'totals': self.totals.as_dict(),
+            'screens': {name: stats.as_dict() for name, stats in self.screens.items()},
+            'wear_fraction': self.wear_fraction,
+        }
+
+
+def ease_linear(t):
+    return t
+
+
+def ease_in_out(t):
+    """Accelera all'inizio e rallenta alla fine"""
+    return t * t * (3 - 2 * t)
+
 
-        # Testo percentuale (opzionale)
-        if self.show_percentage:
-            text = f"{int(self.progress)}%"
-            font = fonts.get(self.font_size, fonts['small'])
-            text_x = self.x + self.width / 2
-            text_y = self.y + self.height / 2
+def ease_out(t):
+    """Rallenta verso la fine"""
+    return 1 - (1 - t) * (1 - t)
 
-            # Disegna testo bianco su sfondo nero per leggibilità
-            bbox = draw.textbbox((text_x, text_y), text, font=font, anchor="mm")
-            draw.rectangle(bbox, fill=255)
-            draw.text((text_x, text_y), text, font=font, fill=0, anchor="mm")
 
+def _interpolate(start, end, k):
+    """Valore tra start e end (numeri o tuple); tra due interi resta intero"""
+    if isinstance(start, (tuple, list)):
+        return type(start)(_interpolate(a, b, k) for a, b in zip(start, end))
+    value = start + (end - start) * k
+    if isinstance(start, int) and isinstance(end, int):
+        return round(value)
+    return value
 
-class SVGIcon(Widget):
-    """Widget per icone SVG"""
 
-    def __init__(self, x, y, svg_string, size=None):
+class Tween:
+    """Variazione nel tempo di una proprietà di un widget (o del valore di una DataSource)"""
+
+    def __init__(self, target, name, end, duration, start=None, delay=0.0, easing=ease_in_out):
         """
         Args:
-            x, y: posizione
-            svg_string: contenuto SVG come stringa
-            size: tupla (width, height) per ridimensionare
+            target: widget o DataSource da animare
+            name: proprietà ('progress', 'level', ...), 'position' per (x, y);
+                ignorato per una DataSource
+            end: valore finale
+            duration: durata in secondi
+            start: valore iniziale (None = valore attuale)
+            delay: attesa in secondi dall'inizio dell'animazione
+            easing: funzione da [0, 1] a [0, 1]
         """
-        super().__init__(x, y)
-        self.svg_string = svg_string
-        self.size = size
+        self.target = target
+        self.name = name
+        self.end = end
+        self.duration = duration
+        self.delay = delay
+        self.easing = easing
+        self.start = self._current() if start is None else start
 
-    def draw(self, draw, image, fonts):
-        # Converte SVG in immagine
-        png_data = cairosvg.svg2png(bytestring=self.svg_string.encode('utf-8'))
-        img = Image.open(io.BytesIO(png_data))
+    def _current(self):
+        if isinstance(self.target, DataSource):
+            return self.target.value
+        if self.name == 'position':
+            return (self.target.x, self.target.y)
+        return getattr(self.target, self.name)
 
-        # Gestisce trasparenza
-        if img.mode == 'RGBA':
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])
-            img = background
+    @property
+    def end_time(self):
+        return self.delay + self.duration
 
-        # Ridimensiona se necessario
-        if self.size:
-            img = img.resize(self.size, Image.Resampling.LANCZOS)
+    def value_at(self, t):
+        """Valore al tempo t (secondi dall'inizio dell'animazione)"""
+        if t <= self.delay:
+            k = 0.0
+        elif t >= self.end_time or self.duration <= 0:
+            k = 1.0
+        else:
+            k = self.easing((t - self.delay) / self.duration)
+        return _interpolate(self.start, self.end, k)
 
-        # Converti in B/N e incolla
-        img = img.convert('1')
-        image.paste(img, (self.x, self.y))
+    def apply(self, t):
+        """Imposta il valore al tempo t; True se è cambiato"""
+        value = self.value_at(t)
+        if isinstance(self.target, DataSource):
+            return self.target.set(value)
+        if self.name == 'position':
+            return self.target.move_to(*value)
+        return self.target.set(self.name, value)
 
 
-class SVG(Widget):
-    """Widget per SVG - supporta sia stringhe che file"""
+class AnimationStats:
+    """Metriche di un'animazione: frame mostrati e saltati, tempi in millisecondi"""
 
-    def __init__(self, x, y, svg_source, size=None, is_file=False):
+    def __init__(self, target_fps):
+        self.target_fps = target_fps
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+        self.refreshes = 0
+        self.total_render_ms = 0.0
+        self.total_refresh_ms = 0.0
+        self.max_frame_ms = 0.0
+        self.duration_s = 0.0
+
+    def record(self, render_ms, refresh_ms, refreshed):
+        self.frames += 1
+        self.refreshes += refreshed
+        self.total_render_ms += render_ms
+        self.total_refresh_ms += refresh_ms
+        self.max_frame_ms = max(self.max_frame_ms, render_ms + refresh_ms)
+
+    @property
+    def achieved_fps(self):
+        # Intervalli tra i frame mostrati: il frame a t=0 apre il primo intervallo
+        if self.frames < 2 or not self.duration_s:
+            return 0.0
+        return (self.frames - 1) / self.duration_s
+
+    def as_dict(self):
+        """Riepilogo delle metriche (totali e medie per frame)"""
+        n = self.frames or 1
+        return {
+            'target_fps': self.target_fps,
+            'achieved_fps': self.achieved_fps,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'late': self.late,
+            'refreshes': self.refreshes,
+            'avg_render_ms': self.total_render_ms / n,
+            'avg_refresh_ms': self.total_refresh_ms / n,
+            'max_frame_ms': self.max_frame_ms,
+            'duration_s': self.duration_s,
+        }
+
+
+class Animation:
+    """
+    Animazione di proprietà dei widget con refresh parziali a frequenza fissa
+
+    I frame sono programmati a intervalli di 1/fps dall'inizio. A ogni frame
+    i Tween impostano i valori del momento con Widget.set, quindi update()
+    ridisegna solo i widget animati e il buffer va al display. Se rendering
+    o refresh finiscono in ritardo i frame intermedi vengono saltati (e
+    contati in dropped): l'animazione resta sincronizzata con il tempo e
+    l'ultimo frame mostra sempre i valori finali.
+
+    Con un SimulatedDisplay (refresh_time/partial_refresh_time) si può
+    provare una frequenza senza hardware; clock e sleep sono sostituibili.
+
+    Example:
+        animazione = Animation(canvas, epd, fps=2, rotation=270)
+        animazione.add(barra, 'progress', 100, duration=5)
+        animazione.add(icona, 'position', (200, 40), duration=3, delay=1)
+        stats = animazione.run()
+        print(stats.as_dict())
+    """
+
+    def __init__(self, canvas, epd=None, fps=2.0, rotation=0, partial=True,
+                 clock=time.perf_counter, sleep=time.sleep):
         """
         Args:
-            x, y: posizione
-            svg_source: stringa SVG o percorso al file SVG
-            size: tupla (width, height) per ridimensionare
-            is_file: True se svg_source è un percorso file, False se è una stringa
+            canvas: canvas con i widget (già mostrato sul display, es. con displayPartBaseImage)
+            epd: display Waveshare o SimulatedDisplay (None = solo rendering)
+            fps: frame al secondo desiderati
+            rotation: rotazione passata a get_buffer()
+            partial: usa displayPartial (False = display)
+            clock, sleep: funzioni del tempo (da sostituire nei test)
         """
-        super().__init__(x, y)
-        self.svg_source = svg_source
-        self.size = size
-        self.is_file = is_file
+        self.canvas = canvas
+        self.epd = epd
+        self.fps = fps
+        self.rotation = rotation
+        self.partial = partial
+        self.clock = clock
+        self.sleep = sleep
+        self.tweens = []
+        self.stats = AnimationStats(fps)
 
-    def draw(self, draw, image, fonts):
-        # Carica SVG da file o stringa
-        if self.is_file:
-            with open(self.svg_source, 'r') as f:
-                svg_string = f.read()
-        else:
-            svg_string = self.svg_source
+    def add(self, target, name, end, duration, start=None, delay=0.0, easing=ease_in_out):
+        """Aggiunge un Tween (stessi argomenti del costruttore di Tween) e lo restituisce"""
+        tween = Tween(target, name, end, duration, start, delay, easing)
+        self.tweens.append(tween)
+        return tween
 
-        # Converte SVG in immagine
-        png_data = cairosvg.svg2png(bytestring=svg_string.encode('utf-8'))
-        img = Image.open(io.BytesIO(png_data))
+    @property
+    def duration(self):
+        return max((tween.end_time for tween in self.tweens), default=0.0)
 
-        # Gestisce trasparenza
-        if img.mode == 'RGBA':
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])
-            img = background
+    def _present(self):
+        """Applica i valori, ridisegna le regioni cambiate e aggiorna il display"""
+        region = self.canvas.update()
+        rendered = self.clock()
+        if region is not None and self.epd is not None:
+            buf = self.canvas.get_buffer(self.rotation)
+            if self.partial:
+                self.epd.displayPartial(buf)
+            else:
+                self.epd.display(buf)
+        return region is not None, rendered
 
-        # Ridimensiona se necessario
-        if self.size:
-            img = img.resize(self.size, Image.Resampling.LANCZOS)
+    def run(self):
+        """
+        Esegue l'animazione fino all'ultimo frame
 
-        # Converti in B/N e incolla
-        img = img.convert('1')
-        image.paste(img, (self.x, self.y))
+        Returns:
+            AnimationStats (anche in self.stats)
+        """
+        interval = 1.0 / self.fps
+        duration = self.duration
+        last = math.ceil(duration * self.fps - 1e-9)
+        stats = self.stats = AnimationStats(self.fps)
+        start = self.clock()
+        shown = -1
+        while True:
+            # Frame dovuto adesso: quelli tra l'ultimo mostrato e questo sono persi
+            frame_start = self.clock()
+            frame = max(shown + 1, min(int((frame_start - start) / interval), last))
+            stats.dropped += frame - shown - 1
+            shown = frame
 
+            t = min(frame * interval, duration)
+            for tween in self.tweens:
+                tween.apply(t)
+            refreshed, rendered = self._present()
+            done = self.clock()
+            stats.record((rendered - frame_start) * 1000, (done - rendered) * 1000, refreshed)
+            if frame >= last:
+                break
 
-class DonutChart(Widget):
-    """Widget per grafici a ciambella (donut chart)"""
+            deadline = start + (frame + 1) * interval
+            if done > deadline:
+                stats.late += 1
+            else:
+                self.sleep(deadline - done)
+        stats.duration_s = self.clock() - start
+        return stats
+
+
+# Formato dei file di frame: intestazione, frame in sequenza, indice e coda
+_FRAME_FILE_MAGIC = b'EINKFRM1'
+_FRAME_FILE_HEADER = struct.Struct('<8sH6x')
+_FRAME_HEADER = struct.Struct('<HHHBBII')   # width, height, rotation, planes, bpp, plane_size, crc32
+_FRAME_FOOTER = struct.Struct('<QI4s')      # offset indice, numero frame, marcatore
+_FRAME_INDEX_MARK = b'EIDX'
 
-    def __init__(self, x, y, diameter, data, labels=None, hole_ratio=0.5, show_labels=True, font_size='small', use_patterns=True):
+
+class Frame:
+    """
+    Frame già renderizzato nel formato nativo del pannello
+
+    Contiene i buffer impacchettati (uno per piano colore, 1 o 2 bit per pixel)
+    pronti per il driver, più le informazioni su dimensioni e orientamento.
+    """
+
+    def __init__(self, width, height, planes, rotation=0, bpp=1):
         """
         Args:
-            x, y: posizione del centro del grafico
-            diameter: diametro del grafico
-            data: lista di valori numerici (verranno convertiti in percentuali)
-            labels: lista di etichette (opzionale)
-            hole_ratio: rapporto del buco centrale (0.0-1.0, default 0.5)
-            show_labels: mostra le etichette con percentuali
-            font_size: dimensione font per le etichette
-            use_patterns: usa retinature invece di riempimenti solidi
+            width, height: dimensioni del buffer (orientamento nativo del pannello)
+            planes: lista di buffer (bytes, bytearray o memoryview), uno per piano
+            rotation: rotazione applicata al canvas per ottenere il buffer
+            bpp: bit per pixel (1 = B/N o piano colore, 2 = 4 livelli di grigio)
         """
-        super().__init__(x, y)
-        self.diameter = diameter
-        self.data = data
-        self.labels = labels or [f"Seg {i+1}" for i in range(len(data))]
-        self.hole_ratio = max(0.0, min(1.0, hole_ratio))
-        self.show_labels = show_labels
-        self.font_size = font_size
-        self.use_patterns = use_patterns
-
-    def _apply_pattern(self, draw, bbox, start_angle, end_angle, pattern_type, spacing=4):
-        """Applica un pattern di retinatura a un settore"""
-        # Crea maschera per il settore
-        mask = Image.new('1', (self.diameter + 20, self.diameter + 20), 255)
-        mask_draw = ImageDraw.Draw(mask)
+        self.width = width
+        self.height = height
+        self.planes = list(planes)
+        self.rotation = rotation
+        self.bpp = bpp
 
-        # Offset per centrare la maschera
-        offset = 10
-        mask_bbox = [offset, offset, self.diameter + offset, self.diameter + offset]
+    @classmethod
+    def from_canvas(cls, canvas, rotation=0):
+        """Crea un frame dal contenuto di un canvas (EinkCanvas, ColorCanvas, GrayCanvas, TiledCanvas)"""
+        width, height = canvas.width, canvas.height
+        if rotation in (90, 270):
+            width, height = height, width
+        if isinstance(canvas, ColorCanvas):
+            return cls(width, height, canvas.get_plane_buffers(rotation), rotation)
+        bpp = 2 if isinstance(canvas, GrayCanvas) else 1
+        return cls(width, height, [canvas.get_buffer(rotation)], rotation, bpp)
 
-        # Disegna il settore sulla maschera
-        mask_draw.pieslice(mask_bbox, start_angle, end_angle, fill=0)
+    @property
+    def checksum(self):
+        crc = 0
+        for plane in self.planes:
+            crc = zlib.crc32(plane, crc)
+        return crc
 
-        # Rimuovi il buco centrale dalla maschera
-        hole_radius = int((self.diameter // 2) * self.hole_ratio)
-        if hole_radius > 0:
-            center = self.diameter // 2 + offset
-            hole_bbox = [
-                center - hole_radius,
-                center - hole_radius,
-                center + hole_radius,
-                center + hole_radius
-            ]
-            mask_draw.ellipse(hole_bbox, fill=255)
-
-        # Applica il pattern in base al tipo
-        x1, y1, x2, y2 = bbox
-
-        if pattern_type == 'horizontal':
-            # Linee orizzontali
-            for y in range(int(y1), int(y2), spacing):
-                for x in range(int(x1), int(x2)):
-                    mx = x - int(x1) + offset
-                    my = y - int(y1) + offset
-                    if 0 <= mx < mask.width and 0 <= my < mask.height:
-                        if mask.getpixel((mx, my)) == 0:
-                            draw.point((x, y), fill=0)
-
-        elif pattern_type == 'vertical':
-            # Linee verticali
-            for x in range(int(x1), int(x2), spacing):
-                for y in range(int(y1), int(y2)):
-                    mx = x - int(x1) + offset
-                    my = y - int(y1) + offset
-                    if 0 <= mx < mask.width and 0 <= my < mask.height:
-                        if mask.getpixel((mx, my)) == 0:
-                            draw.point((x, y), fill=0)
-
-        elif pattern_type == 'diagonal1':
-            # Linee diagonali /
-            for i in range(int(x1 - y2), int(x2 - y1), spacing):
-                for x in range(int(x1), int(x2)):
-                    y = x - i
-                    if y1 <= y < y2:
-                        mx = x - int(x1) + offset
-                        my = int(y) - int(y1) + offset
-                        if 0 <= mx < mask.width and 0 <= my < mask.height:
-                            if mask.getpixel((mx, my)) == 0:
-                                draw.point((x, int(y)), fill=0)
-
-        elif pattern_type == 'diagonal2':
-            # Linee diagonali \
-            for i in range(int(x1 + y1), int(x2 + y2), spacing):
-                for x in range(int(x1), int(x2)):
-                    y = i - x
-                    if y1 <= y < y2:
-                        mx = x - int(x1) + offset
-                        my = int(y) - int(y1) + offset
-                        if 0 <= mx < mask.width and 0 <= my < mask.height:
-                            if mask.getpixel((mx, my)) == 0:
-                                draw.point((x, int(y)), fill=0)
-
-        elif pattern_type == 'dots':
-            # Puntini
-            for x in range(int(x1), int(x2), spacing):
-                for y in range(int(y1), int(y2), spacing):
-                    mx = x - int(x1) + offset
-                    my = y - int(y1) + offset
-                    if 0 <= mx < mask.width and 0 <= my < mask.height:
-                        if mask.getpixel((mx, my)) == 0:
-                            draw.point((x, y), fill=0)
-
-        elif pattern_type == 'crosshatch':
-            # Grigliato (linee orizzontali + verticali)
-            for y in range(int(y1), int(y2), spacing):
-                for x in range(int(x1), int(x2)):
-                    mx = x - int(x1) + offset
-                    my = y - int(y1) + offset
-                    if 0 <= mx < mask.width and 0 <= my < mask.height:
-                        if mask.getpixel((mx, my)) == 0:
-                            draw.point((x, y), fill=0)
-            for x in range(int(x1), int(x2), spacing):
-                for y in range(int(y1), int(y2)):
-                    mx = x - int(x1) + offset
-                    my = y - int(y1) + offset
-                    if 0 <= mx < mask.width and 0 <= my < mask.height:
-                        if mask.getpixel((mx, my)) == 0:
-                            draw.point((x, y), fill=0)
+    def get_image(self, plane=0):
+        """Immagine PIL di un piano (per debug e anteprime)"""
+        if self.bpp == 2:
+            levels = Image.frombytes('P', (self.width, self.height), bytes(self.planes[plane]), 'raw', 'P;2')
+            return levels.point([GRAY4, GRAY3, GRAY2, GRAY1] + [0] * 252).convert('L')
+        return Image.frombytes('1', (self.width, self.height), bytes(self.planes[plane]))
 
-    def draw(self, draw, image, fonts):
-        if not self.data:
-            return
+    def push(self, epd, partial=False):
+        """
+        Invia il frame a un display Waveshare (o SimulatedDisplay) senza conversioni
 
-        # Calcola il totale e le percentuali
-        total = sum(self.data)
-        if total == 0:
-            return
+        Args:
+            epd: display già inizializzato nella modalità giusta
+            partial: usa il refresh parziale (solo frame B/N)
+        """
+        if self.bpp == 2:
+            epd.display_4Gray(self.planes[0])
+        elif len(self.planes) > 1:
+            epd.display(*self.planes)
+        elif partial:
+            epd.displayPartial(self.planes[0])
+        else:
+            epd.display(self.planes[0])
 
-        # Calcola il bounding box per il cerchio
-        radius = self.diameter // 2
-        bbox = [
-            self.x - radius,
-            self.y - radius,
-            self.x + radius,
-            self.y + radius
-        ]
 
-        # Disegna i settori
-        start_angle = -90  # Inizia dall'alto
+class FrameWriter:
+    """
+    Scrive una sequenza di frame in un unico file
 
-        # Pattern disponibili
-        pattern_types = ['horizontal', 'vertical', 'diagonal1', 'diagonal2', 'dots', 'crosshatch']
+    I buffer vengono scritti così come sono (nessuna conversione né copia
+    aggiuntiva); l'indice dei frame è in coda al file.
 
-        for i, value in enumerate(self.data):
-            # Calcola l'angolo del settore
-            angle = 360 * value / total
-            end_angle = start_angle + angle
+    Example:
+        with FrameWriter('schermate.frames') as writer:
+            writer.add(Frame.from_canvas(canvas, rotation=270))
+    """
 
-            if self.use_patterns:
-                # Disegna il settore con sfondo bianco e bordo
-                draw.pieslice(bbox, start_angle, end_angle, fill=255, outline=0, width=2)
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(_FRAME_FILE_HEADER.pack(_FRAME_FILE_MAGIC, 1))
+        self._offsets = []
 
-                # Applica il pattern
-                pattern_type = pattern_types[i % len(pattern_types)]
-                self._apply_pattern(draw, bbox, start_angle, end_angle, pattern_type, spacing=3)
-            else:
-                # Disegna il settore con riempimento solido
-                fill_color = 0 if i % 2 == 0 else 255
-                draw.pieslice(bbox, start_angle, end_angle, fill=fill_color, outline=0, width=2)
+    def add(self, frame):
+        """Aggiunge un frame (o un canvas, con rotazione 0) al file"""
+        if not isinstance(frame, Frame):
+            frame = Frame.from_canvas(frame)
+        plane_size = len(frame.planes[0])
+        if any(len(plane) != plane_size for plane in frame.planes):
+            raise ValueError("Tutti i piani di un frame devono avere la stessa dimensione")
+        self._offsets.append(self._file.tell())
+        self._file.write(_FRAME_HEADER.pack(frame.width, frame.height, frame.rotation, len(frame.planes),
+                                            frame.bpp, plane_size, frame.checksum))
+        for plane in frame.planes:
+            self._file.write(plane)
 
-            # Calcola posizione per l'etichetta (all'esterno del grafico)
-            if self.show_labels and angle > 3:  # Mostra solo se il settore è abbastanza grande
-                mid_angle = (start_angle + end_angle) / 2
+    def close(self):
+        """Scrive l'indice e chiude il file"""
+        if self._file.closed:
+            return
+        index_offset = self._file.tell()
+        self._file.write(struct.pack(f'<{len(self._offsets)}Q', *self._offsets))
+        self._file.write(_FRAME_FOOTER.pack(index_offset, len(self._offsets), _FRAME_INDEX_MARK))
+        self._file.close()
 
-                # Posizione esterna al cerchio
-                label_radius = radius * 1.3  # Fuori dal cerchio
-                label_x = self.x + label_radius * math.cos(math.radians(mid_angle))
-                label_y = self.y + label_radius * math.sin(math.radians(mid_angle))
+    def __enter__(self):
+        return self
 
-                # Prepara il testo
-                percentage = (value / total) * 100
-                label_text = self.labels[i] if i < len(self.labels) else f"Seg{i+1}"
-                font = fonts.get(self.font_size, fonts['small'])
+    def __exit__(self, *exc):
+        self.close()
 
-                # Determina l'ancora in base alla posizione
-                if mid_angle > -45 and mid_angle <= 45:  # Destra
-                    anchor = "lm"
-                elif mid_angle > 45 and mid_angle <= 135:  # Basso
-                    anchor = "mt"
-                elif mid_angle > 135 or mid_angle <= -135:  # Sinistra
-                    anchor = "rm"
-                else:  # Alto
-                    anchor = "mb"
 
-                # Disegna l'etichetta e la percentuale separatamente (anchor non supporta multilinea)
-                # Prima linea: label
-                draw.text((label_x, label_y - 6), label_text, font=font, fill=0, anchor=anchor)
-                # Seconda linea: percentuale
-                draw.text((label_x, label_y + 6), f"{percentage:.0f}%", font=font, fill=0, anchor=anchor)
+def save_frames(path, frames):
+    """Salva una lista di frame (o canvas) in un file"""
+    with FrameWriter(path) as writer:
+        for frame in frames:
+            writer.add(frame)
 
-            start_angle = end_angle
 
-        # Disegna il buco centrale
-        hole_radius = int(radius * self.hole_ratio)
-        if hole_radius > 0:
-            hole_bbox = [
-                self.x - hole_radius,
-                self.y - hole_radius,
-                self.x + hole_radius,
-                self.y + hole_radius
-            ]
-            draw.ellipse(hole_bbox, fill=255, outline=0, width=2)
+class FrameArchive:
+    """
+    File di frame mappato in memoria
 
+    I frame restituiti fanno riferimento direttamente alla memoria mappata
+    (memoryview), quindi si possono inviare al display senza copie; close()
+    rilascia i loro piani, che da lì in poi non sono più leggibili. Per
+    tenere un frame dopo la chiusura si usa copy(i).
 
-class Line(Widget):
-    """Widget per linee"""
+    Example:
+        with FrameArchive('schermate.frames') as archive:
+            archive[2].push(epd)
+    """
 
-    def __init__(self, x1, y1, x2, y2, fill=0, width=1):
+    def __init__(self, path, verify=False):
         """
         Args:
-            x1, y1: punto iniziale
-            x2, y2: punto finale
-            fill: colore
-            width: spessore
+            path: file di frame scritto con FrameWriter/save_frames
+            verify: controlla il checksum di ogni frame alla lettura
         """
-        super().__init__(x1, y1)
-        self.x2 = x2
-        self.y2 = y2
-        self.fill = fill
-        self.width = width
+        self.path = path
+        self.verify = verify
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        # Piani restituiti, da rilasciare prima di chiudere la mappatura
+        self._exported = []
+        magic, version = _FRAME_FILE_HEADER.unpack_from(self._mmap)
+        index_offset, count, mark = _FRAME_FOOTER.unpack_from(self._mmap, len(self._mmap) - _FRAME_FOOTER.size)
+        if magic != _FRAME_FILE_MAGIC or mark != _FRAME_INDEX_MARK:
+            raise ValueError(f"{path} non è un file di frame valido")
+        self._offsets = struct.unpack_from(f'<{count}Q', self._mmap, index_offset)
 
-    def draw(self, draw, image, fonts):
-        draw.line((self.x, self.y, self.x2, self.y2), fill=self.fill, width=self.width)
+    def __len__(self):
+        return len(self._offsets)
 
+    def __getitem__(self, i):
+        offset = self._offsets[i]
+        width, height, rotation, planes, bpp, plane_size, crc = _FRAME_HEADER.unpack_from(self._mmap, offset)
+        start = offset + _FRAME_HEADER.size
+        views = [self._view[start + n * plane_size:start + (n + 1) * plane_size] for n in range(planes)]
+        self._exported.extend(views)
+        frame = Frame(width, height, views, rotation, bpp)
+        if self.verify and frame.checksum != crc:
+            raise ValueError(f"Checksum errato per il frame {i} di {self.path}")
+        return frame
 
-class SimpleGraph(Widget):
-    """Grafico a linee semplice"""
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
-    def __init__(self, x, y, width, height, data, min_val=None, max_val=None):
+    def copy(self, i):
+        """Frame i con i piani copiati in bytes, valido anche dopo close()"""
+        frame = self[i]
+        planes = []
+        for view in frame.planes:
+            planes.append(bytes(view))
+            view.release()
+        frame.planes = planes
+        return frame
+
+    def close(self):
+        """Chiude il file mappato; i piani dei frame letti vengono rilasciati"""
+        for view in self._exported:
+            view.release()
+        self._exported = []
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Restano viste create dal chiamante sui piani: la mappatura
+            # viene chiusa quando vengono raccolte
+            pass
+        self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _file_state(path):
+    """Identità di una risorsa su file: percorso, mtime e dimensione"""
+    path = os.fspath(path)
+    st = os.stat(path)
+    return ('file', path, st.st_mtime_ns, st.st_size)
+
+
+_SCALAR_TYPES = frozenset((type(None), bool, int, float, str))
+
+
+def _state_value(value):
+    """
+    Rappresentazione stabile (anche tra riavvii) di un attributo di un widget
+
+    Raises:
+        TypeError: per valori senza una rappresentazione stabile (iteratori, oggetti generici)
+    """
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return ('bytes', hashlib.blake2b(value, digest_size=16).hexdigest())
+    if isinstance(value, (list, tuple)):
+        if set(map(type, value)) <= _SCALAR_TYPES:
+            # Serie di numeri o stringhe (es. dati dei grafici): un solo repr, senza ricorsione
+            return ('seq', hashlib.blake2b(repr(tuple(value)).encode(), digest_size=16).hexdigest())
+        return tuple(_state_value(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((repr(k), _state_value(v)) for k, v in value.items()))
+    if isinstance(value, Image.Image):
+        return (value.mode, value.size, hashlib.blake2b(value.tobytes(), digest_size=16).hexdigest())
+    if hasattr(value, 'getmask'):
+        return _font_state(value)
+    if isinstance(getattr(value, 'path', None), (str, os.PathLike)):
+        # Risorse su file (es. IconAtlas)
+        return (type(value).__name__, _file_state(value.path))
+    raise TypeError(f"{type(value).__name__} non ha una rappresentazione stabile per l'impronta")
+
+
+def _widget_state(widget, fonts):
+    """Tipo e attributi (in forma stabile) di un widget"""
+    state = []
+    for name, value in sorted(widget._state(fonts).items()):
+        try:
+            state.append((name, _state_value(value)))
+        except TypeError as e:
+            raise TypeError(f"{type(widget).__name__}.{name}: {e}") from None
+    return (type(widget).__name__, tuple(state))
+
+
+def _font_state(font):
+    path = getattr(font, 'path', None)
+    if not isinstance(path, str):
+        # Font caricati da memoria (es. load_default): nome e stile
+        path = font.getname() if hasattr(font, 'getname') else type(font).__name__
+    return (path, getattr(font, 'size', None))
+
+
+class FrameCache:
+    """
+    Cache di frame renderizzati, indicizzata dallo stato completo della schermata
+
+    L'impronta comprende tipo, dimensioni, sfondo e font del canvas, la
+    rotazione e gli attributi pubblici di ogni widget, in ordine; le risorse
+    su file contano con mtime e dimensione, le tabelle solo con le righe
+    visibili. Gli attributi senza una rappresentazione stabile (iteratori,
+    oggetti generici) fanno fallire fingerprint() con TypeError. Se la
+    schermata è già stata renderizzata si ottiene il frame senza disegnare
+    nulla. In memoria i frame sono tenuti in LRU fino a max_bytes; con path
+    vengono anche salvati su disco (un file di frame per schermata) e
+    sopravvivono ai riavvii. Su disco i file restano entro max_disk_bytes:
+    oltre si eliminano quelli usati meno di recente (per mtime, aggiornato a
+    ogni lettura).
+
+    Example:
+        cache = FrameCache(max_bytes=2 * 1024 * 1024, path='/var/cache/eink')
+        frame = cache.render(canvas, [Text(10, 10, "ALLARME"), SVGIcon(...)], rotation=270)
+        frame.push(epd)
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, path=None, max_disk_bytes=64 * 1024 * 1024):
         """
         Args:
-            x, y: posizione
-            width, height: dimensioni
-            data: lista di valori numerici
-            min_val, max_val: range valori (None per auto)
+            max_bytes: dimensione massima dei frame tenuti in memoria
+            path: directory per i frame persistenti (None = solo memoria)
+            max_disk_bytes: dimensione massima dei file di frame in path
         """
-        super().__init__(x, y)
-        self.width = width
-        self.height = height
-        self.data = data
-        self.min_val = min_val if min_val is not None else min(data) if data else 0
-        self.max_val = max_val if max_val is not None else max(data) if data else 100
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        # Impronta -> dimensione dei file su disco, dal meno recente
+        self._disk = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._scan_disk()
 
-    def draw(self, draw, image, fonts):
-        if not self.data or len(self.data) < 2:
-            return
+    def _scan_disk(self):
+        """Ricostruisce l'elenco dei file già presenti (es. dopo un riavvio), per mtime"""
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.frames'):
+                st = os.stat(os.path.join(self.path, name))
+                files.append((st.st_mtime, name[:-len('.frames')], st.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self.disk_bytes += size
+        self._evict_disk()
 
-        # Bordo
-        draw.rectangle(
-            (self.x, self.y, self.x + self.width, self.y + self.height),
-            outline=0, fill=255
+    @staticmethod
+    def fingerprint(canvas, widgets, rotation=0):
+        """Impronta (stringa esadecimale) dello stato di una schermata"""
+        state = (
+            type(canvas).__name__, canvas.width, canvas.height, repr(canvas.background), rotation,
+            getattr(canvas, 'inks', None), getattr(canvas, 'dither', None),
+            tuple(sorted((name, _font_state(font)) for name, font in canvas.fonts.items())),
+            tuple(_widget_state(w, canvas.fonts) for w in widgets),
         )
+        return hashlib.blake2b(repr(state).encode(), digest_size=16).hexdigest()
 
-        # Normalizza i dati
-        value_range = self.max_val - self.min_val
-        if value_range == 0:
-            return
-
-        # Calcola i punti
-        points = []
-        step = (self.width - 4) / (len(self.data) - 1)
-
-        for i, val in enumerate(self.data):
-            px = self.x + 2 + int(i * step)
-            normalized = (val - self.min_val) / value_range
-            py = self.y + self.height - 2 - int(normalized * (self.height - 4))
-            points.append((px, py))
+    def _file(self, key):
+        return os.path.join(self.path, key + '.frames')
 
-        # Disegna la linea
-        if len(points) >= 2:
-            draw.line(points, fill=0, width=2)
+    def get(self, key):
+        """Frame per un'impronta, None se non è in cache"""
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                return frame
+        if self.path and os.path.exists(self._file(key)):
+            with FrameArchive(self._file(key), verify=True) as archive:
+                frame = archive.copy(0)
+            self._remember(key, frame)
+            # L'mtime segna l'ultimo uso: il file non sarà tra i primi eliminati
+            os.utime(self._file(key))
+            self._remember_disk(key, os.path.getsize(self._file(key)))
+            return frame
+        return None
 
+    def put(self, key, frame):
+        """Aggiunge un frame alla cache (e al disco se c'è una directory)"""
+        self._remember(key, frame)
+        if self.path:
+            tmp = self._file(key) + '.tmp'
+            save_frames(tmp, [frame])
+            os.replace(tmp, self._file(key))
+            self._remember_disk(key, os.path.getsize(self._file(key)))
 
-class HorizontalLayout:
-    """Layout helper per disporre widget orizzontalmente"""
+    def _remember_disk(self, key, size):
+        with self._lock:
+            self.disk_bytes += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            self._evict_disk()
 
-    def __init__(self, x, y, spacing=10):
-        self.x = x
-        self.y = y
-        self.spacing = spacing
-        self.current_x = x
+    def _evict_disk(self):
+        """Elimina i file meno recenti oltre max_disk_bytes (l'ultimo scritto resta comunque)"""
+        while self.disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            key, size = self._disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
 
-    def add(self, widget, width=None):
-        """Aggiunge un widget al layout"""
-        widget.x = self.current_x
-        widget.y = self.y
-        if width:
-            self.current_x += width + self.spacing
-        elif hasattr(widget, 'width'):
-            self.current_x += widget.width + self.spacing
-        return widget
+    def _remember(self, key, frame):
+        size = sum(len(p) for p in frame.planes)
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self.bytes -= sum(len(p) for p in old.planes)
+            self._frames[key] = frame
+            self.bytes += size
+            # Evizione LRU per dimensione (l'ultimo frame inserito resta comunque)
+            while self.bytes > self.max_bytes and len(self._frames) > 1:
+                _, evicted = self._frames.popitem(last=False)
+                self.bytes -= sum(len(p) for p in evicted.planes)
 
+    def render(self, canvas, widgets, rotation=0):
+        """
+        Frame della schermata descritta dai widget, disegnandola solo se non è in cache
 
-class VerticalLayout:
-    """Layout helper per disporre widget verticalmente"""
+        Il canvas viene usato solo per i miss (viene pulito e ridisegnato): in
+        caso di hit il suo contenuto non cambia.
 
-    def __init__(self, x, y, spacing=10):
-        self.x = x
-        self.y = y
-        self.spacing = spacing
-        self.current_y = y
+        Returns:
+            Frame pronto per Frame.push()
+        """
+        key = self.fingerprint(canvas, widgets, rotation)
+        frame = self.get(key)
+        if frame is not None:
+            self.hits += 1
+            return frame
+        self.misses += 1
+        canvas.clear(canvas.background)
+        for widget in widgets:
+            canvas.add_widget(widget)
+        frame = Frame.from_canvas(canvas, rotation)
+        frame.planes = [bytes(p) for p in frame.planes]
+        self.put(key, frame)
+        return frame
 
-    def add(self, widget, height=None):
-        """Aggiunge un widget al layout"""
-        widget.x = self.x
-        widget.y = self.current_y
-        if height:
-            self.current_y += height + self.spacing
-        elif hasattr(widget, 'height'):
-            self.current_y += widget.height + self.spacing
-        return widget
+    def clear(self):
+        """Svuota la cache in memoria e su disco"""
+        with self._lock:
+            self._frames.clear()
+            self.bytes = 0
+            self._disk.clear()
+            self.disk_bytes = 0
+        if self.path:
+            for name in os.listdir(self.path):
+                if name.endswith('.frames'):
+                    os.remove(os.path.join(self.path, name))
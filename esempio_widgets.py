@@ -32,7 +32,7 @@ def esempio_dashboard():
 
     # ===== HEADER: Titolo e data =====
     canvas.add_widget(Text(10, 5, "Dashboard", font_size='large', fill=0))
-    canvas.add_widget(Text(160, 10, time.strftime("%H:%M"), font_size='medium'))
+    canvas.add_widget(Clock(160, 10, '%H:%M', font_size='medium'))
 
     # ===== ICONA SVG =====
     svg_sun = """
@@ -151,32 +151,32 @@ def esempio_aggiornamento_parziale():
     WIDTH = epd.height
     HEIGHT = epd.width
 
-    # Primo refresh completo
+    # Widget creati una sola volta e collegati al livello
+    livello = DataSource(0)
+
     canvas = EinkCanvas(WIDTH, HEIGHT, picdir)
     canvas.add_widget(Text(10, 10, "Livello Acqua", font_size='large'))
     canvas.add_widget(Text(10, 35, "Monitoraggio in tempo reale", font_size='small'))
 
+    # Barra progressiva
+    canvas.add_widget(NotchBar(10, 60, 15, 50, level=0, num_notches=5).bind('level', livello))
+    canvas.add_widget(Text(35, 85, "", font_size='xlarge').bind('text', livello, lambda v: f"{v}%"))
+
+    # Progress bar orizzontale
+    canvas.add_widget(ProgressBar(10, 100, 150, 15, progress=0).bind('progress', livello))
+
+    # Primo refresh completo
     rotated = canvas.get_image().rotate(180)
     epd.display(epd.getbuffer(rotated))
     epd.displayPartBaseImage(epd.getbuffer(rotated))
 
-    # Aggiornamenti parziali
-    for level in range(0, 101, 10):
-        canvas.clear()
-
-        canvas.add_widget(Text(10, 10, "Livello Acqua", font_size='large'))
-        canvas.add_widget(Text(10, 35, "Monitoraggio in tempo reale", font_size='small'))
-
-        # Barra progressiva
-        canvas.add_widget(NotchBar(10, 60, 15, 50, level=level, num_notches=5))
-        canvas.add_widget(Text(35, 85, f"{level}%", font_size='xlarge'))
-
-        # Progress bar orizzontale
-        canvas.add_widget(ProgressBar(10, 100, 150, 15, progress=level))
-
-        rotated = canvas.get_image().rotate(180)
-        epd.displayPartial(epd.getbuffer(rotated))
-        time.sleep(0.5)
+    # Animazione del livello da 0 a 100 in 5 secondi a 2 frame al secondo:
+    # vengono ridisegnati solo i widget collegati al livello e, se il refresh
+    # è più lento, i frame intermedi vengono saltati
+    animazione = Animation(canvas, epd, fps=2, rotation=270)
+    animazione.add(livello, None, 100, duration=5, easing=ease_linear)
+    stats = animazione.run()
+    print(f"{stats.achieved_fps:.1f} fps, {stats.dropped} frame saltati")
 
     time.sleep(2)
     epd.sleep()
@@ -199,7 +199,7 @@ def esempio_completo():
 
     # COLONNA 1: Info generali
     canvas.add_widget(Text(5, 5, time.strftime("%d/%m"), font_size='small'))
-    canvas.add_widget(Text(5, 20, time.strftime("%H:%M"), font_size='medium'))
+    canvas.add_widget(Clock(5, 20, '%H:%M', font_size='medium'))
     canvas.add_widget(Text(5, 45, "22°", font_size='large'))
 
     # Separatore verticale
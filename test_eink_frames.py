@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Test dei file di frame (FrameArchive) e della cache delle schermate
+
+Uso:
+    python3 -m pytest -q
+"""
+
+import os
+
+import pytest
+
+from eink_widgets import EinkCanvas, Frame, FrameArchive, FrameCache, Text, save_frames
+
+
+def _frames(count=3):
+    canvas = EinkCanvas(250, 122)
+    frames = []
+    for i in range(count):
+        canvas.clear()
+        canvas.add_widget(Text(10, 10, f"Schermata {i}", font_size='large'))
+        frames.append(Frame.from_canvas(canvas))
+    return frames
+
+
+def test_archive_close_with_live_frame(tmp_path):
+    path = str(tmp_path / 'schermate.frames')
+    frames = _frames()
+    save_frames(path, frames)
+
+    with FrameArchive(path, verify=True) as archive:
+        live = archive[1]
+        kept = archive.copy(2)
+        assert bytes(live.planes[0]) == bytes(frames[1].planes[0])
+
+    # I piani mappati sono rilasciati, le copie restano valide
+    with pytest.raises(ValueError):
+        bytes(live.planes[0])
+    assert kept.planes[0] == bytes(frames[2].planes[0])
+
+
+def test_archive_close_with_caller_views(tmp_path):
+    path = str(tmp_path / 'schermate.frames')
+    save_frames(path, _frames(1))
+    archive = FrameArchive(path)
+    view = memoryview(archive[0].planes[0])[:10]
+    archive.close()
+    assert len(bytes(view)) == 10
+
+
+def _screen(i):
+    return [Text(10, 10, f"Schermata {i}", font_size='large')]
+
+
+def _frame_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith('.frames'))
+
+
+def test_frame_cache_hit_and_miss():
+    canvas = EinkCanvas(250, 122)
+    cache = FrameCache()
+    first = cache.render(canvas, _screen(0))
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.render(canvas, _screen(0)) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.render(canvas, _screen(1))
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_frame_cache_memory_eviction():
+    canvas = EinkCanvas(250, 122)
+    size = len(Frame.from_canvas(canvas).planes[0])
+    cache = FrameCache(max_bytes=2 * size)
+    for i in range(3):
+        cache.render(canvas, _screen(i))
+    assert cache.bytes == 2 * size
+    # La schermata meno recente è stata eliminata e va ridisegnata
+    cache.render(canvas, _screen(0))
+    assert (cache.hits, cache.misses) == (0, 4)
+
+
+def test_frame_cache_reload_from_disk(tmp_path):
+    canvas = EinkCanvas(250, 122)
+    frame = FrameCache(path=str(tmp_path)).render(canvas, _screen(0))
+
+    # Una cache nuova (es. dopo un riavvio) trova il frame su disco
+    cache = FrameCache(path=str(tmp_path))
+    assert cache.disk_bytes == os.path.getsize(tmp_path / _frame_files(tmp_path)[0])
+    reloaded = cache.render(canvas, _screen(0))
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert reloaded.planes == [bytes(p) for p in frame.planes]
+
+
+def test_frame_cache_disk_eviction(tmp_path):
+    canvas = EinkCanvas(250, 122)
+    path = str(tmp_path)
+    cache = FrameCache(max_bytes=0, path=path)
+    cache.render(canvas, _screen(0))
+    file_size = cache.disk_bytes
+    cache.max_disk_bytes = 2 * file_size
+    keys = [FrameCache.fingerprint(canvas, _screen(i)) for i in range(4)]
+
+    cache.render(canvas, _screen(1))
+    # Rileggere la schermata 0 dal disco la rende la più recente
+    assert cache.render(canvas, _screen(0)) is not None
+    cache.render(canvas, _screen(2))
+    assert _frame_files(path) == sorted(k + '.frames' for k in (keys[0], keys[2]))
+    assert cache.disk_bytes == 2 * file_size
+
+    # Anche all'avvio la directory viene riportata entro il limite, per mtime
+    cache.render(canvas, _screen(3))
+    mtime = os.path.getmtime(os.path.join(path, keys[2] + '.frames'))
+    os.utime(os.path.join(path, keys[3] + '.frames'), (mtime - 10, mtime - 10))
+    restarted = FrameCache(path=path, max_disk_bytes=file_size)
+    assert _frame_files(path) == [keys[2] + '.frames']
+    assert restarted.disk_bytes == file_size
+
+    restarted.clear()
+    assert _frame_files(path) == [] and restarted.disk_bytes == 0
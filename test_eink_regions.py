@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Test del ridisegno parziale: update(), render_region() e draw_clipped()
+
+Uso:
+    python3 -m pytest -q
+"""
+
+from PIL import Image, ImageDraw
+import pytest
+
+import eink_widgets
+from eink_widgets import *
+
+
+ROWS = [(f"A{i:03d}", f"Articolo {i}", i * 7 % 100) for i in range(200)]
+
+
+def _widgets(state):
+    """Schermata di prova, con widget sovrapposti, nello stato indicato"""
+    return [
+        Box(0, 0, 249, 121, fill=255),
+        Text(10, 5, state['title'], font_size='large'),
+        ProgressBar(10, 40, 120, 12, progress=state['progress']),
+        StatusBox(140, 38, 50, 18, "ON", is_active=state['active'], font_size='small'),
+        NotchBar(235, 0, 10, 120, level=state['progress']),
+        DonutChart(150, 60, 60, state['donut']),
+        LineChart(10, 60, 130, 60, [state['series']]),
+        Line(0, state['line_y'], 249, state['line_y']),
+        Table(140, 60, 90, 60, ROWS, first_row=state['first_row']),
+    ]
+
+
+BEFORE = {'title': "Serra", 'progress': 20, 'active': False, 'donut': [1, 2, 3],
+          'series': [1, 3, 2, 5, 4], 'line_y': 30, 'first_row': 0}
+AFTER = {'title': "Serra 2", 'progress': 75, 'active': True, 'donut': [3, 1, 1],
+         'series': [2, 2, 6, 1, 3], 'line_y': 34, 'first_row': 12}
+
+
+def _full_redraw(canvas_type, state):
+    canvas = canvas_type(250, 122)
+    for widget in _widgets(state):
+        canvas.add_widget(widget)
+    return canvas
+
+
+@pytest.mark.parametrize('canvas_type', [EinkCanvas, TiledCanvas, GrayCanvas, ColorCanvas])
+def test_update_matches_full_redraw(canvas_type):
+    canvas = canvas_type(250, 122)
+    widgets = _widgets(BEFORE)
+    for widget in widgets:
+        canvas.add_widget(widget)
+
+    # Stesse modifiche di AFTER, fatte con set() e move_to()
+    title, progress, status, notches, donut, chart, line, table = widgets[1:]
+    title.set('text', AFTER['title'])
+    progress.set('progress', AFTER['progress'])
+    status.set('is_active', AFTER['active'])
+    notches.set('level', AFTER['progress'])
+    donut.set('data', AFTER['donut'])
+    chart.set('series', [AFTER['series']])
+    line.move_to(0, AFTER['line_y'])
+    table.set('first_row', AFTER['first_row'])
+    assert canvas.update() is not None
+
+    assert canvas.get_image().tobytes() == _full_redraw(canvas_type, AFTER).get_image().tobytes()
+
+
+@pytest.mark.parametrize('region', [(0, 0, 250, 122), (13, 7, 151, 93), (200, 50, 260, 130), (0, 0, 1, 1)])
+def test_render_region_matches_full_redraw(region):
+    canvas = _full_redraw(EinkCanvas, BEFORE)
+    reference = canvas.get_image().tobytes()
+    # Area sporcata a mano (x1/y1 esclusi): render_region deve ridisegnarla identica
+    x0, y0, x1, y1 = region
+    canvas.draw.rectangle((x0, y0, x1 - 1, y1 - 1), fill=0)
+    assert canvas.render_region(region) is not None
+    assert canvas.get_image().tobytes() == reference
+
+
+def test_update_without_changes_draws_nothing():
+    canvas = _full_redraw(EinkCanvas, BEFORE)
+    assert canvas.update() is None
+
+
+def _svg_widget():
+    if eink_widgets.cairosvg is None:
+        pytest.skip("cairosvg non disponibile")
+    return SVG(30, 20, '<svg xmlns="http://www.w3.org/2000/svg" width="80" height="60">'
+                       '<circle cx="40" cy="30" r="25" fill="black"/></svg>')
+
+
+CLIPPED_WIDGETS = {
+    'text': lambda: Text(20, 30, "Temperatura 21.5°", font_size='large'),
+    'svg': _svg_widget,
+    'donut': lambda: DonutChart(80, 60, 90, [3, 1, 2, 5]),
+    'graph': lambda: SimpleGraph(15, 20, 200, 80, [2, 9, 4, 7, 1, 8, 3, 6]),
+}
+
+
+@pytest.mark.parametrize('clip', [(0, 0, 250, 122), (40, 35, 120, 70), (100, 0, 250, 50), (0, 90, 60, 122)])
+@pytest.mark.parametrize('name', sorted(CLIPPED_WIDGETS))
+def test_draw_clipped_matches_draw_inside_clip(name, clip):
+    widget = CLIPPED_WIDGETS[name]()
+    fonts = EinkCanvas(250, 122).fonts
+    full = Image.new('1', (250, 122), 255)
+    widget.draw(ImageDraw.Draw(full), full, fonts)
+    clipped = Image.new('1', (250, 122), 255)
+    widget.draw_clipped(ImageDraw.Draw(clipped), clipped, fonts, clip)
+    # Dentro il clip i pixel sono identici a draw(), fuori possono mancare
+    assert clipped.crop(clip).tobytes() == full.crop(clip).tobytes()
+
+
+def test_render_region_skips_widgets_outside_region():
+    canvas = EinkCanvas(250, 122)
+    inside, outside = Box(10, 10, 40, 30, fill=0), Box(180, 80, 40, 30, fill=0)
+    canvas.add_widget(inside)
+    canvas.add_widget(outside)
+    drawn = []
+    for widget in (inside, outside):
+        widget.draw_clipped = lambda *args, widget=widget: drawn.append(widget)
+
+    assert canvas.render_region((0, 0, 100, 60)) == (0, 0, 100, 60)
+    assert drawn == [inside]
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Test della validazione delle richieste del server di rendering
+
+Uso:
+    python3 -m pytest -q
+"""
+
+import pytest
+
+from eink_render_server import create_widget, RenderError, MAX_WIDGET_SIZE
+
+
+@pytest.mark.parametrize('spec', [
+    {'type': 'DonutChart', 'x': 0, 'y': 0, 'diameter': 20000, 'data': [1, 2]},
+    {'type': 'Box', 'x': 0, 'y': 0, 'width': MAX_WIDGET_SIZE + 1, 'height': 10},
+    {'type': 'Paragraph', 'x': 0, 'y': 0, 'width': 10 ** 9, 'text': "Ciao"},
+    {'type': 'SVGIcon', 'x': 0, 'y': 0, 'svg_string': "<svg/>", 'size': [48, 100000]},
+    {'type': 'Line', 'x1': 0, 'y1': 0, 'x2': -10 ** 6, 'y2': 0},
+    {'type': 'Text', 'x': float('inf'), 'y': 0, 'text': "Ciao"},
+    {'type': 'NotchBar', 'x': 0, 'y': 0, 'width': 10, 'height': 100, 'level': 50, 'num_notches': 10 ** 7},
+])
+def test_widget_geometry_is_bounded(spec):
+    with pytest.raises(RenderError):
+        create_widget(spec)
+
+
+def test_widget_geometry_within_bounds():
+    widget = create_widget({'type': 'Box', 'x': -MAX_WIDGET_SIZE, 'y': 0,
+                            'width': MAX_WIDGET_SIZE, 'height': 10})
+    assert (widget.width, widget.height) == (MAX_WIDGET_SIZE, 10)
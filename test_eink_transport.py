@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Test della codifica delta dei frame e del trasporto server/client
+
+Uso:
+    python3 -m pytest -q
+"""
+
+import time
+
+import pytest
+
+from eink_widgets import EinkCanvas, Text, ProgressBar
+from eink_transport import (FrameEncoder, FrameDecoder, FrameServer, FrameClient, KEYFRAME, DELTA,
+                            rle_encode, rle_decode, xor_bytes)
+
+
+def _frames(count=12, width=250, height=122):
+    canvas = EinkCanvas(width, height)
+    frames = []
+    for minute in range(count):
+        canvas.clear()
+        canvas.add_widget(Text(10, 10, f"12:{minute:02d}", font_size='large'))
+        canvas.add_widget(ProgressBar(10, 60, 200, 14, progress=minute * 8))
+        frames.append(bytes(canvas.get_buffer()))
+    return frames
+
+
+@pytest.mark.parametrize('keyframe_interval', [0, 1, 5])
+def test_delta_round_trip(keyframe_interval):
+    frames = _frames()
+    encoder = FrameEncoder(keyframe_interval=keyframe_interval)
+    decoder = FrameDecoder()
+    kinds = []
+    for frame in frames:
+        packet = encoder.encode(frame)
+        kinds.append(packet[2])
+        assert decoder.decode(packet) == frame
+
+    assert kinds[0] == KEYFRAME
+    if keyframe_interval:
+        assert kinds == [KEYFRAME if i % keyframe_interval == 0 else DELTA for i in range(len(frames))]
+    else:
+        assert set(kinds[1:]) == {DELTA}
+
+
+def test_delta_round_trip_size_change_and_reset():
+    small, large = _frames(3), _frames(3, 400, 300)
+    encoder = FrameEncoder()
+    decoder = FrameDecoder()
+    for frame in small + large:
+        assert decoder.decode(encoder.encode(frame)) == frame
+
+    # Dopo reset() il frame successivo è completo, anche per un decoder nuovo
+    encoder.reset()
+    packet = encoder.encode(large[0])
+    assert packet[2] == KEYFRAME
+    assert FrameDecoder().decode(packet) == large[0]
+
+
+def test_delta_without_reference_is_rejected():
+    frames = _frames(3)
+    encoder = FrameEncoder()
+    encoder.encode(frames[0])
+    with pytest.raises(ValueError):
+        FrameDecoder().decode(encoder.encode(frames[1]))
+
+
+@pytest.mark.parametrize('data', [b'', b'\x00' * 40, b'\x07' * 40, b'\x00\x00\x05\x00\x09\x09\x00', b'\x01' + b'\x00' * 30])
+def test_rle_round_trip(data):
+    assert rle_decode(rle_encode(data), len(data)) == data
+
+
+def test_xor_bytes_rejects_different_lengths():
+    with pytest.raises(ValueError):
+        xor_bytes(b'\x00' * 4, b'\x00' * 5)
+
+
+class _RecordingDisplay:
+    def __init__(self):
+        self.calls = []
+
+    def display(self, frame):
+        self.calls.append(('display', frame))
+
+    def displayPartial(self, frame):
+        self.calls.append(('displayPartial', frame))
+
+
+def _wait_for_client(server, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while server.client_count == 0:
+        assert time.monotonic() < deadline, "il client non si è collegato"
+        time.sleep(0.01)
+
+
+def test_loopback_server_client():
+    frames = _frames(6)
+    display = _RecordingDisplay()
+    server = FrameServer(queue_size=len(frames))
+    try:
+        client = FrameClient(*server.address, epd=display, partial=True)
+        _wait_for_client(server)
+        # Un frame alla volta: nessun frame intermedio viene scartato
+        for frame in frames:
+            server.send(frame)
+            assert client.receive() == frame
+        assert server.frames_dropped == 0
+        assert client.frames_received == len(frames)
+        assert client.bytes_received < sum(map(len, frames))
+    finally:
+        server.close()
+
+    # A server chiuso il client riceve la fine della connessione
+    assert client.receive() is None
+    client.close()
+    assert [call[0] for call in display.calls] == ['display'] + ['displayPartial'] * (len(frames) - 1)
+    assert [call[1] for call in display.calls] == frames
+
+
+def test_late_client_receives_last_frame_as_keyframe():
+    frames = _frames(3)
+    server = FrameServer()
+    try:
+        for frame in frames:
+            server.send(frame)
+        client = FrameClient(*server.address)
+        assert client.receive() == frames[-1]
+        client.close()
+    finally:
+        server.close()
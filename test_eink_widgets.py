@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Test del canvas: rendering parallelo e a tile, allocazioni a regime e widget
+
+Uso:
+    python3 -m pytest -q
+"""
+
+import pytest
+
+from eink_widgets import *
+
+
+ROWS = [(f"A{i:03d}", f"Articolo {i}", i * 7 % 100) for i in range(200)]
+
+
+def _random_widgets(seed, count=10):
+    """Widget casuali, anche in parte fuori dal canvas (linee larghe, grafici, testo)"""
+    import random
+    rnd = random.Random(seed)
+    widgets = []
+    for _ in range(count):
+        x, y = rnd.randrange(-40, 240), rnd.randrange(-30, 115)
+        width, height = rnd.randrange(5, 120), rnd.randrange(5, 60)
+        widgets.append(rnd.choice([
+            lambda: SimpleGraph(x, y, width, height, [rnd.uniform(0, 10) for _ in range(rnd.randrange(2, 12))]),
+            lambda: ProgressBar(x, y, width, height, rnd.randrange(101)),
+            lambda: Box(x, y, width, height, fill=rnd.choice([0, 255]), outline_width=rnd.randrange(1, 4)),
+            lambda: Line(x, y, x + rnd.randrange(-80, 80), y + rnd.randrange(-60, 60), width=rnd.randrange(1, 6)),
+            lambda: Text(x, y, f"Ciao {rnd.randrange(1000)}", font_size=rnd.choice(['small', 'large'])),
+            lambda: DonutChart(x, y, rnd.randrange(10, 70), [1, 2, 3]),
+        ])())
+    return widgets
+
+
+# Tra i seed ci sono casi che davano pixel diversi (41, 170, 231, 232); None è
+# un grafico con linee larghe fuori dal bordo sinistro
+@pytest.mark.parametrize('seed', [None, *range(1, 25), 41, 170, 231, 232])
+def test_parallel_and_tiled_match_serial(seed):
+    def widgets():
+        if seed is None:
+            return [SimpleGraph(-6, 5, 80, 40, [2, 0, 7, 3, 1, 6, 9, 9]), ProgressBar(121, 35, 80, 12, 87)]
+        return _random_widgets(seed)
+
+    serial = EinkCanvas(250, 122).add_widgets(widgets())
+    reference = serial.get_image().tobytes()
+    assert EinkCanvas(250, 122).add_widgets(widgets(), max_workers=4).get_image().tobytes() == reference
+
+    tiled = TiledCanvas(250, 122, tile_size=32, max_workers=2)
+    for widget in widgets():
+        tiled.add_widget(widget)
+    assert tiled.get_image().tobytes() == reference
+
+    for region in [(0, 0, 250, 122), (37, 23, 211, 101)]:
+        serial.render_region(region)
+        assert serial.get_image().tobytes() == reference
+
+
+def test_steady_state_allocations_flat(allocation_tracker):
+    width, height = 250, 122
+    canvas = EinkCanvas(width, height).enable_steady_state()
+    temperature = DataSource(20.0)
+    history = DataSource([18.0 + i for i in range(8)])
+    canvas.add_widget(Text(10, 5, "").bind('text', temperature, lambda t: f"{t:.1f}°"))
+    canvas.add_widget(ProgressBar(10, 40, 120, 12, 0).bind('progress', temperature, lambda t: int(t * 2) % 100))
+    canvas.add_widget(DonutChart(190, 60, 60, [1, 1, 1]).bind('data', temperature, lambda t: [t, 40 - t, 5]))
+    canvas.add_widget(LineChart(10, 60, 120, 60, [[]]).bind('series', history, lambda h: [h]))
+
+    for i in range(50):
+        # Valori che si ripetono: a regime le cache sono già piene
+        value = 18.0 + i % 8
+        temperature.set(value)
+        history.set(history.value[1:] + [value])
+        canvas.update()
+        canvas.get_buffer(rotation=270)
+        allocation_tracker.frame()
+    allocation_tracker.assert_flat(warmup=20)
+
+
+def _png(size=(40, 30)):
+    import io
+    from PIL import Image, ImageDraw
+    img = Image.new('L', size, 255)
+    ImageDraw.Draw(img).ellipse((5, 5, size[0] - 5, size[1] - 5), fill=0)
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def test_raster_bytes_hashed_once(monkeypatch):
+    import io
+    import eink_widgets
+    calls = []
+    key = eink_widgets._raster_source_key
+    monkeypatch.setattr(eink_widgets, '_raster_source_key', lambda source: calls.append(1) or key(source))
+
+    data = _png()
+    widget = RasterImage(0, 0, data, dither=False)
+    canvas = EinkCanvas(250, 122)
+    canvas.add_widget(widget)
+    for _ in range(3):
+        canvas.render_region((0, 0, 250, 122))
+    assert len(calls) == 1
+
+    # Un file aperto viene letto subito e dà la stessa immagine dei bytes
+    from_file = RasterImage(0, 0, io.BytesIO(data), dither=False)
+    assert from_file.source == data
+    assert from_file._image() is widget._image()
+    assert len(calls) == 2
+
+    widget.set('source', _png((50, 30)))
+    assert widget.get_bbox(canvas.fonts) == (0, 0, 50, 30)
+    assert len(calls) == 3
+
+
+def test_raster_rejects_unsupported_source():
+    with pytest.raises(TypeError):
+        RasterImage(0, 0, 42)
+    with pytest.raises(TypeError):
+        load_image(object())
+
+
+@pytest.mark.parametrize('fill, ink', [(0, 0), ('black', 0), ('red', 0), (255, 255), ('white', 255)])
+def test_table_palette_fill(fill, ink):
+    canvas = EinkCanvas(250, 122)
+    canvas.add_widget(Table(0, 0, 250, 122, ROWS, fill=fill))
+    reference = EinkCanvas(250, 122)
+    reference.add_widget(Table(0, 0, 250, 122, ROWS, fill=ink))
+    assert canvas.get_image().tobytes() == reference.get_image().tobytes()
+
+
+def test_table_row_cache_follows_align_and_widths():
+    def render(**changes):
+        canvas = EinkCanvas(250, 122)
+        canvas.add_widget(Table(0, 0, 250, 122, ROWS, **changes))
+        return canvas.get_image().tobytes()
+
+    canvas = EinkCanvas(250, 122)
+    table = Table(0, 0, 250, 122, ROWS)
+    canvas.add_widget(table)
+    table.set('align', ['right', 'center', 'right'])
+    canvas.update()
+    assert canvas.get_image().tobytes() == render(align=['right', 'center', 'right'])
+    table.set('col_widths', [60, 130, 60])
+    canvas.update()
+    assert canvas.get_image().tobytes() == render(align=['right', 'center', 'right'], col_widths=[60, 130, 60])
+
+
+def test_animation_achieved_fps_counts_intervals():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    canvas = EinkCanvas(250, 122)
+    bar = ProgressBar(10, 10, 150, 15, 0)
+    canvas.add_widget(bar)
+    animation = Animation(canvas, fps=10, clock=lambda: now[0], sleep=sleep)
+    animation.add(bar, 'progress', 100, duration=1.0, easing=ease_linear)
+    stats = animation.run()
+
+    # 1 s a 10 fps: 11 frame (t=0 e t=1 inclusi), cioè 10 intervalli
+    assert (stats.frames, stats.dropped, bar.progress) == (11, 0, 100)
+    assert stats.achieved_fps == pytest.approx(10.0)
+
+
+def test_marquee_rasterizes_message_once_per_text(monkeypatch):
+    from PIL import ImageDraw
+    calls = []
+    text = ImageDraw.ImageDraw.text
+    monkeypatch.setattr(ImageDraw.ImageDraw, 'text', lambda self, *a, **k: calls.append(a[1]) or text(self, *a, **k))
+
+    canvas = EinkCanvas(250, 122)
+    ticker = Marquee(0, 50, 200, 22, "Allerta meteo")
+    canvas.add_widget(ticker)
+    ticker.set('text', "Vento forte")
+    for _ in range(10):
+        ticker.step()
+        canvas.update()
+    assert calls == ["Allerta meteo", "Vento forte"]
+
+    reference = EinkCanvas(250, 122)
+    reference.add_widget(Marquee(0, 50, 200, 22, "Vento forte", offset=ticker.offset))
+    assert canvas.get_image().tobytes() == reference.get_image().tobytes()
+
+
+def test_marquee_colors_per_plane():
+    canvas = ColorCanvas(250, 122)
+    canvas.add_widget(Marquee(0, 50, 200, 22, "ALLARME", fill='red'))
+    assert canvas.planes['black'].getextrema() == (255, 255)
+    assert canvas.planes['red'].getextrema() == (0, 255)
+
+    canvas = ColorCanvas(250, 122)
+    canvas.add_widget(Marquee(0, 50, 200, 22, "ALLARME", fill='white', background='red'))
+    assert canvas.planes['black'].getextrema() == (255, 255)
+    assert canvas.planes['red'].getbbox() is not None
+
+
+def test_counter_invalidates_only_changed_digits():
+    canvas = EinkCanvas(250, 122)
+    counter = Counter(10, 40, "00042", font_size='xlarge')
+    canvas.add_widget(counter)
+    font = canvas.fonts['xlarge']
+    cells = counter._cells(font)
+    x0, y0, x1, y1 = counter.get_bbox(canvas.fonts)
+
+    counter.set('text', "00043")
+    left, width = cells[-1]
+    assert canvas.update() == (x0 + left, y0, x0 + left + width, y1)
+
+    reference = EinkCanvas(250, 122)
+    reference.add_widget(Counter(10, 40, "00043", font_size='xlarge'))
+    assert canvas.get_image().tobytes() == reference.get_image().tobytes()
+
+    # Cambia il numero di cifre: si ridisegna tutto il widget
+    counter.set('text', "100043")
+    assert canvas.update()[0] == x0
+    reference.clear()
+    reference.add_widget(Counter(10, 40, "100043", font_size='xlarge'))
+    assert canvas.get_image().tobytes() == reference.get_image().tobytes()
+
+
+def test_counter_colors_per_plane():
+    canvas = ColorCanvas(250, 122)
+    canvas.add_widget(Counter(10, 40, "12:34", fill='red'))
+    assert canvas.planes['black'].getextrema() == (255, 255)
+    assert canvas.planes['red'].getextrema() == (0, 255)
+
+    gray = GrayCanvas(250, 122)
+    gray.add_widget(Counter(10, 40, "12:34", fill=GRAY2, background=GRAY3))
+    assert {value for _, value in gray.get_image().getcolors()} == {GRAY2, GRAY3, 255}
+
+
+@pytest.fixture
+def ttf_path(tmp_path):
+    """Font TrueType per i test: pic/Font.ttc se c'è, altrimenti quello incorporato in Pillow"""
+    import os
+    from PIL import ImageFont
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pic', 'Font.ttc')
+    if os.path.exists(path):
+        return path
+    default = ImageFont.load_default(size=18)
+    if not isinstance(default, ImageFont.FreeTypeFont):
+        pytest.skip("Pillow senza FreeType")
+    path = tmp_path / 'default.ttf'
+    path.write_bytes(default.path.getvalue())
+    return str(path)
+
+
+@pytest.fixture
+def bitmap_font(ttf_path, tmp_path):
+    path = str(tmp_path / 'Font-18.ebf')
+    build_bitmap_font(ttf_path, path, 18)
+    font = BitmapFont(path)
+    yield font
+    font.close()
+
+
+def _text_image(font, text, anchor, xy=(60, 30)):
+    canvas = EinkCanvas(120, 60)
+    canvas.fonts['test'] = font
+    canvas.add_widget(Text(*xy, text, font='test', anchor=anchor))
+    return canvas.get_image().tobytes()
+
+
+ANCHORS = ['la', 'lt', 'lm', 'ls', 'lb', 'ld', 'ma', 'mm', 'ms', 'ra', 'rm', 'rd']
+
+
+def test_bitmap_font_round_trip(ttf_path, bitmap_font):
+    from PIL import ImageFont
+    ttf = ImageFont.truetype(ttf_path, 18)
+    assert not isinstance(bitmap_font, ImageFont.FreeTypeFont)
+    assert bitmap_font.getmetrics() == ttf.getmetrics()
+    # Ogni glifo salvato nel file è quello del TrueType disegnato in 1-bit
+    for ch in "0123456789:%ACgjy?":
+        assert bitmap_font.getbbox(ch, anchor='ls') == ttf.getbbox(ch, '1', anchor='ls')
+        assert _text_image(bitmap_font, ch, 'ls') == _text_image(ttf, ch, 'ls')
+
+
+@pytest.mark.parametrize('anchor', ANCHORS)
+def test_bitmap_font_anchors_match_truetype(ttf_path, bitmap_font, anchor):
+    from PIL import ImageFont
+    ttf = ImageFont.truetype(ttf_path, 18)
+    for text in ["8", "g", "A", "1\n88\nW"]:
+        if '\n' not in text:
+            assert bitmap_font.getbbox(text, anchor=anchor) == ttf.getbbox(text, '1', anchor=anchor)
+        elif anchor[1] in 'tb':
+            continue
+        # Anche a coordinate frazionarie (es. il centro di StatusBox)
+        for xy in [(60, 30), (60.5, 30.5), (60.25, 29.75), (-3.5, 10.5)]:
+            assert _text_image(bitmap_font, text, anchor, xy) == _text_image(ttf, text, anchor, xy)
+
+
+def test_bitmap_font_mask_modes(bitmap_font):
+    for mode in ('', '1', 'L'):
+        mask, offset = bitmap_font.getmask2("Ciao", mode, anchor='mm')
+        assert offset == bitmap_font.getbbox("Ciao", anchor='mm')[:2]
+    with pytest.raises(ValueError):
+        bitmap_font.getmask2("Ciao", 'RGBA')
+    with pytest.raises(ValueError):
+        bitmap_font.getmask2("Ciao", '1', stroke_width=1)
+
+
+def test_data_source_does_not_keep_cleared_widgets():
+    import gc
+    import weakref
+    canvas = EinkCanvas(250, 122)
+    level = DataSource(10)
+    kept = ProgressBar(10, 40, 120, 12, 0).bind('progress', level)
+    dropped = Text(10, 5, "").bind('text', level, str).bind('fill', level, lambda v: 0)
+    canvas.add_widget(kept)
+    canvas.add_widget(dropped)
+    ref = weakref.ref(dropped)
+
+    canvas.clear()
+    del dropped
+    gc.collect()
+    assert ref() is None
+    level.set(60)
+    assert kept.progress == 60
+
+    level.unbind(kept)
+    level.set(70)
+    assert kept.progress == 60
+
+
+def test_simple_graph_explicit_range_survives_new_data():
+    graph = SimpleGraph(0, 0, 100, 50, [5, 6, 7])
+    assert (graph.min_val, graph.max_val) == (5, 7)
+    graph.set('min_val', 0)
+    graph.set('data', [8, 9, 12])
+    assert (graph.min_val, graph.max_val) == (0, 12)
+
+    graph.set('max_val', 20)
+    graph.set('data', [1, 2])
+    assert (graph.min_val, graph.max_val) == (0, 20)
+
+    # None torna al range automatico
+    graph.set('min_val', None)
+    assert graph.min_val == 1
+    graph.set('data', [3, 4])
+    assert (graph.min_val, graph.max_val) == (3, 20)
+
+
+@pytest.mark.parametrize('size', [(250, 122), (203, 77), (64, 40)])
+@pytest.mark.parametrize('rotation', [90, 270])
+def test_tiled_rotation_matches_eink(size, rotation):
+    reference = EinkCanvas(*size)
+    tiled = TiledCanvas(*size, tile_size=32)
+    for canvas in (reference, tiled):
+        for widget in _random_widgets(7):
+            canvas.add_widget(widget)
+    expected = bytes(reference.get_buffer(rotation=rotation))
+    assert bytes(tiled.get_buffer(rotation=rotation)) == expected
+
+    # A regime il buffer ruotato viene riusato e aggiornato sul posto
+    tiled.enable_steady_state()
+    buf = tiled.get_buffer(rotation=rotation)
+    tiled.add_widget(Box(0, 0, 10, 10, fill=0))
+    reference.add_widget(Box(0, 0, 10, 10, fill=0))
+    assert tiled.get_buffer(rotation=rotation) is buf
+    assert bytes(buf) == bytes(reference.get_buffer(rotation=rotation))